@@ -5,22 +5,29 @@ def clean_csvs(input_folder, output_folder):
     # Make sure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    # Loop over all CSV files in the input folder
+    # Loop over all CSV and Parquet files in the input folder
     for filename in os.listdir(input_folder):
-        if filename.endswith(".csv"):
+        if filename.endswith(".csv") or filename.endswith(".parquet"):
             input_path = os.path.join(input_folder, filename)
             output_path = os.path.join(output_folder, filename)
 
-            # Read CSV
-            df = pd.read_csv(input_path)
+            # Read CSV, or Parquet written with --format parquet, where
+            #   -inf is already stored as a float
+            if filename.endswith(".parquet"):
+                df = pd.read_parquet(input_path)
+            else:
+                df = pd.read_csv(input_path)
 
             # Remove rows where uni_prob == -inf
             df_clean = df[df["uni_prob"] != "-inf"]
             # Also handle actual negative infinity values if stored as float
             df_clean = df_clean[df_clean["uni_prob"] != float("-inf")]
 
-            # Save cleaned CSV
-            df_clean.to_csv(output_path, index=False)
+            # Save cleaned file in the same format
+            if filename.endswith(".parquet"):
+                df_clean.to_parquet(output_path, index=False)
+            else:
+                df_clean.to_csv(output_path, index=False)
             print(f"Cleaned and saved: {output_path}")
 
 # Example usage:
@@ -1,21 +1,27 @@
 import os
+from collections import Counter
 
 def process_corpus(corpus):
     """
     Split each line into words, then:
-    - Add each unique word only once
+    - Count how often each unique word occurs
     - Format by inserting spaces between every character
+    Returns a list of (formatted word, token count) pairs, in the order the
+    words are first seen.
     """
-    processed_corpus = []
-    seen = set()  # faster than checking "if ... not in list"
+    counts = Counter()  # keeps first-seen order
     for line in corpus:
-        words = line.split()
-        for word in words:
-            formatted = ' '.join(word)
-            if formatted not in seen:
-                seen.add(formatted)
-                processed_corpus.append(formatted)
-    return processed_corpus
+        for word in line.split():
+            counts[word] += 1
+    return [(' '.join(word), count) for word, count in counts.items()]
+
+
+def format_token_counts(processed):
+    """
+    Lay out (formatted word, token count) pairs as the two-column
+    "word,freq" lines read by ngram_calculator.read_tokens.
+    """
+    return "\n".join(f"{word},{count}" for word, count in processed)
 
 
 def load_segmented_files(main_folder: str):
@@ -69,7 +75,7 @@ def format_and_save_all(all_corpora_path="./all_corpora",
             processed = process_corpus(corpus)
             out_file = os.path.join(out_dir, f"{key}.txt")
             with open(out_file, "w", encoding="utf-8") as f:
-                f.write("\n".join(processed))
+                f.write(format_token_counts(processed))
             print(f"  Saved {out_file}")
 
 
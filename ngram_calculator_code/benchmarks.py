@@ -0,0 +1,433 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import ngram_calculator
+
+# Data files are found relative to the root of the repository
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Number of times each benchmark is timed
+REPEAT = 5
+# A benchmark is a regression if its median time grows by more than this
+# fraction...
+THRESHOLD = 0.10
+# ...and by more than this many seconds, so timer noise on benchmarks that
+# take microseconds isn't reported
+MIN_SECONDS = 0.001
+# Share of each word length in formatted_corpora/PearlBrentWords, the default
+# length distribution of synthetic corpora
+DEFAULT_WORD_LENGTHS = {
+    1: 0.003, 2: 0.045, 3: 0.193, 4: 0.254, 5: 0.219, 6: 0.134, 7: 0.081,
+    8: 0.045, 9: 0.015, 10: 0.009, 11: 0.002
+}
+
+#####################
+# Synthetic corpora #
+#####################
+
+def synthetic_sounds(inventory_size):
+    """
+    Returns the symbols of a synthetic inventory, named so that they sort in
+    the order they were made: s00, s01, ...
+    """
+    width = len(str(max(inventory_size - 1, 0)))
+    return [f's{idx:0{width}d}' for idx in range(inventory_size)]
+
+def synthetic_corpus(num_tokens, inventory_size=40, word_lengths=None,
+                     sound_skew=1.0, with_freqs=False, seed=0):
+    """
+    Generates a random corpus directly in packed form, so corpora of millions
+    of tokens can be made in seconds. The same arguments always give the same
+    corpus.
+
+    num_tokens: The number of tokens.
+    inventory_size: The number of distinct sounds, not counting the word
+    boundary.
+    word_lengths: A dictionary mapping each word length to its relative
+    weight. Defaults to DEFAULT_WORD_LENGTHS.
+    sound_skew: The exponent of the Zipf distribution sounds are drawn from.
+    0 makes every sound equally likely.
+    with_freqs: If True, every token gets a Zipf-distributed frequency of at
+    least 1, otherwise every frequency is 0, as in the files without a
+    frequency column.
+    seed: The seed of the random number generator.
+
+    returns: A PackedCorpus.
+    """
+    rng = np.random.default_rng(seed)
+    inventory = ngram_calculator.SoundInventory(
+        synthetic_sounds(inventory_size)
+    )
+
+    word_lengths = word_lengths or DEFAULT_WORD_LENGTHS
+    choices = np.array(sorted(word_lengths), dtype=np.int64)
+    weights = np.array(
+        [word_lengths[length] for length in choices], dtype=np.float64
+    )
+    lengths = rng.choice(choices, size=num_tokens, p=weights / weights.sum())
+
+    sound_probs = 1 / np.arange(1, inventory_size + 1) ** sound_skew
+    sounds = rng.choice(
+        inventory_size, size=int(lengths.sum()),
+        p=sound_probs / sound_probs.sum()
+    )
+
+    offsets = np.zeros(num_tokens + 1, dtype=np.int64)
+    np.cumsum(lengths + 2, out=offsets[1:])
+    codes = np.full(offsets[-1], inventory.boundary, dtype=np.int32)
+    corpus = ngram_calculator.PackedCorpus(
+        inventory, codes, offsets, np.zeros(num_tokens)
+    )
+    # The symbols sort in the order they were made, so sound i has code i
+    codes[corpus.sound_mask()] = sounds
+    if with_freqs:
+        corpus.freqs = rng.zipf(2.0, num_tokens).astype(np.float64)
+    return corpus
+
+def write_corpus(corpus, path):
+    """
+    Writes a corpus in the format of the training files: one token per line,
+    as space-separated symbols, followed by its frequency if it has one.
+
+    corpus: A PackedCorpus.
+    path: The path of the file to write.
+
+    returns: None
+    """
+    with open(path, 'w') as f:
+        for word, freq in zip(corpus.words(), corpus.freqs.tolist()):
+            if freq:
+                f.write(f'{word},{freq:g}\n')
+            else:
+                f.write(word + '\n')
+
+#############
+# Scenarios #
+#############
+
+def real_scenario(train, tests):
+    """
+    Returns a function that loads a scenario from data files in the
+    repository, or None if any of them is missing.
+    """
+    paths = [os.path.join(REPO_ROOT, path) for path in [train] + tests]
+
+    def load(directory):
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        return paths[0], paths[1:]
+    return load
+
+def synthetic_scenario(num_tokens, num_test_tokens, **options):
+    """
+    Returns a function that generates a synthetic scenario and writes it to
+    temporary files, so reading is benchmarked on it too. The test tokens are
+    drawn with another seed from a slightly larger inventory, so some test
+    sounds are unseen in training as with real stimuli.
+    """
+    def load(directory):
+        train = os.path.join(directory, 'train.txt')
+        test = os.path.join(directory, 'test.txt')
+        write_corpus(synthetic_corpus(num_tokens, seed=0, **options), train)
+        test_options = dict(options)
+        test_options['inventory_size'] = options.get('inventory_size', 40) + 2
+        write_corpus(
+            synthetic_corpus(num_test_tokens, seed=1, **test_options), test
+        )
+        return train, [test]
+    return load
+
+INFANT_STIMULI = [
+    'infant_stim_formatted/infant_2a_stimuli_unigram_contrast.txt',
+    'infant_stim_formatted/infant_2b_stimuli_both_contrast.txt',
+    'infant_stim_formatted/infant_2c_stimuli_bigram_contrast.txt'
+]
+
+# Every scenario is a training file and the test files scored with it. Each
+# is loaded by a function that is given a scratch directory for any files it
+# has to write, and returns the paths of the files or None if they are
+# missing.
+SCENARIOS = {
+    'pearl_brent': real_scenario(
+        'formatted_corpora/PearlBrentWords/PearlBrentWords1.txt',
+        ['formatted_corpora/PearlBrentWords/PearlBrentWords2.txt']
+    ),
+    'incremental_sample': real_scenario(
+        'incremental_corpora_out_v2/PUDDLE/1.01625/sample0.txt',
+        ['infant_stim_formatted/infant_2b_stimuli_both_contrast.txt']
+    ),
+    'infant_stimuli': real_scenario(
+        'formatted_corpora/PearlBrentWords/PearlBrentWords1.txt',
+        INFANT_STIMULI
+    ),
+    'synthetic_100k': synthetic_scenario(100000, 10000),
+    'synthetic_freqs_100k': synthetic_scenario(
+        100000, 10000, with_freqs=True
+    ),
+    'synthetic_2m': synthetic_scenario(2000000, 100000),
+}
+# Scenarios run unless others are asked for. The largest one takes minutes.
+DEFAULT_SCENARIOS = [name for name in SCENARIOS if name != 'synthetic_2m']
+
+##############
+# Benchmarks #
+##############
+
+def time_call(function, repeat=REPEAT):
+    """
+    Times repeated calls of a function.
+
+    function: A function without arguments.
+    repeat: The number of calls.
+
+    returns: A list of the wall time of each call in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def scenario_benchmarks(train, tests):
+    """
+    Returns the benchmarks of one scenario: reading the corpora, counting
+    them, each family of fitters (every weighting and smoothing variant, as
+    fit_ngram_models runs them) and scoring the test sets.
+
+    train: The path to the training file.
+    tests: The paths to the test files.
+
+    returns: A list of tuples of the benchmark name, the number of tokens it
+    processes and a function without arguments that runs it.
+    """
+    corpus = ngram_calculator.read_corpus(train)
+    counts = ngram_calculator.count_ngrams(corpus)
+    models = counts.fitted_models()
+    test_corpora = [
+        ngram_calculator.read_corpus(test, corpus.inventory) for test in tests
+    ]
+    num_test_tokens = sum(len(test_corpus) for test_corpus in test_corpora)
+    variants = [(False, False), (True, False), (False, True), (True, True)]
+
+    return [
+        ('read', len(corpus), lambda: ngram_calculator.read_corpus(train)),
+        ('count_ngrams', len(corpus),
+         lambda: ngram_calculator.count_ngrams(corpus)),
+        ('fit_unigrams', len(corpus), lambda: [
+            ngram_calculator.fit_unigrams(counts, token_weighted)
+            for token_weighted in [False, True]
+        ]),
+        ('fit_bigrams', len(corpus), lambda: [
+            ngram_calculator.fit_bigrams(counts, token_weighted, smoothed)
+            for token_weighted, smoothed in variants
+        ]),
+        ('fit_positional_unigrams', len(corpus), lambda: [
+            ngram_calculator.fit_positional_unigrams(
+                counts, token_weighted, smoothed
+            )
+            for token_weighted, smoothed in variants
+        ]),
+        ('fit_positional_bigrams', len(corpus), lambda: [
+            ngram_calculator.fit_positional_bigrams(
+                counts, token_weighted, smoothed
+            )
+            for token_weighted, smoothed in variants
+        ]),
+        ('score_corpus', num_test_tokens, lambda: [
+            ngram_calculator.score_corpus(test_corpus, models)
+            for test_corpus in test_corpora
+        ]),
+    ]
+
+def run_benchmarks(scenarios=None, repeat=REPEAT, log=print):
+    """
+    Runs the benchmarks of some scenarios.
+
+    scenarios: The names of the scenarios to run. Defaults to
+    DEFAULT_SCENARIOS.
+    repeat: The number of times each benchmark is timed.
+    log: A function that progress messages are passed to.
+
+    returns: A dictionary with a description of the machine and a
+    'benchmarks' dictionary mapping "<scenario>/<benchmark>" to the number
+    of tokens and the minimum, median and individual times in seconds.
+    """
+    results = {}
+    for name in scenarios or DEFAULT_SCENARIOS:
+        with tempfile.TemporaryDirectory(prefix='ngram_benchmarks') as scratch:
+            loaded = SCENARIOS[name](scratch)
+            if loaded is None:
+                log(f"Skipping {name}: its data files are missing.")
+                continue
+            for benchmark, tokens, function in scenario_benchmarks(*loaded):
+                times = time_call(function, repeat)
+                key = f'{name}/{benchmark}'
+                results[key] = {
+                    'tokens': tokens,
+                    'min_s': min(times),
+                    'median_s': statistics.median(times),
+                    'times_s': times
+                }
+                log(f"{key}: {results[key]['median_s']:.4f}s ({tokens} tokens)")
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'repeat': repeat,
+        'benchmarks': results
+    }
+
+def compare(old, new, threshold=THRESHOLD, min_seconds=MIN_SECONDS):
+    """
+    Compares the median times of two benchmark runs.
+
+    old: The results of the baseline run, as returned by run_benchmarks.
+    new: The results of the run to check.
+    threshold: The fraction by which a median time has to grow to count as a
+    regression.
+    min_seconds: The number of seconds by which it also has to grow.
+
+    returns: A list of rows, one for each benchmark in both runs, with its
+    name, the old and new median times, their ratio and whether it is a
+    regression.
+    """
+    rows = []
+    for key, new_result in new['benchmarks'].items():
+        if key not in old['benchmarks']:
+            continue
+        old_time = old['benchmarks'][key]['median_s']
+        new_time = new_result['median_s']
+        ratio = new_time / old_time if old_time else float('inf')
+        regression = (
+            new_time > old_time * (1 + threshold)
+            and new_time - old_time > min_seconds
+        )
+        rows.append([key, old_time, new_time, ratio, regression])
+    return rows
+
+def _git_commit():
+    """
+    Returns the commit the benchmarks were run at, or None outside a git
+    checkout.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+            text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description = "Benchmark fitting and scoring the n-gram models."
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks.')
+    run_parser.add_argument(
+        '--out', type=str,
+        default=time.strftime('benchmarks-%Y%m%d-%H%M%S.json'),
+        help='Path of the JSON results file'
+    )
+    run_parser.add_argument(
+        '--scenarios', type=str, nargs='+', default=None,
+        choices=list(SCENARIOS),
+        help=f'Scenarios to run (default: {" ".join(DEFAULT_SCENARIOS)})'
+    )
+    run_parser.add_argument(
+        '--repeat', type=int, default=REPEAT,
+        help='Number of times each benchmark is timed'
+    )
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='Flag regressions between two benchmark runs.'
+    )
+    compare_parser.add_argument(
+        'old', type=str, help='Results of the baseline run'
+    )
+    compare_parser.add_argument(
+        'new', type=str, help='Results of the run to check'
+    )
+    compare_parser.add_argument(
+        '--threshold', type=float, default=THRESHOLD,
+        help='Fraction a median time has to grow by to be a regression'
+    )
+
+    generate_parser = subparsers.add_parser(
+        'generate', help='Write a synthetic corpus file.'
+    )
+    generate_parser.add_argument(
+        'output_file', type=str, help='Path of the corpus file'
+    )
+    generate_parser.add_argument(
+        '--tokens', type=int, default=100000, help='Number of tokens'
+    )
+    generate_parser.add_argument(
+        '--inventory-size', type=int, default=40, help='Number of sounds'
+    )
+    generate_parser.add_argument(
+        '--sound-skew', type=float, default=1.0,
+        help='Zipf exponent of the sound distribution (0 for uniform)'
+    )
+    generate_parser.add_argument(
+        '--word-lengths', type=str, default=None,
+        help='JSON object mapping word lengths to weights, e.g. '
+        '\'{"3": 1, "4": 2}\''
+    )
+    generate_parser.add_argument(
+        '--freqs', action='store_true',
+        help='Give every token a frequency'
+    )
+    generate_parser.add_argument(
+        '--seed', type=int, default=0, help='Random seed'
+    )
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmarks(args.scenarios, args.repeat)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.out}")
+    elif args.command == 'compare':
+        with open(args.old, 'r') as f:
+            old = json.load(f)
+        with open(args.new, 'r') as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        for key, old_time, new_time, ratio, regression in rows:
+            flag = 'REGRESSION' if regression else ''
+            print(
+                f"{key:45} {old_time:10.4f}s {new_time:10.4f}s "
+                f"{ratio:6.2f}x {flag}"
+            )
+        regressions = sum(row[-1] for row in rows)
+        print(f"{regressions} regressions in {len(rows)} benchmarks.")
+        sys.exit(1 if regressions else 0)
+    elif args.command == 'generate':
+        word_lengths = None
+        if args.word_lengths is not None:
+            word_lengths = {
+                int(length): weight
+                for length, weight in json.loads(args.word_lengths).items()
+            }
+        corpus = synthetic_corpus(
+            args.tokens, args.inventory_size, word_lengths, args.sound_skew,
+            args.freqs, args.seed
+        )
+        write_corpus(corpus, args.output_file)
+    else:
+        parser.print_help()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Suffix of the sidecar directory written next to each cached corpus file
+CACHE_SUFFIX = '.packed'
+# Version of the layout of the sidecar directory
+CACHE_FORMAT_VERSION = 1
+# Arrays stored in the sidecar, one .npy file each so they can be mmapped
+CACHE_ARRAYS = ['codes', 'offsets', 'freqs']
+
+def sidecar_path(dataset):
+    """
+    Returns the path of the sidecar directory that caches a corpus file.
+
+    dataset: The path to the corpus file.
+    """
+    return dataset + CACHE_SUFFIX
+
+def file_hash(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+
+    path: The path to the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load(dataset):
+    """
+    Loads the packed form of a corpus file from its sidecar, if the sidecar
+    exists and is still valid. The sidecar is trusted if the size and
+    modification time of the corpus file match the ones it was built from;
+    otherwise the file is hashed, and the sidecar is only used if the hash
+    still matches.
+
+    dataset: The path to the corpus file.
+
+    returns: A tuple of the symbol table and the memory-mapped code, offset
+    and frequency arrays, or None if there is no valid sidecar.
+    """
+    sidecar = sidecar_path(dataset)
+    meta_path = os.path.join(sidecar, 'meta.json')
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('format_version') != CACHE_FORMAT_VERSION:
+        return None
+
+    stat = os.stat(dataset)
+    if (stat.st_size, stat.st_mtime_ns) != (meta['size'], meta['mtime_ns']):
+        if stat.st_size != meta['size'] or file_hash(dataset) != meta['sha256']:
+            return None
+        # The file was touched but not changed, so skip hashing next time
+        meta['mtime_ns'] = stat.st_mtime_ns
+        try:
+            _write_json(meta_path, meta)
+        except OSError:
+            pass
+
+    try:
+        arrays = [
+            np.load(os.path.join(sidecar, name + '.npy'), mmap_mode='r')
+            for name in CACHE_ARRAYS
+        ]
+    except (OSError, ValueError):
+        return None
+
+    return (meta['symbols'], *arrays)
+
+def store(dataset, symbols, codes, offsets, freqs):
+    """
+    Writes the packed form of a corpus file to its sidecar. The sidecar is
+    built in a temporary directory and moved into place, so concurrent
+    readers never see a partial sidecar.
+
+    dataset: The path to the corpus file.
+    symbols: The symbol table the codes refer to.
+    codes: The flat array of sound codes.
+    offsets: The array of token offsets into codes.
+    freqs: The array of token frequencies.
+
+    returns: None
+    """
+    stat = os.stat(dataset)
+    meta = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'symbols': list(symbols),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_hash(dataset)
+    }
+
+    sidecar = sidecar_path(dataset)
+    parent = os.path.dirname(os.path.abspath(sidecar))
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=parent)
+    try:
+        for name, array in zip(CACHE_ARRAYS, [codes, offsets, freqs]):
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(array))
+        _write_json(os.path.join(tmp_dir, 'meta.json'), meta)
+
+        # Replace a stale sidecar. If another process put a fresh one in
+        #   place first, keep theirs.
+        shutil.rmtree(sidecar, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, sidecar)
+        except OSError:
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _write_json(path, data):
+    """
+    Atomically writes a JSON file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.tmp', dir=os.path.dirname(os.path.abspath(path))
+    )
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
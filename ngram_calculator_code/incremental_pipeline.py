@@ -0,0 +1,120 @@
+import os
+import sys
+
+import ngram_calculator
+import shared_corpora
+import sweep
+import timing_trace
+
+# The splitter lives at the root of the repository
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+import splitting_corpora
+
+# Splits each segmenter's Model.txt into the incremental training samples of
+#   splitting_corpora.py and fits and scores every sample as soon as it is
+#   built, without writing the samples out and reading them back as
+#   splitting_corpora.py followed by run_ngramcalc.py does. The results are
+#   the same as that round trip gives.
+
+# Input root, and the samples drawn from it. The defaults are the settings of
+#   splitting_corpora.py, so both draw the same samples.
+input_root = "../all_corpora"
+target_folders = splitting_corpora.target_folders
+levels = splitting_corpora.levels
+samples_per_level = splitting_corpora.samples_per_level
+random_seed = splitting_corpora.random_seed
+sample_mode = splitting_corpora.sample_mode
+
+# Output root, laid out as run_ngramcalc.py lays out the incremental runs. The
+#   results store, trace and test stimuli are set in sweep.py.
+output_root = "../ScoredLists"
+
+# If set, the training samples are also written here, as splitting_corpora.py
+#   writes them. If None they are only kept in memory.
+# corpora_root = "../incremental_corpora_out_v2"
+corpora_root = None
+
+def run_sample(folder, level, sample, indexed_corpus, mask, stimuli):
+    """
+    Builds one training sample of a segmenter and scores the stimuli on it.
+
+    folder: The name of the segmenter.
+    level: The slice level the sample was drawn at.
+    sample: The number of the sample within its level.
+    indexed_corpus: The segmenter's corpus, from splitting_corpora.index_words.
+    mask: The line mask of the sample, from splitting_corpora.sample_masks.
+    stimuli: The stimuli of each contrast, as paths or PackedCorpus objects.
+
+    returns: The paths the results were written to, joined by commas.
+    """
+    with timing_trace.stage('split') as record:
+        processed = splitting_corpora.process_corpus(indexed_corpus, mask)
+        record['tokens'] = len(processed)
+
+    if corpora_root is not None:
+        corpus_dir = os.path.join(corpora_root, folder, str(level))
+        os.makedirs(corpus_dir, exist_ok=True)
+        corpus_path = os.path.join(corpus_dir, f"sample{sample}.txt")
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            f.write(splitting_corpora.format_token_counts(processed))
+
+    # The same tokens and frequencies ngram_calculator.read_tokens would read
+    #   back from the written sample
+    train = ngram_calculator.pack_tokens(
+        [(word.split(' '), float(count)) for word, count in processed]
+    )
+    header, results = ngram_calculator.evaluate_many(train, stimuli)
+
+    output_dir = os.path.join(output_root, "incremental_v2", folder, str(level))
+    os.makedirs(output_dir, exist_ok=True)
+    keys = {"segmenter": folder, "level": str(level), "sample": str(sample)}
+    done = []
+    for contrast, test_results in zip(sweep.contrasts, results):
+        out_path = os.path.join(output_dir, f"{level}{sample}_{contrast}.csv")
+        done.append(sweep.save_results(test_results, header, out_path, dict(keys, contrast=contrast)))
+    return ", ".join(done)
+
+def run_segmenter(folder, corpus_size, samples_by_level):
+    """
+    Reads a segmenter's Model.txt once and runs every sample of every level
+    on it, keeping going when one fails so the rest aren't lost.
+
+    folder: The name of the segmenter.
+    corpus_size: The number of lines the samples were drawn from.
+    samples_by_level: A dictionary mapping levels to sample index arrays,
+    from splitting_corpora.shared_samples.
+
+    returns: A list of triples from sweep.timed_run, one for each sample.
+    """
+    model_path = os.path.join(input_root, folder, "1", "Model.txt")
+    indexed_corpus = splitting_corpora.index_words(splitting_corpora.load_corpus(model_path))
+    # Use the stimuli the parent shared with this worker, reading any that
+    #   weren't shared from disk
+    stimuli = [shared_corpora.attached_corpus(path, path) for path in sweep.contrasts.values()]
+
+    timings = []
+    for level, samples in samples_by_level.items():
+        masks = splitting_corpora.sample_masks(corpus_size, samples)
+        for sample, mask in enumerate(masks):
+            label = f"{folder} {level} sample{sample}"
+            timings.append(sweep.timed_run(label, run_sample, folder, level, sample, indexed_corpus, mask, stimuli))
+    return timings
+
+if __name__ == "__main__":
+    corpus_size, samples_by_level = splitting_corpora.shared_samples(
+        input_root, target_folders, levels, samples_per_level, random_seed, sample_mode
+    )
+
+    folders = []
+    for folder in target_folders:
+        if os.path.isfile(os.path.join(input_root, folder, "1", "Model.txt")):
+            folders.append(folder)
+        else:
+            print(f"Skipping {folder} (no Model.txt in 1/)")
+
+    num_samples = sum(len(samples) for samples in samples_by_level.values())
+    print(f"Running {num_samples} samples of {len(folders)} segmenters.")
+
+    segmenters = {folder: (folder, corpus_size, samples_by_level) for folder in folders}
+    sweep.run(run_segmenter, segmenters, sweep.contrasts.values(), noun="samples")
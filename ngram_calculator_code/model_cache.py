@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import corpus_cache
+
+# Where fitted models are cached unless another directory is given
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'ngram_calculator', 'models'
+)
+# Total size of the cached model files before the least recently used ones
+# are removed
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Extension of the cached model files
+MODEL_SUFFIX = '.npz'
+
+class ModelCache:
+    """
+    A size-bounded directory of fitted models, addressed by the content of
+    the training file and the configuration the model was fitted with, so a
+    model is reused whenever the same data is fitted the same way, whatever
+    the training file is called. The modification time of each model file
+    records when it was last used, and the least recently used files are
+    removed once the directory grows beyond max_bytes.
+
+    The size of the directory is only listed again once the models this
+    object stored since the last listing could have taken it past
+    max_bytes, so storing a model doesn't stat every file in the cache.
+    Other processes sharing the directory each keep their own estimate, so
+    it can briefly grow past max_bytes by what they stored in between.
+
+    directory: The directory the model files are kept in.
+    max_bytes: The maximum total size of the model files.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Total size of the directory at the last listing plus what was
+        #   stored since, or None before the first listing
+        self._total_bytes = None
+
+    def key(self, dataset, **config):
+        """
+        Returns the key of the model fitted from a training file with a given
+        configuration.
+
+        dataset: The path to the training file.
+        config: JSON-serializable settings that change the fitted model.
+
+        returns: A hex digest.
+        """
+        description = dict(config, sha256=corpus_cache.file_hash(dataset))
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def path(self, key):
+        """
+        Returns the path of the model file for a key.
+        """
+        return os.path.join(self.directory, key + MODEL_SUFFIX)
+
+    def lookup(self, key):
+        """
+        Returns the path of the cached model for a key, marking it as
+        recently used, or None if it isn't cached.
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, write):
+        """
+        Adds a model to the cache, then evicts the least recently used models
+        if the cache is too large. The model is written to a temporary file
+        and moved into place, so concurrent readers never see a partial file.
+
+        key: The key of the model.
+        write: A function that writes the model to the path it is given.
+
+        returns: The path of the cached model.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.tmp', suffix=MODEL_SUFFIX, dir=self.directory
+        )
+        os.close(fd)
+        try:
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if self._total_bytes is not None:
+            self._total_bytes += size
+        if self._total_bytes is None or self._total_bytes > self.max_bytes:
+            self.evict()
+        return self.path(key)
+
+    def evict(self):
+        """
+        Lists the directory and removes the least recently used models until
+        the cache fits in max_bytes.
+
+        returns: None
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp') or not name.endswith(MODEL_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # Another process may have removed it already
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+        self._total_bytes = total
@@ -1,454 +1,2418 @@
-import csv
-import nltk
-import numpy as np
-
-from collections import defaultdict
-
-WORD_BOUNDARY = '#'
-MAX_WORD_LEN = 100
-HEADER = [
-    'word',
-    'word_len',
-
-    'uni_prob',
-    'uni_prob_freq_weighted',
-
-    'bi_prob',
-    'bi_prob_freq_weighted',
-    'bi_prob_smoothed',
-    'bi_prob_freq_weighted_smoothed',
-
-    'pos_uni_score',
-    'pos_uni_score_freq_weighted',
-    'pos_uni_score_smoothed',
-    'pos_uni_score_freq_weighted_smoothed',
-
-    'pos_bi_score',
-    'pos_bi_score_freq_weighted',
-    'pos_bi_score_smoothed',
-    'pos_bi_score_freq_weighted_smoothed'
-]
-
-####################
-# Helper functions #
-####################
-
-def generate_bigrams(token):
-    """
-    Returns a list of sound bigrams given a single word token.
-
-    token: The list of symbols in the token.
-
-    returns: The list of bigrams of the token.
-    """
-    return nltk.ngrams([WORD_BOUNDARY] + token + [WORD_BOUNDARY], 2)
-
-def read_tokens(dataset):
-    """
-    Reads in a file containing tokens and optional frequencies and converts
-    it to a list of tokens and a list of token/frequency pairs.
-
-    dataset: The path to the dataset.
-
-    returns: A list of lists, where each sublist corresponds to a token and
-    consists of a list of the individual symbols.
-    """
-    with open(dataset, 'r') as f:
-        reader = csv.reader(f)
-    
-        token_freqs = []
-
-        for row in reader:
-            split_token = row[0].split(' ')
-            freq = float(row[1]) if len(row) == 2 else 0
-            token_freqs.append([split_token, freq])
-
-    return token_freqs
-
-def write_results(results, outfile):
-    """
-    Writes the results of scoring the test dataset to a file.
-
-    results: The results to write.
-    outfile: The path to the output file.
-
-    returns: None
-    """
-    results = [HEADER] + results
-    with open(outfile, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerows(results)
-
-###########################
-# Code for fitting models #
-###########################
-
-def fit_ngram_models(token_freqs, sound_idx):
-    """
-    Fits all of the ngram models to the provided data and returns the fitted
-    models.
-
-    token_freqs: A list of tuples of word-frequency pairs.
-    sound_idx: The list of unique sounds used to map sound identity to matrix
-    dimensions.
-
-    returns: A list of lists of models. These models are in the same order as
-    defined in the HEADER file at the top of this file, and broken into sublists
-    based on their type (unigram/bigram/positional unigram/positional bigram).
-    """
-    unigram_models = []
-    # Get unigram probabilities
-    unigram_models.append(fit_unigrams(token_freqs))
-    unigram_models.append(fit_unigrams(token_freqs, token_weighted=True))
-
-    # Get bigram probabilities
-    bigram_models = []
-    bigram_models.append(fit_bigrams(token_freqs, sound_idx))
-    bigram_models.append(
-        fit_bigrams(token_freqs, sound_idx, token_weighted=True)
-    )
-    bigram_models.append(
-        fit_bigrams(token_freqs, sound_idx, smoothed=True)
-    )
-    bigram_models.append(
-        fit_bigrams(token_freqs, sound_idx, smoothed=True, token_weighted=True)
-    )
-
-    # Get positional unigram probabilities
-    pos_unigram_models = []
-    pos_unigram_models.append(fit_positional_unigrams(token_freqs))
-    pos_unigram_models.append(
-        fit_positional_unigrams(token_freqs, token_weighted=True)
-    )
-    pos_unigram_models.append(
-        fit_positional_unigrams(token_freqs, smoothed=True)
-    )
-    pos_unigram_models.append(
-        fit_positional_unigrams(token_freqs, smoothed=True, token_weighted=True)
-    )
-
-    # Get positional bigram probabilities
-    pos_bigram_models = []
-    pos_bigram_models.append(fit_positional_bigrams(token_freqs))
-    pos_bigram_models.append(
-        fit_positional_bigrams(token_freqs, token_weighted=True)
-    )
-    pos_bigram_models.append(
-        fit_positional_bigrams(token_freqs, smoothed=True)
-    )
-    pos_bigram_models.append(
-        fit_positional_bigrams(token_freqs, smoothed=True, token_weighted=True)
-    )
-
-    return unigram_models, bigram_models, pos_unigram_models, pos_bigram_models
-
-def fit_unigrams(token_freqs, token_weighted=False):
-    """
-    This function takes a set of word tokens and returns a dictionary whose
-    keys are unigrams and whose values are log unigram probabilities. Smoothing 
-    isn't implemented for standard unigram scores: we assume the set of sounds
-    in the training data is the full set of sounds.
-
-    token_freqs: A list of tuples of word-frequency pairs
-    token_weighted: If true, counts are weighted by log frequency of token
-
-    returns: A dictionary of unigram:probability pairs.
-    """
-    unigram_freqs = defaultdict(int)
-
-    for token, freq in token_freqs:
-        val = np.log(freq) if token_weighted else 1
-        for sound in token:
-            unigram_freqs[sound] += val
-
-    total_sounds = sum(unigram_freqs.values())
-    unigram_freqs = {
-        key: (np.log(value/total_sounds)) 
-        for key, value in unigram_freqs.items()
-    }
-    return unigram_freqs
-
-def fit_bigrams(token_freqs, sound_idx, token_weighted=False, smoothed=False):
-    """
-    This function takes a set of word tokens and a list of sounds and
-    returns a matrix of bigrams probabilities. The sound list is necessary because
-    we include counts of 0 for unattested bigram combinations.
-
-    token_freqs: A list of tuples of word-frequency pairs.
-
-    token_weighted: if True, counts are weighted by the log frequency
-    of the words they occur in.
-
-    smoothed: if True, start with a pseudo-count of 1 for every bigram.
-
-    returns: A matrix of bigram probabilities, where rows correspond to the second
-    sound in the bigram and columns correspond to the first.
-    """
-    num_sounds = len(sound_idx)
-
-    if smoothed:
-        count_matrix = np.ones((num_sounds, num_sounds))
-    else:
-        count_matrix = np.zeros((num_sounds, num_sounds))
-
-    for token, freq in token_freqs:
-        val = np.log(freq) if token_weighted else 1
-        bigrams = generate_bigrams(token)
-        for s1, s2 in bigrams:
-            count_matrix[sound_idx.index(s2)][sound_idx.index(s1)] += val
-
-    bigram_probs = np.log(count_matrix / np.sum(count_matrix, 0))
-    return bigram_probs
-
-def fit_positional_unigrams(token_freqs, token_weighted=False, smoothed=False):
-    """
-    This function takes a set of word tokens and returns a dictionary containing
-    positional unigram log scores.
-
-    token_freqs: A list of tuples of word-frequency pairs.
-
-    token_weighted: If True, counts are weighted by log frequency of token.
-
-    smoothed: If True, each start with a pseudo-count of 1 for every unigram in
-    every position up to MAX_WORD_LEN. Note that this smoothing does not allow
-    unseen unigrams to get probabilities > 0: rather it assigns known unigrams
-    in unknown positions probabilities > 0.
-
-    returns: A dictionary of dictionaries, where the first dictionary maps position
-    indices to unigrams, and the second maps unigrams to their scores in that
-    position.
-    """
-    pos_unigram_freqs = defaultdict(lambda: defaultdict(int))
-
-    if smoothed:
-        unique_sounds = set(
-            [sound for token, _ in token_freqs for sound in token]
-        )
-        max_idx = max([len(token) for token, _ in token_freqs])
-
-        for i in range(MAX_WORD_LEN):
-            for sound in unique_sounds:
-                pos_unigram_freqs[i][sound] = 1
-
-    for token, freq in token_freqs:
-        val = np.log(freq) if token_weighted else 1
-        for idx, sound in enumerate(token):
-            pos_unigram_freqs[idx][sound] += val
-
-    pos_unigram_freqs = normalize_positional_counts(pos_unigram_freqs)
-
-    return pos_unigram_freqs
-
-def fit_positional_bigrams(token_freqs, token_weighted=False, smoothed=False):
-    """
-    This function takes a set of word tokens and returns a dictionary containing
-    positional bigram scores.
-
-    token_freqs: A list of tuples of word-frequency pairs.
-
-    token_weighted: If True, counts are weighted by log frequency of token.
-
-    smoothed: If True, each start with a pseudo-count of 1 for every bigram in
-    every pair of positions up to MAX_WORD_LEN.
-
-    returns: A dictionary of dictionaries, where the first dictionary maps pairs of
-    position indices to bigrams, and the second maps bigram to their scores in those
-    positions.
-    """
-    pos_bigram_freqs = defaultdict(lambda: defaultdict(int))
-
-    if smoothed:
-        unique_sounds = set(
-            [sound for token, _ in token_freqs for sound in token]
-        )
-        for i in range(MAX_WORD_LEN - 1):
-            for s1 in unique_sounds:
-                for s2 in unique_sounds:
-                    pos_bigram_freqs[(i, i+1)][(s1, s2)] = 1
-
-    for token, freq in token_freqs:
-        val = np.log(freq) if token_weighted else 1
-        for idx, sound in enumerate(token):
-            if idx < len(token) - 1:
-                pos_bigram_freqs[(idx, idx + 1)][(sound, token[idx + 1])] += val
-
-    pos_bigram_freqs = normalize_positional_counts(pos_bigram_freqs)
-    
-    return pos_bigram_freqs
-
-def normalize_positional_counts(counts):
-    """
-    Normalizes positional counts by total counts for each position.
-    """
-    for idx in counts.keys():
-        total = sum(counts[idx].values())
-        for gram in counts[idx].keys():
-            counts[idx][gram] /= total
-
-    return counts
-
-###########################
-# Code for testing models #
-###########################
-
-def score_corpus(token_freqs, fitted_models, sound_idx):
-    """
-    Given a dataset and a list of fitted models, returns the score for each 
-    word under each model.
-
-    token_freqs: A list of tuples of word-frequency pairs. Frequencies 
-    aren't used in this function.
-    sound_idx: The list of unique sounds used to map sound identity to matrix
-    dimensions.
-
-    fitted_models: A list of lists of models. These models are in the same order as
-    defined in the HEADER file at the top of this file, and broken into sublists
-    based on their type (unigram/bigram/positional unigram/positional bigram).
-
-    returns: A list of lists of scores. Each sublist corresponds to one word. Each
-    sublist contains the word itself, its length, and its score under each of the
-    ngram models.
-    """
-    uni_models, bi_models, pos_uni_models, pos_bi_models = fitted_models
-
-    results = []
-    
-    for token, _ in token_freqs:
-        row = [' '.join(token), len(token)]
-
-        for model in uni_models:
-            row.append(get_unigram_prob(token, model))
-
-        for model in bi_models:
-            row.append(get_bigram_prob(token, model, sound_idx))
-
-        for model in pos_uni_models:
-            row.append(get_pos_unigram_score(token, model))
-
-        for model in pos_bi_models:
-            row.append(get_pos_bigram_score(token, model))
-
-        results.append(row)
-
-    return results
-
-def get_unigram_prob(word, unigram_probs):
-    """
-    Calculcates the unigram probability of a word given a fitted unigram model
-
-    word: The test word
-    ungiram_probs: The fitted model
-
-    returns: The log probability of the word under the unigram model.
-    """
-    prob = 0
-    for sound in word:
-        # Add basic smoothing for sounds that appear in test data but
-        #   not training data. Use float('-inf') because we are
-        #   using log probabilities.
-        prob += unigram_probs.get(sound, float('-inf'))
-
-    return prob
-
-def get_bigram_prob(word, bigram_probs, sound_idx):
-    """
-    Calculcates the bigram probability of a word given a fitted bigram model
-
-    word: The test word
-    bigram_probs: The fitted model
-    sound_idx: The list of unique sounds used to map sound identity to matrix
-    dimensions.
-
-    returns: The log probability of the word under the bigram model.
-    """
-    bigrams = generate_bigrams(word)
-    prob = 0
-    for s1, s2 in bigrams:
-        try:
-            prob += bigram_probs[sound_idx.index(s2), sound_idx.index(s1)]
-        except:
-            # If bigram contains symbol we haven't seen, assign 0 probability
-            prob += float('-inf')
-
-    return prob
-
-def get_pos_unigram_score(word, pos_uni_freqs):
-    """
-    Calculcates the positional unigram score of a word given a fitted 
-    positional unigram model.
-
-    word: The test word
-    pos_uni_freqs: The fitted positional unigram model
-
-    returns: The score of the word under the positional unigram model. Following
-    Vitevich & Luce (2004), we add 1 to these scores.
-    """
-    score = 1
-
-    for idx, sound in enumerate(word):
-        score += pos_uni_freqs[idx][sound]
-
-    return score
-
-def get_pos_bigram_score(word, pos_bi_freqs):
-    """
-    Calculcates the positional bigram score of a word given a fitted 
-    positional bigram model.
-
-    word: The test word
-    pos_bi_freqs: The fitted positional bigram model
-
-    returns: The score of the word under the positional unigram model. Following
-    Vitevich & Luce (2004), we add 1 to these scores.
-    """
-    score = 1
-
-    for idx, sound in enumerate(word):
-        if idx < len(word) - 1:
-            score += pos_bi_freqs[(idx, idx + 1)][sound, word[idx + 1]]
-
-    return score
-
-##################
-# Entry function #
-##################
-
-def run(train, test, out):
-    """
-    Trains all of the n-gram models on the training set, evaluates them on
-    the test set, and writes the evaluation results to a file.
-
-    train: The path to the training file.
-    test: The path to the test file.
-    out: The path to the output file.
-
-    returns: None
-    """
-    train_token_freqs = read_tokens(train)
-    test_token_freqs = read_tokens(test)
-    unique_sounds = set(
-        [sound for token, _ in train_token_freqs for sound in token]
-    )
-    sound_idx = sorted(list(unique_sounds)) + ['#']
-
-    fitted_models = fit_ngram_models(train_token_freqs, sound_idx)
-    results = score_corpus(test_token_freqs, fitted_models, sound_idx)
-    write_results(results, out)
-
-if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(
-        description = "Calculate a suite of unigram/bigram scores for a data set."
-    )
-    parser.add_argument(
-        'train_file', type=str, help='Path to the input corpus file.'
-    )
-    parser.add_argument(
-        'test_file', type=str, help='Path to test data file' 
-    )
-    parser.add_argument(
-        'output_file', type=str, help='Path to output file with word judgements' 
-    )
-    args = parser.parse_args()
-    run(args.train_file, args.test_file, args.output_file)
+import csv
+import json
+import threading
+import numpy as np
+from collections import OrderedDict
+
+import corpus_cache
+import model_cache as model_cache_module
+import result_formats
+import timing_trace
+
+WORD_BOUNDARY = '#'
+# Number of tokens read at a time when streaming a training file
+CHUNK_SIZE = 10000
+# Code given to symbols that are missing from the inventory a corpus is
+# encoded against (e.g. test sounds that never occur in the training data).
+UNKNOWN_SOUND = -1
+# Pseudo-count every n-gram starts with in the smoothed models
+SMOOTHING_ALPHA = 1
+# Number of positions that get pseudo-counts in the smoothed positional
+# models. None smooths every position, however long the tokens are.
+MAX_WORD_LEN = None
+# Highest n-gram order counted and scored. Every order above 2 adds columns
+# to the output, see build_header.
+MAX_ORDER = 2
+# Names of the higher orders in the output columns
+ORDER_NAMES = {3: 'tri', 4: 'quad'}
+HEADER = [
+    'word',
+    'word_len',
+
+    'uni_prob',
+    'uni_prob_freq_weighted',
+
+    'bi_prob',
+    'bi_prob_freq_weighted',
+    'bi_prob_smoothed',
+    'bi_prob_freq_weighted_smoothed',
+
+    'pos_uni_score',
+    'pos_uni_score_freq_weighted',
+    'pos_uni_score_smoothed',
+    'pos_uni_score_freq_weighted_smoothed',
+
+    'pos_bi_score',
+    'pos_bi_score_freq_weighted',
+    'pos_bi_score_smoothed',
+    'pos_bi_score_freq_weighted_smoothed'
+]
+
+####################
+# Helper functions #
+####################
+
+def build_header(max_order=MAX_ORDER):
+    """
+    Returns the header of the output files when scoring models up to a given
+    order. Each order above 2 adds its n-gram and positional n-gram columns
+    after the columns of HEADER, in the same arrangement as the bigram ones.
+
+    max_order: The highest n-gram order scored.
+
+    returns: A list of column names.
+    """
+    header = list(HEADER)
+    for order in range(3, max_order + 1):
+        name = ORDER_NAMES.get(order, f'order{order}')
+        header += [
+            f'{name}_prob',
+            f'{name}_prob_freq_weighted',
+            f'{name}_prob_smoothed',
+            f'{name}_prob_freq_weighted_smoothed',
+
+            f'pos_{name}_score',
+            f'pos_{name}_score_freq_weighted',
+            f'pos_{name}_score_smoothed',
+            f'pos_{name}_score_freq_weighted_smoothed'
+        ]
+    return header
+
+class SoundInventory:
+    """
+    A fixed mapping between sound symbols and the integer codes used to index
+    the model arrays. Sounds are sorted and the word boundary symbol always
+    receives the last code, so the codes match the matrix dimensions of the
+    fitted bigram models.
+
+    sounds: An iterable of the sound symbols to include. The word boundary is
+    added automatically.
+    """
+    def __init__(self, sounds):
+        self.symbols = sorted(set(sounds) - {WORD_BOUNDARY}) + [WORD_BOUNDARY]
+        self.codes = {sound: code for code, sound in enumerate(self.symbols)}
+        self.boundary = self.codes[WORD_BOUNDARY]
+
+    @classmethod
+    def from_tokens(cls, token_freqs):
+        """
+        Builds the inventory of all sounds that occur in a list of tokens.
+
+        token_freqs: A list of tuples of word-frequency pairs.
+
+        returns: A SoundInventory.
+        """
+        return cls(sound for token, _ in token_freqs for sound in token)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SoundInventory) and self.symbols == other.symbols
+        )
+
+    def encode(self, token):
+        """
+        Converts a list of symbols to an array of codes. Symbols that are not
+        in the inventory are given the code UNKNOWN_SOUND.
+
+        token: The list of symbols in the token.
+
+        returns: An int32 array of codes.
+        """
+        return np.array(
+            [self.codes.get(sound, UNKNOWN_SOUND) for sound in token],
+            dtype=np.int32
+        )
+
+    def decode(self, codes):
+        """
+        Converts an array of codes back to a list of symbols.
+
+        codes: The codes to convert. These must all be in the inventory.
+
+        returns: The list of symbols.
+        """
+        return [self.symbols[code] for code in codes]
+
+    def lookup(self, other):
+        """
+        Returns an array that translates codes from another inventory into
+        codes of this inventory, using UNKNOWN_SOUND for sounds that this
+        inventory does not contain.
+
+        other: The inventory whose codes should be translated.
+
+        returns: An int32 array indexed by the codes of the other inventory.
+        """
+        return np.array(
+            [self.codes.get(sound, UNKNOWN_SOUND) for sound in other.symbols],
+            dtype=np.int32
+        )
+
+class PackedCorpus:
+    """
+    A corpus of tokens stored as flat arrays of sound codes. The codes of all
+    tokens are concatenated into one array, with each token surrounded by
+    word boundaries, so token i is codes[offsets[i]:offsets[i + 1]].
+
+    inventory: The SoundInventory the codes refer to.
+    codes: An int32 array of the concatenated, boundary-padded tokens.
+    offsets: An int64 array with the start of each token plus the end of the
+    last one.
+    freqs: A float64 array with the frequency of each token.
+    """
+    def __init__(self, inventory, codes, offsets, freqs, words=None):
+        self.inventory = inventory
+        self.codes = codes
+        self.offsets = offsets
+        self.freqs = freqs
+        self._words = words
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """
+        The number of sounds in each token, not counting word boundaries.
+        """
+        return np.diff(self.offsets) - 2
+
+    def token(self, i):
+        """
+        Returns the codes of token i, including the surrounding boundaries.
+        """
+        return self.codes[self.offsets[i]:self.offsets[i + 1]]
+
+    def words(self):
+        """
+        Returns each token as a string of space-separated symbols.
+        """
+        if self._words is None:
+            self._words = [
+                ' '.join(self.inventory.decode(self.token(i)[1:-1]))
+                for i in range(len(self))
+            ]
+        return self._words
+
+    def sound_mask(self):
+        """
+        Returns a boolean mask over the codes that is False at the word
+        boundaries added around each token.
+        """
+        mask = np.ones(len(self.codes), dtype=bool)
+        mask[self.offsets[:-1]] = False
+        mask[self.offsets[1:] - 1] = False
+        return mask
+
+    def positions(self):
+        """
+        Returns the position of every code within its token, where the first
+        sound of a token is position 0 and the initial boundary is -1.
+        """
+        starts = np.repeat(self.offsets[:-1], np.diff(self.offsets))
+        return np.arange(len(self.codes), dtype=np.int64) - starts - 1
+
+    def padded(self):
+        """
+        Lays the tokens out as the rows of a matrix, with each token
+        surrounded by its word boundaries and the remainder of each row
+        filled with UNKNOWN_SOUND.
+
+        returns: An int32 array of shape (N, L + 2), where L is the length of
+        the longest token, and a boolean mask of the same shape marking the
+        entries that belong to a token.
+        """
+        lengths = np.diff(self.offsets)
+        width = int(lengths.max()) if len(self) else 0
+        mask = np.arange(width) < lengths[:, None]
+        padded = np.full(mask.shape, UNKNOWN_SOUND, dtype=np.int32)
+        padded[mask] = self.codes
+        return padded, mask
+
+    def subset(self, indices):
+        """
+        Returns a corpus of some of the tokens of this one.
+
+        indices: The indices of the tokens to keep, in the order to keep them.
+
+        returns: A new PackedCorpus.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = np.diff(self.offsets)[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        starts = np.repeat(self.offsets[indices] - offsets[:-1], lengths)
+        codes = self.codes[np.arange(offsets[-1]) + starts]
+        words = None
+        if self._words is not None:
+            words = [self._words[i] for i in indices]
+        return PackedCorpus(
+            self.inventory, codes, offsets, self.freqs[indices], words
+        )
+
+    def token_weights(self, token_weighted):
+        """
+        Returns the amount each token adds to a count.
+
+        token_weighted: If True, tokens are weighted by their log frequency,
+        otherwise every token counts once.
+        """
+        if token_weighted:
+            with np.errstate(divide='ignore'):
+                return np.log(self.freqs)
+        return np.ones(len(self))
+
+    def recode(self, inventory):
+        """
+        Re-encodes the corpus against another inventory. Sounds missing from
+        that inventory are given the code UNKNOWN_SOUND.
+
+        inventory: The SoundInventory to encode against.
+
+        returns: A new PackedCorpus.
+        """
+        if inventory == self.inventory:
+            return self
+        codes = inventory.lookup(self.inventory)[self.codes]
+        return PackedCorpus(
+            inventory, codes, self.offsets, self.freqs, self.words()
+        )
+
+def pack_tokens(token_freqs, inventory=None):
+    """
+    Converts a list of tokens into a PackedCorpus.
+
+    token_freqs: A list of tuples of word-frequency pairs.
+    inventory: The SoundInventory to encode against. If None, an inventory
+    of the sounds in token_freqs is built.
+
+    returns: A PackedCorpus.
+    """
+    words = None
+    if inventory is None:
+        with timing_trace.stage('inventory', tokens=len(token_freqs)):
+            inventory = SoundInventory.from_tokens(token_freqs)
+    else:
+        # Sounds missing from the inventory can't be decoded again later
+        words = [' '.join(token) for token, _ in token_freqs]
+
+    with timing_trace.stage('encode', tokens=len(token_freqs)):
+        lengths = np.array(
+            [len(token) + 2 for token, _ in token_freqs], dtype=np.int64
+        )
+        offsets = np.zeros(len(token_freqs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        boundary = [WORD_BOUNDARY]
+        codes = inventory.encode(
+            [
+                sound for token, _ in token_freqs
+                for sound in boundary + token + boundary
+            ]
+        )
+        freqs = np.array([freq for _, freq in token_freqs], dtype=np.float64)
+
+    return PackedCorpus(inventory, codes, offsets, freqs, words)
+
+def iter_tokens(dataset):
+    """
+    Reads a file containing tokens and optional frequencies one line at a time.
+
+    dataset: The path to the dataset.
+
+    returns: A generator of [split_token, freq] pairs, where split_token is the
+    list of the individual symbols of a token.
+    """
+    with open(dataset, 'r') as f:
+        reader = csv.reader(f)
+
+        for row in reader:
+            split_token = row[0].split(' ')
+            freq = float(row[1]) if len(row) == 2 else 0
+            yield [split_token, freq]
+
+def iter_chunks(token_freqs, chunk_size):
+    """
+    Groups a stream of tokens into lists of at most chunk_size tokens.
+
+    token_freqs: An iterable of word-frequency pairs.
+    chunk_size: The maximum number of tokens in a chunk.
+
+    returns: A generator of lists of word-frequency pairs.
+    """
+    chunk = []
+    for token_freq in token_freqs:
+        chunk.append(token_freq)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def read_tokens(dataset):
+    """
+    Reads in a file containing tokens and optional frequencies and converts
+    it to a list of tokens and a list of token/frequency pairs.
+
+    dataset: The path to the dataset.
+
+    returns: A list of lists, where each sublist corresponds to a token and
+    consists of a list of the individual symbols.
+    """
+    return list(iter_tokens(dataset))
+
+def read_corpus(dataset, inventory=None, cache=False):
+    """
+    Reads in a file containing tokens and optional frequencies and packs it.
+
+    dataset: The path to the dataset, or a PackedCorpus that was already
+    read (such as one shared between processes), which is only re-encoded.
+    inventory: The SoundInventory to encode against. If None, the inventory
+    of the sounds in the file is used.
+    cache: If True, the packed corpus is loaded from a sidecar next to the
+    dataset instead of parsing it, and the sidecar is written if it is
+    missing or out of date.
+
+    returns: A PackedCorpus.
+    """
+    if isinstance(dataset, PackedCorpus):
+        corpus = dataset
+    elif cache:
+        with timing_trace.stage('read', cached=True) as record:
+            corpus = read_cached_corpus(dataset)
+            record['tokens'] = len(corpus)
+    else:
+        with timing_trace.stage('read') as record:
+            token_freqs = read_tokens(dataset)
+            record['tokens'] = len(token_freqs)
+        corpus = pack_tokens(token_freqs)
+    if inventory is not None:
+        with timing_trace.stage('encode', tokens=len(corpus), recoded=True):
+            corpus = corpus.recode(inventory)
+    return corpus
+
+def read_cached_corpus(dataset):
+    """
+    Loads the packed form of a dataset from its sidecar, building the sidecar
+    first if there is no valid one. The arrays of a loaded corpus are memory
+    mapped rather than read into memory.
+
+    dataset: The path to the dataset.
+
+    returns: A PackedCorpus encoded against the inventory of the dataset.
+    """
+    cached = corpus_cache.load(dataset)
+    if cached is None:
+        corpus = pack_tokens(read_tokens(dataset))
+        corpus_cache.store(
+            dataset, corpus.inventory.symbols, corpus.codes, corpus.offsets,
+            corpus.freqs
+        )
+        return corpus
+
+    symbols, codes, offsets, freqs = cached
+    return PackedCorpus(SoundInventory(symbols), codes, offsets, freqs)
+
+def write_results(results, outfile, header=HEADER, output_format=None,
+                  float32=False):
+    """
+    Writes the results of scoring the test dataset to a file.
+
+    results: The results to write.
+    outfile: The path to the output file.
+    header: The column names, as returned by build_header.
+    output_format: One of result_formats.FORMATS (csv, npz, parquet or
+    arrow). If None, the format is chosen by the extension of outfile, and
+    anything unrecognized is written as CSV.
+    float32: If True, scores are stored as 32-bit floats.
+
+    returns: None
+    """
+    with timing_trace.stage('write', tokens=len(results)):
+        result_formats.write_results(
+            results, outfile, header, output_format, float32
+        )
+
+###########################
+# Code for fitting models #
+###########################
+
+class NgramCounts:
+    """
+    The raw counts every ngram model is fitted from, collected in a single
+    pass over a corpus. Each array has a leading axis of length 3: index 0
+    holds unweighted counts, index 1 holds counts weighted by the log
+    frequency of the token, and index 2 counts the tokens with a frequency of
+    0. The log frequency weight of those tokens is -inf, so they are kept out
+    of index 1 to allow their counts to be subtracted again; select_counts
+    combines the two into the weighted counts a model needs.
+
+    Counts can be updated with partial_fit, combined with merge and removed
+    again with subtract (or with + and -). The inventory and positions are
+    kept to the ones that have been counted, so the fitted models are the
+    same as if every token had been counted at once. Models are only
+    normalized from the counts when fitted_models is called, and are cached
+    until the counts change.
+
+    The weighted count of each gram adds up the log frequencies of its
+    occurrences, and the totals of each context or position add up the
+    counts of its grams in code order, where the original per-word code
+    added them in the order the tokens and grams were first seen. The models
+    weighted by token frequency can therefore differ from it in the last few
+    bits, by a relative 1e-12 at most, which ngram_reference.py checks. The
+    unweighted models add up integers and are exact.
+
+    inventory: The SoundInventory the sound dimensions refer to.
+    unigrams: Sound counts, shape (3, V).
+    bigrams: Bigram counts including word boundaries, shape (3, V, V), where
+    the second axis is the second sound and the third axis the first.
+    pos_unigrams: Sound counts per position, shape (3, P, V), where P is the
+    length of the longest token.
+    pos_bigrams: Bigram counts per pair of positions, shape (3, P - 1, V, V),
+    indexed by the position of the first sound, then the first and second
+    sounds.
+    higher_orders: A dictionary mapping each order above 2 that was counted
+    to its SparseNgramCounts, which share this inventory.
+    """
+    def __init__(self, inventory, unigrams, bigrams, pos_unigrams, pos_bigrams,
+                 higher_orders=None):
+        self.inventory = inventory
+        self.unigrams = unigrams
+        self.bigrams = bigrams
+        self.pos_unigrams = pos_unigrams
+        self.pos_bigrams = pos_bigrams
+        self.higher_orders = higher_orders or {}
+        self._fitted_models = {}
+
+    @classmethod
+    def empty(cls, max_order=MAX_ORDER):
+        """
+        Returns the counts of an empty corpus, to be filled with partial_fit.
+
+        max_order: The highest n-gram order to count.
+        """
+        return count_ngrams(pack_tokens([]), max_order)
+
+    @property
+    def num_positions(self):
+        """
+        The length of the longest token that was counted.
+        """
+        return self.pos_unigrams.shape[1]
+
+    @property
+    def max_order(self):
+        """
+        The highest n-gram order that was counted.
+        """
+        return max(self.higher_orders, default=2)
+
+    def sounds(self):
+        """
+        Returns the codes of the sounds that were seen in the counted tokens.
+        """
+        return np.flatnonzero(self.unigrams[0] > 0)
+
+    def copy(self):
+        """
+        Returns an independent copy of the counts.
+        """
+        return NgramCounts(
+            self.inventory, self.unigrams.copy(), self.bigrams.copy(),
+            self.pos_unigrams.copy(), self.pos_bigrams.copy(),
+            {
+                order: counts.copy()
+                for order, counts in self.higher_orders.items()
+            }
+        )
+
+    def fitted_models(self, max_word_len=MAX_WORD_LEN, alpha=SMOOTHING_ALPHA):
+        """
+        Returns the models fitted from the current counts, normalizing them
+        only the first time they are requested.
+
+        max_word_len: The number of positions smoothed in the positional models.
+        alpha: The pseudo-count of the smoothed models.
+
+        returns: The fitted models, as returned by fit_ngram_models.
+        """
+        key = (max_word_len, alpha)
+        if key not in self._fitted_models:
+            self._fitted_models[key] = fit_ngram_models(
+                self, max_word_len, alpha
+            )
+        return self._fitted_models[key]
+
+    def partial_fit(self, tokens):
+        """
+        Adds the counts of more tokens.
+
+        tokens: A list of tuples of word-frequency pairs, or a PackedCorpus.
+
+        returns: These counts, updated.
+        """
+        if not isinstance(tokens, PackedCorpus):
+            tokens = pack_tokens(tokens)
+        return self.merge(count_ngrams(tokens, self.max_order))
+
+    def merge(self, other):
+        """
+        Adds the counts of another NgramCounts to these counts.
+
+        other: The counts to add.
+
+        returns: These counts, updated.
+        """
+        return self._combine(other, 1)
+
+    def subtract(self, other):
+        """
+        Removes the counts of another NgramCounts from these counts. Every
+        token other was counted from must also have been counted here.
+
+        other: The counts to remove.
+
+        returns: These counts, updated.
+        """
+        return self._combine(other, -1)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __sub__(self, other):
+        return self.copy().subtract(other)
+
+    def _combine(self, other, sign):
+        """
+        Adds sign times the counts of other to these counts in place, then
+        drops the sounds and positions that no longer have any counts.
+        """
+        if self.higher_orders.keys() != other.higher_orders.keys():
+            raise ValueError("Can't combine counts of different orders.")
+
+        inventory = SoundInventory(
+            self.inventory.symbols + other.inventory.symbols
+        )
+        num_positions = max(self.num_positions, other.num_positions)
+
+        combined = [
+            mine + sign * theirs
+            for mine, theirs in zip(
+                self._reindexed(inventory, num_positions),
+                other._reindexed(inventory, num_positions)
+            )
+        ]
+        if any(np.any(counts[0] < 0) for counts in combined):
+            raise ValueError(
+                "Can't subtract counts of tokens that were not counted."
+            )
+        # Weighted counts of grams that are gone should be exactly 0 rather
+        #   than whatever rounding error the subtraction left behind
+        for counts in combined:
+            counts[1:, counts[0] == 0] = 0
+
+        higher_orders = {
+            order: counts.reindexed(inventory).combined(
+                other.higher_orders[order].reindexed(inventory), sign
+            )
+            for order, counts in self.higher_orders.items()
+        }
+
+        combined = NgramCounts(inventory, *combined, higher_orders).compacted()
+        self.inventory = combined.inventory
+        self.unigrams = combined.unigrams
+        self.bigrams = combined.bigrams
+        self.pos_unigrams = combined.pos_unigrams
+        self.pos_bigrams = combined.pos_bigrams
+        self.higher_orders = combined.higher_orders
+        self._fitted_models = {}
+        return self
+
+    def compacted(self):
+        """
+        Returns the counts restricted to the sounds and positions that have
+        been counted, or these counts if there is nothing to drop.
+        """
+        inventory = SoundInventory(self.inventory.decode(self.sounds()))
+        num_positions = int(np.sum(np.any(self.pos_unigrams[0] > 0, 1)))
+        if (inventory == self.inventory
+                and num_positions == self.num_positions):
+            return self
+        return NgramCounts(
+            inventory, *self._reindexed(inventory, num_positions),
+            {
+                order: counts.reindexed(inventory)
+                for order, counts in self.higher_orders.items()
+            }
+        )
+
+    def _reindexed(self, inventory, num_positions):
+        """
+        Returns copies of the count arrays laid out for another inventory and
+        number of positions. The inventory must contain every counted sound,
+        and only positions without counts may be dropped.
+        """
+        lookup = inventory.lookup(self.inventory)
+        old = np.flatnonzero(lookup != UNKNOWN_SOUND)
+        new = lookup[old]
+        num_sounds = len(inventory)
+        kept = min(num_positions, self.num_positions)
+        kept_pairs = max(kept - 1, 0)
+
+        unigrams = np.zeros((3, num_sounds))
+        unigrams[:, new] = self.unigrams[:, old]
+
+        bigrams = np.zeros((3, num_sounds, num_sounds))
+        bigrams[:, new[:, None], new] = self.bigrams[:, old[:, None], old]
+
+        pos_unigrams = np.zeros((3, num_positions, num_sounds))
+        pos_unigrams[:, :kept, new] = self.pos_unigrams[:, :kept, old]
+
+        pos_bigrams = np.zeros(
+            (3, max(num_positions - 1, 0), num_sounds, num_sounds)
+        )
+        pos_bigrams[:, :kept_pairs, new[:, None], new] = (
+            self.pos_bigrams[:, :kept_pairs, old[:, None], old]
+        )
+
+        return unigrams, bigrams, pos_unigrams, pos_bigrams
+
+def select_counts(counts, token_weighted):
+    """
+    Selects the counts a model is fitted from out of one of the arrays of an
+    NgramCounts.
+
+    counts: An array of counts with the NgramCounts layout.
+    token_weighted: If True, returns counts weighted by log frequency of token,
+    which are -inf wherever a token with a frequency of 0 was counted.
+    Otherwise returns the unweighted counts.
+
+    returns: An array of counts.
+    """
+    if not token_weighted:
+        return counts[0]
+    return np.where(counts[2] > 0, -np.inf, counts[1])
+
+def _bincount_weighted(index, weights, size):
+    """
+    Counts how often each value of index occurs, both unweighted and weighted,
+    in the layout of an NgramCounts.
+
+    index: The values to count.
+    weights: An array with a log frequency weight for every value in index.
+    size: The number of bins.
+
+    returns: An array of shape (3, size).
+    """
+    zero_freq = weights == -np.inf
+    return np.stack([
+        np.bincount(index, minlength=size).astype(np.float64),
+        np.bincount(
+            index, weights=np.where(zero_freq, 0, weights), minlength=size
+        ),
+        np.bincount(index[zero_freq], minlength=size).astype(np.float64)
+    ])
+
+def count_ngrams(corpus, max_order=MAX_ORDER):
+    """
+    Counts every unigram, bigram, positional unigram and positional bigram in
+    a corpus in one pass over its codes, both unweighted and weighted by the
+    log frequency of each token.
+
+    corpus: A PackedCorpus of the training tokens.
+    max_order: The highest n-gram order to count. The n-grams of each order
+    above 2 are counted sparsely, see count_sparse_ngrams.
+
+    returns: An NgramCounts.
+    """
+    with timing_trace.stage('count', tokens=len(corpus)):
+        num_sounds = len(corpus.inventory)
+        lengths = corpus.lengths
+        max_len = int(lengths.max()) if len(corpus) else 0
+        codes = corpus.codes.astype(np.int64)
+        positions = corpus.positions()
+
+        # Every code belongs to one token and is weighted by that token
+        token_ids = np.repeat(np.arange(len(corpus)), lengths + 2)
+        with np.errstate(divide='ignore'):
+            log_freqs = np.log(corpus.freqs)[token_ids]
+
+        # Unigrams and positional unigrams use every code but the boundaries
+        sounds = np.flatnonzero(corpus.sound_mask())
+        unigrams = _bincount_weighted(
+            codes[sounds], log_freqs[sounds], num_sounds
+        )
+        pos_unigrams = _bincount_weighted(
+            positions[sounds] * num_sounds + codes[sounds],
+            log_freqs[sounds],
+            max_len * num_sounds
+        ).reshape(3, max_len, num_sounds)
+
+        # A bigram starts at every code except the final boundary of each
+        #   token
+        starts = np.ones(len(codes), dtype=bool)
+        starts[corpus.offsets[1:] - 1] = False
+        starts = np.flatnonzero(starts)
+        bigrams = _bincount_weighted(
+            codes[starts + 1] * num_sounds + codes[starts],
+            log_freqs[starts],
+            num_sounds * num_sounds
+        ).reshape(3, num_sounds, num_sounds)
+
+        # Positional bigrams only use bigrams that don't touch a boundary
+        inner = (positions[starts] >= 0) & (
+            positions[starts] < lengths[token_ids[starts]] - 1
+        )
+        starts = starts[inner]
+        pos_bigrams = _bincount_weighted(
+            (positions[starts] * num_sounds + codes[starts]) * num_sounds
+            + codes[starts + 1],
+            log_freqs[starts],
+            max(max_len - 1, 0) * num_sounds * num_sounds
+        ).reshape(3, max(max_len - 1, 0), num_sounds, num_sounds)
+
+    higher_orders = {
+        order: count_sparse_ngrams(corpus, order)
+        for order in range(3, max_order + 1)
+    }
+
+    return NgramCounts(
+        corpus.inventory, unigrams, bigrams, pos_unigrams, pos_bigrams,
+        higher_orders
+    ).compacted()
+
+def count_ngrams_streaming(dataset, chunk_size=CHUNK_SIZE, max_order=MAX_ORDER):
+    """
+    Counts a training file without reading it all into memory. The file is
+    read in chunks of tokens, and each chunk is packed, counted and merged
+    into the running counts before the next one is read, so memory use
+    depends on the size of the model rather than the size of the corpus.
+
+    dataset: The path to the dataset.
+    chunk_size: The number of tokens counted at a time.
+    max_order: The highest n-gram order to count.
+
+    returns: An NgramCounts.
+    """
+    counts = NgramCounts.empty(max_order)
+    for chunk in iter_chunks(iter_tokens(dataset), chunk_size):
+        counts.partial_fit(chunk)
+    return counts
+
+def fit_ngram_models(corpus, max_word_len=MAX_WORD_LEN, alpha=SMOOTHING_ALPHA):
+    """
+    Fits all of the ngram models to the provided data and returns the fitted
+    models. The corpus is counted once and every model is derived from the
+    same counts.
+
+    corpus: A PackedCorpus of the training tokens, or the NgramCounts of one.
+    Its inventory is used to map sound identity to matrix dimensions.
+    max_word_len: The number of positions smoothed in the positional models.
+    alpha: The pseudo-count of the smoothed models.
+
+    returns: A list of lists of models. These models are in the same order as
+    defined in the HEADER file at the top of this file, and broken into sublists
+    based on their type (unigram/bigram/positional unigram/positional bigram).
+    A final sublist holds an (order, models) pair for each order above 2 that
+    was counted, as returned by fit_higher_order_models.
+    """
+    counts = corpus if isinstance(corpus, NgramCounts) else count_ngrams(corpus)
+
+    # Get unigram probabilities
+    unigram_models = []
+    with timing_trace.stage('fit', model='unigram'):
+        unigram_models.append(fit_unigrams(counts))
+        unigram_models.append(fit_unigrams(counts, token_weighted=True))
+
+    # Get bigram probabilities
+    bigram_models = []
+    with timing_trace.stage('fit', model='bigram'):
+        bigram_models.append(fit_bigrams(counts))
+        bigram_models.append(fit_bigrams(counts, token_weighted=True))
+        bigram_models.append(fit_bigrams(counts, smoothed=True, alpha=alpha))
+        bigram_models.append(
+            fit_bigrams(counts, smoothed=True, token_weighted=True, alpha=alpha)
+        )
+
+    # Get positional unigram probabilities
+    pos_unigram_models = []
+    with timing_trace.stage('fit', model='positional unigram'):
+        pos_unigram_models.append(
+            fit_positional_unigrams(counts, max_word_len=max_word_len)
+        )
+        pos_unigram_models.append(
+            fit_positional_unigrams(
+                counts, token_weighted=True, max_word_len=max_word_len
+            )
+        )
+        pos_unigram_models.append(
+            fit_positional_unigrams(
+                counts, smoothed=True, max_word_len=max_word_len,
+                alpha=alpha
+            )
+        )
+        pos_unigram_models.append(
+            fit_positional_unigrams(
+                counts, smoothed=True, token_weighted=True,
+                max_word_len=max_word_len, alpha=alpha
+            )
+        )
+
+    # Get positional bigram probabilities
+    pos_bigram_models = []
+    with timing_trace.stage('fit', model='positional bigram'):
+        pos_bigram_models.append(
+            fit_positional_bigrams(counts, max_word_len=max_word_len)
+        )
+        pos_bigram_models.append(
+            fit_positional_bigrams(
+                counts, token_weighted=True, max_word_len=max_word_len
+            )
+        )
+        pos_bigram_models.append(
+            fit_positional_bigrams(
+                counts, smoothed=True, max_word_len=max_word_len,
+                alpha=alpha
+            )
+        )
+        pos_bigram_models.append(
+            fit_positional_bigrams(
+                counts, smoothed=True, token_weighted=True,
+                max_word_len=max_word_len, alpha=alpha
+            )
+        )
+
+    # Get higher-order probabilities
+    higher_order_models = []
+    for order in sorted(counts.higher_orders):
+        with timing_trace.stage('fit', model=f'order {order}'):
+            higher_order_models.append((
+                order,
+                fit_higher_order_models(
+                    counts.higher_orders[order], max_word_len, alpha
+                )
+            ))
+
+    return (
+        unigram_models, bigram_models, pos_unigram_models, pos_bigram_models,
+        higher_order_models
+    )
+
+def fit_unigrams(counts, token_weighted=False):
+    """
+    This function takes the counts of a set of word tokens and returns an array
+    of log unigram probabilities indexed by sound code. Smoothing isn't
+    implemented for standard unigram scores: we assume the set of sounds in
+    the training data is the full set of sounds.
+
+    counts: The NgramCounts of the training tokens.
+    token_weighted: If true, counts are weighted by log frequency of token
+
+    returns: An array of log unigram probabilities. The word boundary never
+    occurs as a unigram and has a log probability of -inf.
+    """
+    unigram_freqs = select_counts(counts.unigrams, token_weighted)
+
+    total_sounds = np.sum(unigram_freqs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unigram_probs = np.log(unigram_freqs / total_sounds)
+    return unigram_probs
+
+def fit_bigrams(counts, token_weighted=False, smoothed=False,
+                alpha=SMOOTHING_ALPHA):
+    """
+    This function takes the counts of a set of word tokens and returns a matrix
+    of bigrams probabilities. The matrix covers every pair of sounds in the
+    inventory because we include counts of 0 for unattested bigram
+    combinations.
+
+    counts: The NgramCounts of the training tokens.
+
+    token_weighted: if True, counts are weighted by the log frequency
+    of the words they occur in.
+
+    smoothed: if True, start with a pseudo-count of alpha for every bigram.
+
+    alpha: The pseudo-count of the smoothed model. It is added to the count
+    of each bigram and, once for each sound, to the total of each context,
+    rather than to a matrix of pseudo-counts before normalizing. The
+    weighted counts are therefore added to the pseudo-counts in a different
+    order than the per-word code did, and the weighted smoothed model can
+    differ from it in the last few bits (see NgramCounts).
+
+    returns: A matrix of bigram probabilities, where rows correspond to the second
+    sound in the bigram and columns correspond to the first.
+    """
+    count_matrix = select_counts(counts.bigrams, token_weighted)
+    totals = np.sum(count_matrix, 0)
+
+    if smoothed:
+        count_matrix = count_matrix + alpha
+        totals = totals + alpha * len(count_matrix)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bigram_probs = np.log(count_matrix / totals)
+    return bigram_probs
+
+def fit_positional_unigrams(counts, token_weighted=False, smoothed=False,
+                            max_word_len=MAX_WORD_LEN, alpha=SMOOTHING_ALPHA):
+    """
+    This function takes the counts of a set of word tokens and returns an array
+    containing positional unigram scores.
+
+    counts: The NgramCounts of the training tokens.
+
+    token_weighted: If True, counts are weighted by log frequency of token.
+
+    smoothed: If True, each start with a pseudo-count of alpha for every unigram
+    in every position up to max_word_len. Note that this smoothing does not
+    allow unseen unigrams to get probabilities > 0: rather it assigns known
+    unigrams in unknown positions probabilities > 0.
+
+    max_word_len: The number of positions that are smoothed. If None, every
+    position is smoothed.
+
+    alpha: The pseudo-count of the smoothed model.
+
+    returns: A read-only array of shape (P + 1, V) mapping positions and sound
+    codes to scores. P covers the longest training token (and max_word_len);
+    the final row holds the scores for every position beyond that.
+    """
+    pos_unigram_freqs, attested, pseudo_counts = _positional_counts(
+        counts.pos_unigrams, counts.sounds(), token_weighted, smoothed,
+        max_word_len, alpha
+    )
+    return normalize_positional_counts(
+        pos_unigram_freqs, attested, pseudo_counts
+    )
+
+def fit_positional_bigrams(counts, token_weighted=False, smoothed=False,
+                           max_word_len=MAX_WORD_LEN, alpha=SMOOTHING_ALPHA):
+    """
+    This function takes the counts of a set of word tokens and returns an array
+    containing positional bigram scores.
+
+    counts: The NgramCounts of the training tokens.
+
+    token_weighted: If True, counts are weighted by log frequency of token.
+
+    smoothed: If True, each start with a pseudo-count of alpha for every bigram
+    in every pair of positions up to max_word_len.
+
+    max_word_len: The number of positions that are smoothed. If None, every
+    pair of positions is smoothed.
+
+    alpha: The pseudo-count of the smoothed model.
+
+    returns: A read-only array of shape (P, V, V) mapping the position of the
+    first sound and the codes of the first and second sound to scores. The
+    final row holds the scores for every pair of positions beyond the
+    longest training token (and max_word_len).
+    """
+    sounds = counts.sounds()
+    pos_bigram_freqs, attested, pseudo_counts = _positional_counts(
+        counts.pos_bigrams, np.ix_(sounds, sounds), token_weighted, smoothed,
+        None if max_word_len is None else max_word_len - 1, alpha
+    )
+    return normalize_positional_counts(
+        pos_bigram_freqs, attested, pseudo_counts
+    )
+
+def _positional_counts(counts, smoothed_grams, token_weighted, smoothed,
+                       num_smoothed, alpha=SMOOTHING_ALPHA):
+    """
+    Selects the positional counts for one model, adds a final row for the
+    positions beyond the counted ones and works out the pseudo-counts.
+
+    counts: The positional counts in the NgramCounts layout, with positions on
+    the second axis.
+    smoothed_grams: An index into the gram axes selecting the grams that
+    receive a pseudo-count.
+    token_weighted: If True, the weighted counts are used.
+    smoothed: If True, every gram in smoothed_grams gets a pseudo-count of
+    alpha in each of the first num_smoothed positions.
+    num_smoothed: The number of positions that are smoothed, or None to
+    smooth every position.
+    alpha: The pseudo-count.
+
+    returns: The counts, a boolean array marking the attested entries, and
+    the pseudo-counts as a pair: the pseudo-count of each position and a
+    boolean mask of the grams that receive it.
+    """
+    gram_counts = select_counts(counts, token_weighted)
+    attested = counts[0] > 0
+
+    # Positions up to the smoothing bound need their own row, and the final
+    # row stands in for every position after the last one
+    num_positions = len(gram_counts)
+    if smoothed and num_smoothed is not None:
+        num_positions = max(num_positions, num_smoothed)
+    padding = [(0, num_positions + 1 - len(gram_counts))] + [(0, 0)] * (
+        gram_counts.ndim - 1
+    )
+    gram_counts = np.pad(gram_counts, padding)
+    attested = np.pad(attested, padding)
+
+    position_pseudo_counts = np.zeros(num_positions + 1)
+    gram_mask = np.zeros(gram_counts.shape[1:], dtype=bool)
+    if smoothed:
+        position_pseudo_counts[:num_smoothed] = alpha
+        gram_mask[smoothed_grams] = True
+
+    return gram_counts, attested, (position_pseudo_counts, gram_mask)
+
+def normalize_positional_counts(counts, attested, pseudo_counts=None):
+    """
+    Normalizes positional counts by total counts for each position. Entries
+    that were never attested get a score of -0.0, which adds nothing to a
+    score but lets scoring tell them from attested entries that score 0. The
+    result is read-only so that scoring can never change a fitted model.
+
+    Smoothing is applied here rather than by adding pseudo-counts to the
+    counts first: the total of a smoothed position is its attested total
+    plus the pseudo-count times the number of smoothed grams, and each entry
+    is (count + pseudo-count) / total. Like the totals, this adds the
+    weighted counts in a different order than the per-word code did, so the
+    weighted models can differ from it in the last few bits (see
+    NgramCounts).
+
+    counts: The positional counts, with positions on the first axis.
+    attested: A boolean array marking the attested entries.
+    pseudo_counts: The pseudo-counts, as returned by _positional_counts, or
+    None for an unsmoothed model.
+    """
+    shape = (-1,) + (1,) * (counts.ndim - 1)
+    totals = np.sum(
+        np.where(attested, counts, 0).reshape(len(counts), -1), 1
+    )
+    if pseudo_counts is not None:
+        position_pseudo_counts, gram_mask = pseudo_counts
+        totals = totals + position_pseudo_counts * np.count_nonzero(gram_mask)
+        pseudo = position_pseudo_counts.reshape(shape) * gram_mask
+        counts = counts + pseudo
+        attested = attested | (pseudo > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Adding 0.0 turns an attested -0.0 into 0.0
+        scores = np.where(attested, counts / totals.reshape(shape) + 0.0, -0.0)
+    scores.setflags(write=False)
+    return scores
+
+########################################
+# Code for fitting higher-order models #
+########################################
+
+class SparseNgramCounts:
+    """
+    The counts of the n-grams of one order, stored sparsely so that memory
+    grows with the number of attested n-grams rather than with V ** order.
+    Each n-gram is packed into one int64 key, with its sounds as the digits
+    of a base V number and the first sound as the most significant digit, so
+    the n-grams that share a context have contiguous keys once sorted. The
+    counts have the same three rows as the arrays of an NgramCounts.
+
+    The n-grams of a token run over the token with order - 1 word boundaries
+    before it and one after it, so each token has len + 1 n-grams, like
+    bigrams do. Positional n-grams only use the n-grams that don't touch a
+    boundary, and are keyed by the position of their first sound times
+    V ** order plus the key of the n-gram.
+
+    inventory: The SoundInventory the digits of the keys refer to.
+    order: The number of sounds in each n-gram.
+    keys: A sorted int64 array with the key of each attested n-gram.
+    counts: The counts of each n-gram in keys, shape (3, G).
+    pos_keys: A sorted int64 array with the key of each attested positional
+    n-gram.
+    pos_counts: The counts of each positional n-gram in pos_keys, shape
+    (3, G').
+    """
+    def __init__(self, inventory, order, keys, counts, pos_keys, pos_counts):
+        self.inventory = inventory
+        self.order = order
+        self.keys = keys
+        self.counts = counts
+        self.pos_keys = pos_keys
+        self.pos_counts = pos_counts
+
+    @property
+    def gram_size(self):
+        """
+        The number of possible n-grams, which the positional keys are
+        multiplied by.
+        """
+        return len(self.inventory) ** self.order
+
+    @property
+    def num_positions(self):
+        """
+        The number of positions that have positional n-gram counts.
+        """
+        if not len(self.pos_keys):
+            return 0
+        return int(self.pos_keys[-1] // self.gram_size) + 1
+
+    def copy(self):
+        """
+        Returns an independent copy of the counts.
+        """
+        return SparseNgramCounts(
+            self.inventory, self.order, self.keys.copy(), self.counts.copy(),
+            self.pos_keys.copy(), self.pos_counts.copy()
+        )
+
+    def reindexed(self, inventory):
+        """
+        Returns the counts with their keys rewritten for another inventory,
+        which must contain every counted sound.
+
+        inventory: The SoundInventory to rewrite the keys for.
+
+        returns: A SparseNgramCounts, or these counts if the inventory is the
+        same.
+        """
+        if inventory == self.inventory:
+            return self
+        _check_key_range(len(inventory), self.order, self.num_positions)
+        lookup = inventory.lookup(self.inventory).astype(np.int64)
+        keys, counts = _rekeyed(
+            self.keys, self.counts, lookup, len(self.inventory),
+            len(inventory), self.order
+        )
+        pos_keys, pos_counts = _rekeyed(
+            self.pos_keys, self.pos_counts, lookup, len(self.inventory),
+            len(inventory), self.order
+        )
+        return SparseNgramCounts(
+            inventory, self.order, keys, counts, pos_keys, pos_counts
+        )
+
+    def combined(self, other, sign):
+        """
+        Returns the sum of these counts and sign times the counts of other,
+        dropping the n-grams that no longer have any counts. Both must use
+        the same inventory.
+
+        other: The SparseNgramCounts to add or remove.
+        sign: 1 to add the counts of other, -1 to remove them.
+
+        returns: A new SparseNgramCounts.
+        """
+        keys, counts = _sparse_sum(
+            self.keys, self.counts, other.keys, sign * other.counts
+        )
+        pos_keys, pos_counts = _sparse_sum(
+            self.pos_keys, self.pos_counts, other.pos_keys,
+            sign * other.pos_counts
+        )
+        return SparseNgramCounts(
+            self.inventory, self.order, keys, counts, pos_keys, pos_counts
+        )
+
+class SparseNgramModel:
+    """
+    A higher-order model fitted from SparseNgramCounts. Only the scores of
+    the attested n-grams are stored. Every other n-gram gets the score of its
+    group, which is its context for the n-gram models and its position for
+    the positional ones, or a default score if the group is unseen as well.
+
+    keys: A sorted int64 array with the keys of the attested n-grams.
+    scores: The score of each n-gram in keys.
+    group_keys: A sorted int64 array with the keys of the seen groups.
+    group_scores: The score of an unattested n-gram in each group.
+    default: The score of an n-gram whose group was never seen.
+    """
+    def __init__(self, keys, scores, group_keys, group_scores, default):
+        self.keys = keys
+        self.scores = scores
+        self.group_keys = group_keys
+        self.group_scores = group_scores
+        self.default = default
+
+    def lookup(self, keys, groups):
+        """
+        Returns the score of each of a set of n-grams.
+
+        keys: An int64 array with the keys of the n-grams.
+        groups: An int64 array with the group of each n-gram.
+
+        returns: An array of scores.
+        """
+        scores = np.full(len(keys), self.default, dtype=np.float64)
+        found, index = _sparse_find(self.group_keys, groups)
+        scores[found] = self.group_scores[index[found]]
+        found, index = _sparse_find(self.keys, keys)
+        scores[found] = self.scores[index[found]]
+        return scores
+
+def count_sparse_ngrams(corpus, order):
+    """
+    Counts the n-grams and positional n-grams of one order in a corpus, both
+    unweighted and weighted by the log frequency of each token.
+
+    corpus: A PackedCorpus of the training tokens.
+    order: The number of sounds in each n-gram.
+
+    returns: A SparseNgramCounts.
+    """
+    num_symbols = len(corpus.inventory)
+    max_len = int(corpus.lengths.max()) if len(corpus) else 0
+    _check_key_range(num_symbols, order, max_len)
+    with timing_trace.stage(
+        'count', model=f'order {order}', tokens=len(corpus)
+    ):
+        with np.errstate(divide='ignore'):
+            log_freqs = np.log(corpus.freqs)
+
+        tokens, _, grams = _ngrams(corpus, order, positional=False)
+        keys, counts = _sparse_bincount(
+            _gram_keys(grams, num_symbols), log_freqs[tokens]
+        )
+
+        tokens, positions, grams = _ngrams(corpus, order, positional=True)
+        pos_keys, pos_counts = _sparse_bincount(
+            positions * num_symbols ** order + _gram_keys(grams, num_symbols),
+            log_freqs[tokens]
+        )
+
+    return SparseNgramCounts(
+        corpus.inventory, order, keys, counts, pos_keys, pos_counts
+    )
+
+def fit_higher_order_models(counts, max_word_len=MAX_WORD_LEN,
+                            alpha=SMOOTHING_ALPHA):
+    """
+    Fits the n-gram and positional n-gram models of one order.
+
+    counts: The SparseNgramCounts of the training tokens.
+    max_word_len: The number of positions smoothed in the positional models.
+    alpha: The pseudo-count of the smoothed models.
+
+    returns: A list of SparseNgramModels, in the order of the columns that
+    build_header adds for the order.
+    """
+    models = []
+    for smoothed in [False, True]:
+        for token_weighted in [False, True]:
+            models.append(
+                fit_sparse_ngrams(counts, token_weighted, smoothed, alpha)
+            )
+    for smoothed in [False, True]:
+        for token_weighted in [False, True]:
+            models.append(
+                fit_sparse_positional_ngrams(
+                    counts, token_weighted, smoothed, max_word_len, alpha
+                )
+            )
+    return models
+
+def fit_sparse_ngrams(counts, token_weighted=False, smoothed=False,
+                      alpha=SMOOTHING_ALPHA):
+    """
+    Fits an n-gram model, where the probability of an n-gram is the
+    probability of its last sound given the sounds before it. This
+    generalizes fit_bigrams: the probabilities are the same as those of a
+    dense matrix over every n-gram in the inventory, they are just only
+    stored for the attested ones.
+
+    counts: The SparseNgramCounts of the training tokens.
+
+    token_weighted: if True, counts are weighted by the log frequency
+    of the words they occur in.
+
+    smoothed: if True, start with a pseudo-count of alpha for every n-gram.
+    An n-gram whose context was never seen then has a probability of 1 / V,
+    and otherwise a probability of 0.
+
+    alpha: The pseudo-count of the smoothed model.
+
+    returns: A SparseNgramModel of log probabilities, grouped by context.
+    """
+    num_symbols = len(counts.inventory)
+    context_keys, contexts = np.unique(
+        counts.keys // num_symbols, return_inverse=True
+    )
+    context_counts = select_counts(
+        np.stack([
+            np.bincount(contexts, weights=plane, minlength=len(context_keys))
+            for plane in counts.counts
+        ]),
+        token_weighted
+    )
+    gram_counts = select_counts(counts.counts, token_weighted)
+
+    pseudo_count = alpha if smoothed else 0
+    if smoothed:
+        gram_counts = gram_counts + alpha
+        context_counts = context_counts + alpha * num_symbols
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gram_probs = np.log(gram_counts / context_counts[contexts])
+        unattested_probs = np.log(pseudo_count / context_counts)
+        default = np.log(1 / num_symbols) if smoothed else -np.inf
+    return SparseNgramModel(
+        counts.keys, gram_probs, context_keys, unattested_probs, default
+    )
+
+def fit_sparse_positional_ngrams(counts, token_weighted=False, smoothed=False,
+                                 max_word_len=MAX_WORD_LEN,
+                                 alpha=SMOOTHING_ALPHA):
+    """
+    Fits a positional n-gram model. This generalizes fit_positional_bigrams:
+    scores are normalized by the total count of each position, and smoothing
+    gives every n-gram of seen sounds a pseudo-count of alpha in each smoothed
+    position.
+
+    counts: The SparseNgramCounts of the training tokens.
+
+    token_weighted: If True, counts are weighted by log frequency of token.
+
+    smoothed: If True, each start with a pseudo-count of alpha for every
+    n-gram of seen sounds in every position up to max_word_len.
+
+    max_word_len: The number of positions that are smoothed. If None, every
+    position is smoothed.
+
+    alpha: The pseudo-count of the smoothed model.
+
+    returns: A SparseNgramModel of scores, grouped by position. The final
+    group holds the scores of every position beyond the longest training
+    token (and max_word_len).
+    """
+    order = counts.order
+    positions = counts.pos_keys // counts.gram_size
+    num_positions = counts.num_positions
+    totals = select_counts(
+        np.stack([
+            np.bincount(positions, weights=plane, minlength=num_positions)
+            for plane in counts.pos_counts
+        ]),
+        token_weighted
+    )
+    gram_counts = select_counts(counts.pos_counts, token_weighted)
+
+    # Positions up to the smoothing bound need their own entry, and the final
+    #   entry stands in for every position after the last one
+    num_smoothed = None
+    if max_word_len is not None:
+        num_smoothed = max(max_word_len - (order - 1), 0)
+    if smoothed and num_smoothed is not None:
+        num_positions = max(num_positions, num_smoothed)
+    totals = np.pad(totals, (0, num_positions + 1 - len(totals)))
+
+    pseudo_counts = np.zeros(num_positions + 1)
+    if smoothed:
+        pseudo_counts[:num_smoothed] = alpha
+    # The boundary never occurs in a positional n-gram
+    totals = totals + pseudo_counts * (len(counts.inventory) - 1) ** order
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gram_scores = (gram_counts + pseudo_counts[positions]) / totals[positions]
+        unattested_scores = np.where(
+            pseudo_counts > 0, pseudo_counts / totals, 0
+        )
+    return SparseNgramModel(
+        counts.pos_keys, gram_scores, np.arange(num_positions + 1),
+        unattested_scores, 0
+    )
+
+def _ngrams(corpus, order, positional):
+    """
+    Finds the n-grams of one order in every token of a corpus, in order.
+
+    corpus: A PackedCorpus.
+    order: The number of sounds in each n-gram.
+    positional: If True, only the n-grams that don't touch a word boundary
+    are returned. Otherwise the tokens are padded with order - 1 word
+    boundaries before them and one after them.
+
+    returns: The token of each n-gram, the index of each n-gram within its
+    token (the position of its first sound for positional n-grams), and an
+    int64 array of shape (order, G) with the codes of the sounds of each
+    n-gram.
+    """
+    codes = corpus.codes.astype(np.int64)
+    positions = corpus.positions()
+    token_ids = np.repeat(np.arange(len(corpus)), corpus.lengths + 2)
+
+    if positional:
+        # A positional n-gram ends at every sound that has order - 1 sounds
+        #   before it
+        ends = np.flatnonzero(
+            (positions >= order - 1)
+            & (positions < corpus.lengths[token_ids])
+        )
+        index = positions[ends] - (order - 1)
+        grams = np.stack([
+            codes[ends - back] for back in range(order - 1, -1, -1)
+        ]) if len(ends) else np.zeros((order, 0), dtype=np.int64)
+        return token_ids[ends], index, grams
+
+    # An n-gram ends at every code but the initial boundary, and the sounds
+    #   before the initial boundary are boundaries too
+    ends = np.flatnonzero(positions >= 0)
+    index = positions[ends]
+    grams = np.stack([
+        np.where(
+            index - back >= -1,
+            codes[np.maximum(ends - back, 0)],
+            corpus.inventory.boundary
+        )
+        for back in range(order - 1, -1, -1)
+    ]) if len(ends) else np.zeros((order, 0), dtype=np.int64)
+    return token_ids[ends], index, grams
+
+def _gram_keys(grams, num_symbols):
+    """
+    Packs the codes of a set of n-grams into keys.
+
+    grams: An int64 array of shape (order, G).
+    num_symbols: The size of the inventory the codes refer to.
+
+    returns: An int64 array of keys. The keys of n-grams containing
+    UNKNOWN_SOUND are meaningless and have to be masked by the caller.
+    """
+    keys = np.zeros(grams.shape[1], dtype=np.int64)
+    for codes in grams:
+        keys = keys * num_symbols + codes
+    return keys
+
+def _check_key_range(num_symbols, order, num_positions):
+    """
+    Raises a ValueError if the positional keys of an order could overflow an
+    int64.
+    """
+    if num_symbols ** order * (num_positions + 1) >= 2 ** 63:
+        raise ValueError(
+            f"Can't count {order}-grams of {num_symbols} symbols in tokens of "
+            f"{num_positions} sounds: the keys would overflow."
+        )
+
+def _sparse_bincount(keys, weights):
+    """
+    Counts how often each key occurs, both unweighted and weighted, in the
+    layout of an NgramCounts.
+
+    returns: A sorted array of the distinct keys and their counts.
+    """
+    unique_keys, index = np.unique(keys, return_inverse=True)
+    return unique_keys, _bincount_weighted(
+        index.ravel(), weights, len(unique_keys)
+    )
+
+def _sparse_sum(keys, counts, other_keys, other_counts):
+    """
+    Adds two sets of sparse counts, dropping the keys without any counts left.
+    """
+    unique_keys, index = np.unique(
+        np.concatenate([keys, other_keys]), return_inverse=True
+    )
+    index = index.ravel()
+    summed = np.stack([
+        np.bincount(index, weights=plane, minlength=len(unique_keys))
+        for plane in np.concatenate([counts, other_counts], 1)
+    ])
+    if np.any(summed[0] < 0):
+        raise ValueError(
+            "Can't subtract counts of tokens that were not counted."
+        )
+    kept = summed[0] > 0
+    return unique_keys[kept], summed[:, kept]
+
+def _rekeyed(keys, counts, lookup, old_size, new_size, order):
+    """
+    Rewrites keys packed in base old_size as keys packed in base new_size,
+    translating each sound through lookup, and sorts them again.
+    """
+    prefixes, grams = np.divmod(keys, old_size ** order)
+    new_keys = prefixes * new_size ** order
+    for digit in range(order - 1, -1, -1):
+        codes = grams // old_size ** digit % old_size
+        new_keys += lookup[codes] * new_size ** digit
+    sort = np.argsort(new_keys, kind='stable')
+    return new_keys[sort], counts[:, sort]
+
+def _sparse_find(sorted_keys, keys):
+    """
+    Finds keys in a sorted array of keys.
+
+    returns: A boolean array marking the keys that were found, and the index
+    of each found key in sorted_keys.
+    """
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=int)
+    index = np.minimum(
+        np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1
+    )
+    return sorted_keys[index] == keys, index
+
+###########################
+# Code for testing models #
+###########################
+
+def score_corpus(corpus, fitted_models):
+    """
+    Given a dataset and a list of fitted models, returns the score for each 
+    word under each model.
+
+    corpus: A PackedCorpus of the test tokens, encoded against the inventory
+    the models were fitted with. Frequencies aren't used in this function.
+
+    fitted_models: A list of lists of models. These models are in the same order as
+    defined in the HEADER file at the top of this file, and broken into sublists
+    based on their type (unigram/bigram/positional unigram/positional bigram).
+
+    returns: A list of lists of scores. Each sublist corresponds to one word. Each
+    sublist contains the word itself, its length, and its score under each of the
+    ngram models.
+    """
+    return _result_rows(corpus, *_score_batch(corpus, fitted_models))
+
+def _result_rows(corpus, scores, unattested):
+    """
+    Lays scores out as result rows: the word, its length and its score under
+    each model. A positional score that no attested entry of the model added
+    to is the int 1 the score starts from, so it is written as 1 like the
+    per-word scorers write it, rather than as 1.0.
+
+    corpus: The PackedCorpus that was scored.
+    scores: The scores, as returned by score_batch.
+    unattested: A boolean array the shape of scores marking those scores.
+
+    returns: A list of result rows.
+    """
+    rows = scores.tolist()
+    for idx, column in zip(*np.nonzero(unattested)):
+        rows[idx][column] = 1
+    return [
+        [word, length] + row
+        for word, length, row in zip(
+            corpus.words(), corpus.lengths.tolist(), rows
+        )
+    ]
+
+class ScoreMemo:
+    """
+    Remembers the scores of tokens under one set of fitted models, keyed by
+    the encoded token, so a token that occurs in several test sets (or is
+    requested again) is only scored once. Sounds missing from the model all
+    share one code, so tokens that only differ in unseen sounds share their
+    scores too, as they would score the same anyway.
+
+    fitted_models: The fitted models, as returned by fit_ngram_models.
+    max_size: The maximum number of tokens to remember, dropping the least
+    recently used ones beyond that. If None, every token is remembered.
+    """
+    def __init__(self, fitted_models, max_size=None):
+        self.fitted_models = fitted_models
+        self.max_size = max_size
+        self._scores = OrderedDict()
+        # Memos are shared between the threads of the scoring service
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def score_batch(self, corpus):
+        """
+        Scores every word of a dataset, scoring only the tokens that haven't
+        been scored before. Takes the same arguments as score_batch.
+
+        returns: An array with a row for each word and a column for each
+        model.
+        """
+        return self._score_batch(corpus)[0]
+
+    def score_corpus(self, corpus):
+        """
+        Scores a dataset like score_corpus, reusing the remembered scores.
+        """
+        return _result_rows(corpus, *self._score_batch(corpus))
+
+    def _score_batch(self, corpus):
+        """
+        Returns the scores of a dataset and the unattested positional scores
+        among them, as _score_batch does.
+        """
+        if not len(corpus):
+            return _score_batch(corpus, self.fitted_models)
+        keys = [corpus.token(i).tobytes() for i in range(len(corpus))]
+
+        # Take the remembered scores this corpus needs, so they can't be
+        #   dropped before they are used
+        found = {}
+        unscored = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in found or key in unscored:
+                    continue
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[key] = self._scores[key]
+                else:
+                    unscored[key] = i
+
+        if unscored:
+            scores, unattested = _score_batch(
+                corpus.subset(list(unscored.values())), self.fitted_models
+            )
+            new_scores = dict(zip(unscored, zip(scores, unattested)))
+            found.update(new_scores)
+            with self._lock:
+                self._scores.update(new_scores)
+                if self.max_size is not None:
+                    while len(self._scores) > self.max_size:
+                        self._scores.popitem(last=False)
+
+        return (
+            np.stack([found[key][0] for key in keys]),
+            np.stack([found[key][1] for key in keys])
+        )
+
+def score_batch(corpus, fitted_models):
+    """
+    Scores every word of a dataset under every model at once. The words are
+    laid out as a padded matrix of sound codes, so each model is applied with
+    one gather per position rather than one lookup per sound.
+
+    corpus: A PackedCorpus of the test tokens, encoded against the inventory
+    the models were fitted with.
+
+    fitted_models: A list of lists of models, as returned by fit_ngram_models.
+
+    returns: An array with a row for each word and a column for each model, in
+    the order of the score columns of build_header.
+    """
+    return _score_batch(corpus, fitted_models)[0]
+
+def _score_batch(corpus, fitted_models):
+    """
+    Scores a dataset like score_batch, and also marks the positional unigram
+    and bigram scores that no attested entry of the model added to.
+
+    returns: The array of scores, and a boolean array of the same shape that
+    is True for those scores.
+    """
+    (uni_models, bi_models, pos_uni_models, pos_bi_models,
+     higher_order_models) = fitted_models
+
+    padded, mask = corpus.padded()
+    lengths = corpus.lengths[:, None]
+    sounds = padded[:, 1:]
+    sound_mask = np.arange(sounds.shape[1]) < lengths
+    bigram_mask = np.arange(padded.shape[1] - 1) < lengths + 1
+    pos_bigram_mask = np.arange(sounds.shape[1] - 1) < lengths - 1
+
+    columns = []
+    unattested = {}
+
+    with timing_trace.stage('score', model='unigram', tokens=len(corpus)):
+        for model in uni_models:
+            columns.append(
+                _sum_positions(_gather_unigrams(sounds, model), sound_mask, 0)
+            )
+
+    with timing_trace.stage('score', model='bigram', tokens=len(corpus)):
+        for model in bi_models:
+            columns.append(
+                _sum_positions(
+                    _gather_bigrams(padded[:, :-1], padded[:, 1:], model),
+                    bigram_mask, 0
+                )
+            )
+
+    with timing_trace.stage(
+        'score', model='positional unigram', tokens=len(corpus)
+    ):
+        for model in pos_uni_models:
+            values = _gather_pos_unigrams(sounds, model)
+            unattested[len(columns)] = _unattested(values, sound_mask)
+            columns.append(_sum_positions(values, sound_mask, 1))
+
+    with timing_trace.stage(
+        'score', model='positional bigram', tokens=len(corpus)
+    ):
+        for model in pos_bi_models:
+            values = _gather_pos_bigrams(sounds[:, :-1], sounds[:, 1:], model)
+            unattested[len(columns)] = _unattested(values, pos_bigram_mask)
+            columns.append(_sum_positions(values, pos_bigram_mask, 1))
+
+    for order, models in higher_order_models:
+        with timing_trace.stage(
+            'score', model=f'order {order}', tokens=len(corpus)
+        ):
+            columns.extend(_score_higher_order(corpus, order, models))
+
+    scores = np.stack(columns, 1)
+    unattested_scores = np.zeros(scores.shape, dtype=bool)
+    for column, flags in unattested.items():
+        unattested_scores[:, column] = flags
+    return scores, unattested_scores
+
+def _score_higher_order(corpus, order, models):
+    """
+    Scores every word of a dataset under the models of one order above 2.
+
+    corpus: A PackedCorpus of the test tokens, encoded against the inventory
+    the models were fitted with.
+    order: The number of sounds in each n-gram.
+    models: The models of the order, as returned by fit_higher_order_models.
+
+    returns: A list with a column of scores for each model.
+    """
+    num_symbols = len(corpus.inventory)
+    width = int(corpus.lengths.max()) + 1 if len(corpus) else 1
+    columns = []
+
+    for positional, start in [(False, 0), (True, 1)]:
+        tokens, index, grams = _ngrams(corpus, order, positional)
+        keys = _gram_keys(grams, num_symbols)
+        known = np.all(grams != UNKNOWN_SOUND, 0)
+        if positional:
+            # n-grams with an unseen sound score 0, and positions beyond the
+            #   model share its final group
+            keys = index * num_symbols ** order + keys
+            unknown_score = 0
+        else:
+            # n-grams with an unseen sound get a log probability of -inf
+            unknown_score = -np.inf
+
+        # Lay the scores out by word so they are added up in order
+        mask = np.zeros((len(corpus), width), dtype=bool)
+        mask[tokens, index] = True
+        for model in models[4:] if positional else models[:4]:
+            if positional:
+                groups = np.minimum(index, len(model.group_keys) - 1)
+            else:
+                groups = keys // num_symbols
+            values = np.zeros(mask.shape)
+            values[tokens, index] = np.where(
+                known, model.lookup(keys, groups), unknown_score
+            )
+            columns.append(_sum_positions(values, mask, start))
+
+    return columns
+
+def _sum_positions(values, mask, start):
+    """
+    Sums each row of values over the entries in mask, adding one position at a
+    time so that the sums match adding up each word's scores in order.
+
+    values: The per-position scores, one row per word.
+    mask: A boolean array marking which entries of values to include.
+    start: The value each sum starts from.
+
+    returns: An array with the sum of each row.
+    """
+    scores = np.full(len(values), start, dtype=np.float64)
+    for idx in range(values.shape[1]):
+        scores += np.where(mask[:, idx], values[:, idx], 0)
+    return scores
+
+def _unattested(values, mask):
+    """
+    Marks the rows of positional scores where every entry in mask is an
+    unattested entry of the model, which positional models score as -0.0.
+    """
+    unattested = (values == 0) & np.signbit(values)
+    return np.all(unattested | ~mask, 1)
+
+def _gather_unigrams(sounds, unigram_probs):
+    """
+    Looks up the log probability of each sound in a matrix of codes. Sounds
+    that were not seen in training get a log probability of -inf.
+    """
+    known = sounds != UNKNOWN_SOUND
+    return np.where(known, unigram_probs[np.where(known, sounds, 0)], -np.inf)
+
+def _gather_bigrams(first, second, bigram_probs):
+    """
+    Looks up the log probability of each bigram, given matrices of the codes
+    of the first and second sounds. Bigrams containing a sound that was not
+    seen in training get a log probability of -inf.
+    """
+    known = (first != UNKNOWN_SOUND) & (second != UNKNOWN_SOUND)
+    return np.where(
+        known,
+        bigram_probs[np.where(known, second, 0), np.where(known, first, 0)],
+        -np.inf
+    )
+
+def _gather_pos_unigrams(sounds, pos_uni_freqs):
+    """
+    Looks up the positional score of each sound in a matrix of codes. Columns
+    beyond the model share its final row, and unseen sounds score -0.0, as
+    unattested entries do.
+    """
+    rows = np.minimum(np.arange(sounds.shape[1]), len(pos_uni_freqs) - 1)
+    known = sounds != UNKNOWN_SOUND
+    return np.where(
+        known, pos_uni_freqs[rows, np.where(known, sounds, 0)], -0.0
+    )
+
+def _gather_pos_bigrams(first, second, pos_bi_freqs):
+    """
+    Looks up the positional score of each bigram, given matrices of the codes
+    of the first and second sounds. Columns beyond the model share its final
+    row, and bigrams containing an unseen sound score -0.0, as unattested
+    entries do.
+    """
+    rows = np.minimum(np.arange(first.shape[1]), len(pos_bi_freqs) - 1)
+    known = (first != UNKNOWN_SOUND) & (second != UNKNOWN_SOUND)
+    return np.where(
+        known,
+        pos_bi_freqs[
+            rows, np.where(known, first, 0), np.where(known, second, 0)
+        ],
+        -0.0
+    )
+
+def get_unigram_prob(word, unigram_probs):
+    """
+    Calculcates the unigram probability of a word given a fitted unigram model
+
+    word: The sound codes of the test word
+    ungiram_probs: The fitted model
+
+    returns: The log probability of the word under the unigram model.
+    """
+    prob = 0
+    for sound in word:
+        # Add basic smoothing for sounds that appear in test data but
+        #   not training data. Use float('-inf') because we are
+        #   using log probabilities.
+        if sound == UNKNOWN_SOUND:
+            prob += float('-inf')
+        else:
+            prob += unigram_probs[sound]
+
+    return prob
+
+def get_bigram_prob(word, bigram_probs):
+    """
+    Calculcates the bigram probability of a word given a fitted bigram model
+
+    word: The sound codes of the test word, including the word boundaries at
+    either end
+    bigram_probs: The fitted model
+
+    returns: The log probability of the word under the bigram model.
+    """
+    prob = 0
+    for s1, s2 in zip(word[:-1], word[1:]):
+        if s1 == UNKNOWN_SOUND or s2 == UNKNOWN_SOUND:
+            # If bigram contains symbol we haven't seen, assign 0 probability
+            prob += float('-inf')
+        else:
+            prob += bigram_probs[s2, s1]
+
+    return prob
+
+def get_pos_unigram_score(word, pos_uni_freqs):
+    """
+    Calculcates the positional unigram score of a word given a fitted 
+    positional unigram model.
+
+    word: The sound codes of the test word
+    pos_uni_freqs: The fitted positional unigram model
+
+    returns: The score of the word under the positional unigram model. Following
+    Vitevich & Luce (2004), we add 1 to these scores.
+    """
+    score = 1
+    last = len(pos_uni_freqs) - 1
+
+    for idx, sound in enumerate(word):
+        # Unseen sounds add nothing, and positions beyond the model share
+        #   its final row
+        if sound != UNKNOWN_SOUND:
+            score += pos_uni_freqs[min(idx, last), sound]
+
+    return score
+
+def get_pos_bigram_score(word, pos_bi_freqs):
+    """
+    Calculcates the positional bigram score of a word given a fitted 
+    positional bigram model.
+
+    word: The sound codes of the test word
+    pos_bi_freqs: The fitted positional bigram model
+
+    returns: The score of the word under the positional unigram model. Following
+    Vitevich & Luce (2004), we add 1 to these scores.
+    """
+    score = 1
+    last = len(pos_bi_freqs) - 1
+
+    for idx, sound in enumerate(word):
+        if idx < len(word) - 1:
+            next_sound = word[idx + 1]
+            if sound != UNKNOWN_SOUND and next_sound != UNKNOWN_SOUND:
+                score += pos_bi_freqs[min(idx, last), sound, next_sound]
+
+    return score
+
+##########################
+# Code for saving models #
+##########################
+
+# Version of the layout written by save_model
+MODEL_FORMAT_VERSION = 2
+
+def save_model(path, counts, **metadata):
+    """
+    Saves the counts of a fitted model to a compressed .npz file, together
+    with its inventory and any metadata needed to rebuild the same models.
+
+    path: The path to the model file.
+    counts: The NgramCounts of the training tokens.
+    metadata: JSON-serializable settings to store with the model, such as
+    max_word_len and the training file.
+
+    returns: None
+    """
+    metadata = dict(metadata, format_version=MODEL_FORMAT_VERSION)
+    # The sparse counts of each higher order are stored under its own names
+    higher_orders = {}
+    for order, sparse_counts in counts.higher_orders.items():
+        higher_orders[f'order{order}_keys'] = sparse_counts.keys
+        higher_orders[f'order{order}_counts'] = sparse_counts.counts
+        higher_orders[f'order{order}_pos_keys'] = sparse_counts.pos_keys
+        higher_orders[f'order{order}_pos_counts'] = sparse_counts.pos_counts
+
+    with open(path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            symbols=np.array(counts.inventory.symbols),
+            unigrams=counts.unigrams,
+            bigrams=counts.bigrams,
+            pos_unigrams=counts.pos_unigrams,
+            pos_bigrams=counts.pos_bigrams,
+            higher_orders=np.array(sorted(counts.higher_orders), dtype=int),
+            metadata=np.array(json.dumps(metadata)),
+            **higher_orders
+        )
+
+def load_model(path):
+    """
+    Loads a model saved with save_model.
+
+    path: The path to the model file.
+
+    returns: The NgramCounts of the model and a dictionary of its metadata.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        metadata = json.loads(str(data['metadata']))
+        if metadata.get('format_version') != MODEL_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has model format version "
+                f"{metadata.get('format_version')}, expected "
+                f"{MODEL_FORMAT_VERSION}."
+            )
+        inventory = SoundInventory(data['symbols'].tolist())
+        # Models saved before higher orders were supported have none
+        orders = []
+        if 'higher_orders' in data.files:
+            orders = data['higher_orders'].tolist()
+        higher_orders = {
+            order: SparseNgramCounts(
+                inventory, order,
+                data[f'order{order}_keys'],
+                data[f'order{order}_counts'],
+                data[f'order{order}_pos_keys'],
+                data[f'order{order}_pos_counts']
+            )
+            for order in orders
+        }
+        counts = NgramCounts(
+            inventory,
+            data['unigrams'],
+            data['bigrams'],
+            data['pos_unigrams'],
+            data['pos_bigrams'],
+            higher_orders
+        )
+    return counts, metadata
+
+##################
+# Entry function #
+##################
+
+def run(train, test, out, save_to=None, max_word_len=MAX_WORD_LEN,
+        chunk_size=None, cache=False, max_order=MAX_ORDER, output_format=None,
+        float32=False, model_cache=None, alpha=SMOOTHING_ALPHA):
+    """
+    Trains all of the n-gram models on the training set, evaluates them on
+    the test set, and writes the evaluation results to a file.
+
+    train: The path to the training file.
+    test: The path to the test file.
+    out: The path to the output file.
+    save_to: If given, the path the fitted model is saved to.
+    max_word_len: The number of positions smoothed in the positional models.
+    chunk_size: If given, the training file is streamed in chunks of this
+    many tokens instead of being read all at once.
+    cache: If True, corpora are loaded from packed sidecar files.
+    max_order: The highest n-gram order to fit and score.
+    output_format: The format of the output file, see write_results.
+    float32: If True, scores are stored as 32-bit floats.
+    model_cache: If given, the ModelCache fitted models are reused from, see
+    fit.
+    alpha: The pseudo-count of the smoothed models.
+
+    returns: None
+    """
+    header, results = evaluate(
+        train, test, save_to, max_word_len, chunk_size, cache, max_order,
+        model_cache, alpha
+    )
+    write_results(results, out, header, output_format, float32)
+
+def run_many(train, tests, outs, save_to=None, max_word_len=MAX_WORD_LEN,
+             chunk_size=None, cache=False, max_order=MAX_ORDER,
+             output_format=None, float32=False, model_cache=None,
+             alpha=SMOOTHING_ALPHA):
+    """
+    Trains all of the n-gram models on the training set once, evaluates them
+    on any number of test sets and writes the results for each one to its own
+    file. Tokens shared between test sets are only scored once.
+
+    tests: The paths to the test files.
+    outs: The paths to the output files, one for each test file.
+
+    The other arguments are the same as for run.
+
+    returns: None
+    """
+    if len(tests) != len(outs):
+        raise ValueError("run_many needs exactly one output file per test file.")
+
+    header, results = evaluate_many(
+        train, tests, save_to, max_word_len, chunk_size, cache, max_order,
+        model_cache, alpha
+    )
+    for test_results, out in zip(results, outs):
+        write_results(test_results, out, header, output_format, float32)
+
+def evaluate(train, test, save_to=None, max_word_len=MAX_WORD_LEN,
+             chunk_size=None, cache=False, max_order=MAX_ORDER,
+             model_cache=None, alpha=SMOOTHING_ALPHA):
+    """
+    Trains all of the n-gram models on the training set and evaluates them on
+    the test set, without writing the results anywhere. Takes the same
+    arguments as run.
+
+    returns: The header and the result rows.
+    """
+    header, results = evaluate_many(
+        train, [test], save_to, max_word_len, chunk_size, cache, max_order,
+        model_cache, alpha
+    )
+    return header, results[0]
+
+def evaluate_many(train, tests, save_to=None, max_word_len=MAX_WORD_LEN,
+                  chunk_size=None, cache=False, max_order=MAX_ORDER,
+                  model_cache=None, alpha=SMOOTHING_ALPHA):
+    """
+    Trains all of the n-gram models on the training set and evaluates them on
+    several test sets, scoring each distinct token only once. Takes the same
+    arguments as run_many, without the output files. Test sets can also be
+    given as PackedCorpus objects that were read already.
+
+    returns: The header and a list of result rows for each test set.
+    """
+    counts = fit(
+        train, save_to, max_word_len, chunk_size, cache, max_order,
+        model_cache
+    )
+    memo = ScoreMemo(counts.fitted_models(max_word_len, alpha))
+    results = [
+        memo.score_corpus(read_corpus(test, counts.inventory, cache))
+        for test in tests
+    ]
+    return build_header(counts.max_order), results
+
+def fit(train, save_to=None, max_word_len=MAX_WORD_LEN, chunk_size=None,
+        cache=False, max_order=MAX_ORDER, model_cache=None):
+    """
+    Counts the training set and optionally saves the result as a model file.
+
+    train: The path to the training file.
+    save_to: If given, the path the fitted model is saved to.
+    max_word_len: The number of positions smoothed in the positional models.
+    chunk_size: If given, the training file is streamed in chunks of this
+    many tokens instead of being read all at once.
+    cache: If True, the training set is loaded from a packed sidecar file.
+    Ignored when streaming.
+    max_order: The highest n-gram order to count.
+    model_cache: If given, a model_cache.ModelCache that the counts are
+    loaded from when the same training data was counted with the same
+    settings and the same version of this file before, and stored in
+    otherwise.
+
+    returns: The NgramCounts of the training set.
+    """
+    if model_cache is not None:
+        # The counts don't depend on max_word_len, which is only applied
+        #   when the models are fitted from them. Any change to this file
+        #   gives new keys, so counts from older code are never reused.
+        key = model_cache.key(
+            train, max_order=max_order, word_boundary=WORD_BOUNDARY,
+            format_version=MODEL_FORMAT_VERSION,
+            code=_code_hash()
+        )
+        path = model_cache.lookup(key)
+        counts = None
+        if path is not None:
+            try:
+                with timing_trace.stage('load', cached=True):
+                    counts, _ = load_model(path)
+            except (OSError, ValueError):
+                # A damaged cache file is fitted again and replaced
+                counts = None
+        if counts is None:
+            counts = fit(
+                train, None, max_word_len, chunk_size, cache, max_order
+            )
+            model_cache.store(
+                key,
+                lambda path: save_model(
+                    path, counts, train=train, max_word_len=max_word_len
+                )
+            )
+    elif chunk_size is None:
+        counts = count_ngrams(read_corpus(train, cache=cache), max_order)
+    else:
+        counts = count_ngrams_streaming(train, chunk_size, max_order)
+    if save_to is not None:
+        save_model(save_to, counts, train=train, max_word_len=max_word_len)
+    return counts
+
+def _code_hash():
+    """
+    Returns the hash of this file, hashing it only once per process.
+    """
+    global _CODE_HASH
+    if _CODE_HASH is None:
+        _CODE_HASH = corpus_cache.file_hash(__file__)
+    return _CODE_HASH
+
+_CODE_HASH = None
+
+def score(model, tests, outs, cache=False, output_format=None,
+          float32=False, alpha=SMOOTHING_ALPHA):
+    """
+    Evaluates a saved model on any number of test sets and writes the results
+    for each one to its own file. Every order the model was fitted with is
+    scored, and tokens shared between test sets are only scored once.
+
+    model: The path to a model file written by save_model.
+    tests: The paths to the test files.
+    outs: The paths to the output files, one for each test file.
+    cache: If True, test sets are loaded from packed sidecar files.
+    output_format: The format of the output files, see write_results.
+    float32: If True, scores are stored as 32-bit floats.
+    alpha: The pseudo-count of the smoothed models.
+
+    returns: None
+    """
+    if len(tests) != len(outs):
+        raise ValueError("score needs exactly one output file per test file.")
+
+    with timing_trace.stage('load'):
+        counts, metadata = load_model(model)
+    memo = ScoreMemo(counts.fitted_models(metadata['max_word_len'], alpha))
+
+    for test, out in zip(tests, outs):
+        test_corpus = read_corpus(test, counts.inventory, cache)
+        results = memo.score_corpus(test_corpus)
+        write_results(
+            results, out, build_header(counts.max_order), output_format,
+            float32
+        )
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description = "Calculate a suite of unigram/bigram scores for a data set."
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser(
+        'run', help='Fit the models and score a test set (the default).'
+    )
+    run_parser.add_argument(
+        'train_file', type=str, help='Path to the input corpus file.'
+    )
+    run_parser.add_argument(
+        'test_file', type=str, help='Path to test data file' 
+    )
+    run_parser.add_argument(
+        'output_file', type=str, help='Path to output file with word judgements' 
+    )
+    run_parser.add_argument(
+        '--save-model', type=str, default=None,
+        help='Also save the fitted model to this .npz file'
+    )
+    run_parser.add_argument(
+        '--chunk-size', type=int, default=None,
+        help='Stream the training file in chunks of this many tokens'
+    )
+    run_parser.add_argument(
+        '--cache', action='store_true',
+        help='Load corpora from packed sidecar files, writing them if needed'
+    )
+    run_parser.add_argument(
+        '--format', type=str, default=None,
+        choices=result_formats.FORMATS,
+        help='Output format (default: chosen by the output file extension)'
+    )
+    run_parser.add_argument(
+        '--float32', action='store_true',
+        help='Store scores as 32-bit floats'
+    )
+    run_parser.add_argument(
+        '--max-order', type=int, default=MAX_ORDER,
+        help='Also fit and score n-grams up to this order (e.g. 3 or 4)'
+    )
+    run_parser.add_argument(
+        '--model-cache', action='store_true',
+        help='Reuse models fitted from the same training data in earlier '
+        f'runs, cached in {model_cache_module.DEFAULT_CACHE_DIR}'
+    )
+    run_parser.add_argument(
+        '--model-cache-dir', type=str, default=None,
+        help='Like --model-cache, with the cache in this directory'
+    )
+    run_parser.add_argument(
+        '--alpha', type=float, default=SMOOTHING_ALPHA,
+        help='Pseudo-count of the smoothed models (default: 1)'
+    )
+    run_parser.add_argument(
+        '--trace', type=str, default=None,
+        help='Append the time, CPU time and memory use of each stage to this '
+        'JSON lines file'
+    )
+
+    fit_parser = subparsers.add_parser(
+        'fit', help='Fit the models and save them to a model file.'
+    )
+    fit_parser.add_argument(
+        'train_file', type=str, help='Path to the input corpus file.'
+    )
+    fit_parser.add_argument(
+        'model_file', type=str, help='Path to the output .npz model file.'
+    )
+    fit_parser.add_argument(
+        '--chunk-size', type=int, default=None,
+        help='Stream the training file in chunks of this many tokens'
+    )
+    fit_parser.add_argument(
+        '--cache', action='store_true',
+        help='Load corpora from packed sidecar files, writing them if needed'
+    )
+    fit_parser.add_argument(
+        '--max-order', type=int, default=MAX_ORDER,
+        help='Also fit and score n-grams up to this order (e.g. 3 or 4)'
+    )
+    fit_parser.add_argument(
+        '--model-cache', action='store_true',
+        help='Reuse models fitted from the same training data in earlier '
+        f'runs, cached in {model_cache_module.DEFAULT_CACHE_DIR}'
+    )
+    fit_parser.add_argument(
+        '--model-cache-dir', type=str, default=None,
+        help='Like --model-cache, with the cache in this directory'
+    )
+    fit_parser.add_argument(
+        '--trace', type=str, default=None,
+        help='Append the time, CPU time and memory use of each stage to this '
+        'JSON lines file'
+    )
+
+    score_parser = subparsers.add_parser(
+        'score', help='Score test sets with a saved model.'
+    )
+    score_parser.add_argument(
+        'model_file', type=str, help='Path to a saved .npz model file.'
+    )
+    score_parser.add_argument(
+        'test_files', type=str, nargs='+', help='Paths to test data files'
+    )
+    score_parser.add_argument(
+        '--out-dir', type=str, default='.',
+        help='Directory for the output files, named <model>_<test>.<format>'
+    )
+    score_parser.add_argument(
+        '--cache', action='store_true',
+        help='Load corpora from packed sidecar files, writing them if needed'
+    )
+    score_parser.add_argument(
+        '--format', type=str, default=None,
+        choices=result_formats.FORMATS,
+        help='Output format (default: chosen by the output file extension)'
+    )
+    score_parser.add_argument(
+        '--float32', action='store_true',
+        help='Store scores as 32-bit floats'
+    )
+    score_parser.add_argument(
+        '--alpha', type=float, default=SMOOTHING_ALPHA,
+        help='Pseudo-count of the smoothed models (default: 1)'
+    )
+    score_parser.add_argument(
+        '--trace', type=str, default=None,
+        help='Append the time, CPU time and memory use of each stage to this '
+        'JSON lines file'
+    )
+
+    # Keep supporting the original "train test out" invocation
+    argv = sys.argv[1:]
+    commands = list(subparsers.choices) + ['-h', '--help']
+    if argv and argv[0] not in commands:
+        argv = ['run'] + argv
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'trace', None) is not None:
+        timing_trace.enable(args.trace)
+
+    model_cache = None
+    if args.command in ('run', 'fit') and args.model_cache_dir is not None:
+        model_cache = model_cache_module.ModelCache(args.model_cache_dir)
+    elif args.command in ('run', 'fit') and args.model_cache:
+        model_cache = model_cache_module.ModelCache()
+
+    if args.command == 'run':
+        run(
+            args.train_file, args.test_file, args.output_file,
+            args.save_model, chunk_size=args.chunk_size, cache=args.cache,
+            max_order=args.max_order, output_format=args.format,
+            float32=args.float32, model_cache=model_cache, alpha=args.alpha
+        )
+    elif args.command == 'fit':
+        fit(
+            args.train_file, args.model_file, chunk_size=args.chunk_size,
+            cache=args.cache, max_order=args.max_order,
+            model_cache=model_cache
+        )
+    elif args.command == 'score':
+        model_name = os.path.splitext(os.path.basename(args.model_file))[0]
+        extension = result_formats.DEFAULT_EXTENSIONS[args.format or 'csv']
+        outs = [
+            os.path.join(
+                args.out_dir,
+                model_name + '_'
+                + os.path.splitext(os.path.basename(test))[0] + extension
+            )
+            for test in args.test_files
+        ]
+        score(
+            args.model_file, args.test_files, outs, args.cache, args.format,
+            args.float32, args.alpha
+        )
+    else:
+        parser.print_help()
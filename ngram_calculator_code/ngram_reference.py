@@ -0,0 +1,936 @@
+import csv
+import math
+import os
+import tempfile
+
+import nltk
+import numpy as np
+
+from collections import defaultdict
+
+import ngram_calculator
+
+# The per-word implementation the calculator started from, kept verbatim as
+# the reference the backends of ngram_calculator.py are checked against,
+# with its own settings (MAX_WORD_LEN and a pseudo-count of 1). Orders above
+# 2, which it never had, are fitted by the dictionary code after it. None of
+# the reference code uses ngram_calculator.py, so a change there can't hide
+# a difference; only the backends at the end of this file call it.
+
+WORD_BOUNDARY = '#'
+MAX_WORD_LEN = 100
+HEADER = [
+    'word',
+    'word_len',
+
+    'uni_prob',
+    'uni_prob_freq_weighted',
+
+    'bi_prob',
+    'bi_prob_freq_weighted',
+    'bi_prob_smoothed',
+    'bi_prob_freq_weighted_smoothed',
+
+    'pos_uni_score',
+    'pos_uni_score_freq_weighted',
+    'pos_uni_score_smoothed',
+    'pos_uni_score_freq_weighted_smoothed',
+
+    'pos_bi_score',
+    'pos_bi_score_freq_weighted',
+    'pos_bi_score_smoothed',
+    'pos_bi_score_freq_weighted_smoothed'
+]
+
+####################
+# Helper functions #
+####################
+
+def generate_bigrams(token):
+    """
+    Returns a list of sound bigrams given a single word token.
+
+    token: The list of symbols in the token.
+
+    returns: The list of bigrams of the token.
+    """
+    return nltk.ngrams([WORD_BOUNDARY] + token + [WORD_BOUNDARY], 2)
+
+def read_tokens(dataset):
+    """
+    Reads in a file containing tokens and optional frequencies and converts
+    it to a list of tokens and a list of token/frequency pairs.
+
+    dataset: The path to the dataset.
+
+    returns: A list of lists, where each sublist corresponds to a token and
+    consists of a list of the individual symbols.
+    """
+    with open(dataset, 'r') as f:
+        reader = csv.reader(f)
+    
+        token_freqs = []
+
+        for row in reader:
+            split_token = row[0].split(' ')
+            freq = float(row[1]) if len(row) == 2 else 0
+            token_freqs.append([split_token, freq])
+
+    return token_freqs
+
+def write_results(results, outfile):
+    """
+    Writes the results of scoring the test dataset to a file.
+
+    results: The results to write.
+    outfile: The path to the output file.
+
+    returns: None
+    """
+    results = [HEADER] + results
+    with open(outfile, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerows(results)
+
+###########################
+# Code for fitting models #
+###########################
+
+def fit_ngram_models(token_freqs, sound_idx):
+    """
+    Fits all of the ngram models to the provided data and returns the fitted
+    models.
+
+    token_freqs: A list of tuples of word-frequency pairs.
+    sound_idx: The list of unique sounds used to map sound identity to matrix
+    dimensions.
+
+    returns: A list of lists of models. These models are in the same order as
+    defined in the HEADER file at the top of this file, and broken into sublists
+    based on their type (unigram/bigram/positional unigram/positional bigram).
+    """
+    unigram_models = []
+    # Get unigram probabilities
+    unigram_models.append(fit_unigrams(token_freqs))
+    unigram_models.append(fit_unigrams(token_freqs, token_weighted=True))
+
+    # Get bigram probabilities
+    bigram_models = []
+    bigram_models.append(fit_bigrams(token_freqs, sound_idx))
+    bigram_models.append(
+        fit_bigrams(token_freqs, sound_idx, token_weighted=True)
+    )
+    bigram_models.append(
+        fit_bigrams(token_freqs, sound_idx, smoothed=True)
+    )
+    bigram_models.append(
+        fit_bigrams(token_freqs, sound_idx, smoothed=True, token_weighted=True)
+    )
+
+    # Get positional unigram probabilities
+    pos_unigram_models = []
+    pos_unigram_models.append(fit_positional_unigrams(token_freqs))
+    pos_unigram_models.append(
+        fit_positional_unigrams(token_freqs, token_weighted=True)
+    )
+    pos_unigram_models.append(
+        fit_positional_unigrams(token_freqs, smoothed=True)
+    )
+    pos_unigram_models.append(
+        fit_positional_unigrams(token_freqs, smoothed=True, token_weighted=True)
+    )
+
+    # Get positional bigram probabilities
+    pos_bigram_models = []
+    pos_bigram_models.append(fit_positional_bigrams(token_freqs))
+    pos_bigram_models.append(
+        fit_positional_bigrams(token_freqs, token_weighted=True)
+    )
+    pos_bigram_models.append(
+        fit_positional_bigrams(token_freqs, smoothed=True)
+    )
+    pos_bigram_models.append(
+        fit_positional_bigrams(token_freqs, smoothed=True, token_weighted=True)
+    )
+
+    return unigram_models, bigram_models, pos_unigram_models, pos_bigram_models
+
+def fit_unigrams(token_freqs, token_weighted=False):
+    """
+    This function takes a set of word tokens and returns a dictionary whose
+    keys are unigrams and whose values are log unigram probabilities. Smoothing 
+    isn't implemented for standard unigram scores: we assume the set of sounds
+    in the training data is the full set of sounds.
+
+    token_freqs: A list of tuples of word-frequency pairs
+    token_weighted: If true, counts are weighted by log frequency of token
+
+    returns: A dictionary of unigram:probability pairs.
+    """
+    unigram_freqs = defaultdict(int)
+
+    for token, freq in token_freqs:
+        val = np.log(freq) if token_weighted else 1
+        for sound in token:
+            unigram_freqs[sound] += val
+
+    total_sounds = sum(unigram_freqs.values())
+    unigram_freqs = {
+        key: (np.log(value/total_sounds)) 
+        for key, value in unigram_freqs.items()
+    }
+    return unigram_freqs
+
+def fit_bigrams(token_freqs, sound_idx, token_weighted=False, smoothed=False):
+    """
+    This function takes a set of word tokens and a list of sounds and
+    returns a matrix of bigrams probabilities. The sound list is necessary because
+    we include counts of 0 for unattested bigram combinations.
+
+    token_freqs: A list of tuples of word-frequency pairs.
+
+    token_weighted: if True, counts are weighted by the log frequency
+    of the words they occur in.
+
+    smoothed: if True, start with a pseudo-count of 1 for every bigram.
+
+    returns: A matrix of bigram probabilities, where rows correspond to the second
+    sound in the bigram and columns correspond to the first.
+    """
+    num_sounds = len(sound_idx)
+
+    if smoothed:
+        count_matrix = np.ones((num_sounds, num_sounds))
+    else:
+        count_matrix = np.zeros((num_sounds, num_sounds))
+
+    for token, freq in token_freqs:
+        val = np.log(freq) if token_weighted else 1
+        bigrams = generate_bigrams(token)
+        for s1, s2 in bigrams:
+            count_matrix[sound_idx.index(s2)][sound_idx.index(s1)] += val
+
+    bigram_probs = np.log(count_matrix / np.sum(count_matrix, 0))
+    return bigram_probs
+
+def fit_positional_unigrams(token_freqs, token_weighted=False, smoothed=False):
+    """
+    This function takes a set of word tokens and returns a dictionary containing
+    positional unigram log scores.
+
+    token_freqs: A list of tuples of word-frequency pairs.
+
+    token_weighted: If True, counts are weighted by log frequency of token.
+
+    smoothed: If True, each start with a pseudo-count of 1 for every unigram in
+    every position up to MAX_WORD_LEN. Note that this smoothing does not allow
+    unseen unigrams to get probabilities > 0: rather it assigns known unigrams
+    in unknown positions probabilities > 0.
+
+    returns: A dictionary of dictionaries, where the first dictionary maps position
+    indices to unigrams, and the second maps unigrams to their scores in that
+    position.
+    """
+    pos_unigram_freqs = defaultdict(lambda: defaultdict(int))
+
+    if smoothed:
+        unique_sounds = set(
+            [sound for token, _ in token_freqs for sound in token]
+        )
+        max_idx = max([len(token) for token, _ in token_freqs])
+
+        for i in range(MAX_WORD_LEN):
+            for sound in unique_sounds:
+                pos_unigram_freqs[i][sound] = 1
+
+    for token, freq in token_freqs:
+        val = np.log(freq) if token_weighted else 1
+        for idx, sound in enumerate(token):
+            pos_unigram_freqs[idx][sound] += val
+
+    pos_unigram_freqs = normalize_positional_counts(pos_unigram_freqs)
+
+    return pos_unigram_freqs
+
+def fit_positional_bigrams(token_freqs, token_weighted=False, smoothed=False):
+    """
+    This function takes a set of word tokens and returns a dictionary containing
+    positional bigram scores.
+
+    token_freqs: A list of tuples of word-frequency pairs.
+
+    token_weighted: If True, counts are weighted by log frequency of token.
+
+    smoothed: If True, each start with a pseudo-count of 1 for every bigram in
+    every pair of positions up to MAX_WORD_LEN.
+
+    returns: A dictionary of dictionaries, where the first dictionary maps pairs of
+    position indices to bigrams, and the second maps bigram to their scores in those
+    positions.
+    """
+    pos_bigram_freqs = defaultdict(lambda: defaultdict(int))
+
+    if smoothed:
+        unique_sounds = set(
+            [sound for token, _ in token_freqs for sound in token]
+        )
+        for i in range(MAX_WORD_LEN - 1):
+            for s1 in unique_sounds:
+                for s2 in unique_sounds:
+                    pos_bigram_freqs[(i, i+1)][(s1, s2)] = 1
+
+    for token, freq in token_freqs:
+        val = np.log(freq) if token_weighted else 1
+        for idx, sound in enumerate(token):
+            if idx < len(token) - 1:
+                pos_bigram_freqs[(idx, idx + 1)][(sound, token[idx + 1])] += val
+
+    pos_bigram_freqs = normalize_positional_counts(pos_bigram_freqs)
+    
+    return pos_bigram_freqs
+
+def normalize_positional_counts(counts):
+    """
+    Normalizes positional counts by total counts for each position.
+    """
+    for idx in counts.keys():
+        total = sum(counts[idx].values())
+        for gram in counts[idx].keys():
+            counts[idx][gram] /= total
+
+    return counts
+
+###########################
+# Code for testing models #
+###########################
+
+def score_corpus(token_freqs, fitted_models, sound_idx):
+    """
+    Given a dataset and a list of fitted models, returns the score for each 
+    word under each model.
+
+    token_freqs: A list of tuples of word-frequency pairs. Frequencies 
+    aren't used in this function.
+    sound_idx: The list of unique sounds used to map sound identity to matrix
+    dimensions.
+
+    fitted_models: A list of lists of models. These models are in the same order as
+    defined in the HEADER file at the top of this file, and broken into sublists
+    based on their type (unigram/bigram/positional unigram/positional bigram).
+
+    returns: A list of lists of scores. Each sublist corresponds to one word. Each
+    sublist contains the word itself, its length, and its score under each of the
+    ngram models.
+    """
+    uni_models, bi_models, pos_uni_models, pos_bi_models = fitted_models
+
+    results = []
+    
+    for token, _ in token_freqs:
+        row = [' '.join(token), len(token)]
+
+        for model in uni_models:
+            row.append(get_unigram_prob(token, model))
+
+        for model in bi_models:
+            row.append(get_bigram_prob(token, model, sound_idx))
+
+        for model in pos_uni_models:
+            row.append(get_pos_unigram_score(token, model))
+
+        for model in pos_bi_models:
+            row.append(get_pos_bigram_score(token, model))
+
+        results.append(row)
+
+    return results
+
+def get_unigram_prob(word, unigram_probs):
+    """
+    Calculcates the unigram probability of a word given a fitted unigram model
+
+    word: The test word
+    ungiram_probs: The fitted model
+
+    returns: The log probability of the word under the unigram model.
+    """
+    prob = 0
+    for sound in word:
+        # Add basic smoothing for sounds that appear in test data but
+        #   not training data. Use float('-inf') because we are
+        #   using log probabilities.
+        prob += unigram_probs.get(sound, float('-inf'))
+
+    return prob
+
+def get_bigram_prob(word, bigram_probs, sound_idx):
+    """
+    Calculcates the bigram probability of a word given a fitted bigram model
+
+    word: The test word
+    bigram_probs: The fitted model
+    sound_idx: The list of unique sounds used to map sound identity to matrix
+    dimensions.
+
+    returns: The log probability of the word under the bigram model.
+    """
+    bigrams = generate_bigrams(word)
+    prob = 0
+    for s1, s2 in bigrams:
+        try:
+            prob += bigram_probs[sound_idx.index(s2), sound_idx.index(s1)]
+        except:
+            # If bigram contains symbol we haven't seen, assign 0 probability
+            prob += float('-inf')
+
+    return prob
+
+def get_pos_unigram_score(word, pos_uni_freqs):
+    """
+    Calculcates the positional unigram score of a word given a fitted 
+    positional unigram model.
+
+    word: The test word
+    pos_uni_freqs: The fitted positional unigram model
+
+    returns: The score of the word under the positional unigram model. Following
+    Vitevich & Luce (2004), we add 1 to these scores.
+    """
+    score = 1
+
+    for idx, sound in enumerate(word):
+        score += pos_uni_freqs[idx][sound]
+
+    return score
+
+def get_pos_bigram_score(word, pos_bi_freqs):
+    """
+    Calculcates the positional bigram score of a word given a fitted 
+    positional bigram model.
+
+    word: The test word
+    pos_bi_freqs: The fitted positional bigram model
+
+    returns: The score of the word under the positional unigram model. Following
+    Vitevich & Luce (2004), we add 1 to these scores.
+    """
+    score = 1
+
+    for idx, sound in enumerate(word):
+        if idx < len(word) - 1:
+            score += pos_bi_freqs[(idx, idx + 1)][sound, word[idx + 1]]
+
+    return score
+
+##################
+# Entry function #
+##################
+
+def run(train, test, out):
+    """
+    Trains all of the n-gram models on the training set, evaluates them on
+    the test set, and writes the evaluation results to a file.
+
+    train: The path to the training file.
+    test: The path to the test file.
+    out: The path to the output file.
+
+    returns: None
+    """
+    train_token_freqs = read_tokens(train)
+    test_token_freqs = read_tokens(test)
+    unique_sounds = set(
+        [sound for token, _ in train_token_freqs for sound in token]
+    )
+    sound_idx = sorted(list(unique_sounds)) + ['#']
+
+    fitted_models = fit_ngram_models(train_token_freqs, sound_idx)
+    results = score_corpus(test_token_freqs, fitted_models, sound_idx)
+    write_results(results, out)
+
+################################
+# Code for higher-order models #
+################################
+
+# Pseudo-count of the smoothed higher-order models, as in the models above
+PSEUDO_COUNT = 1
+# Names of the higher orders in the output columns
+ORDER_NAMES = {3: 'tri', 4: 'quad'}
+
+def build_header(max_order=2):
+    """
+    Returns the header of the results when scoring models up to a given
+    order: HEADER, then the n-gram and positional n-gram columns of each
+    order above 2.
+    """
+    header = list(HEADER)
+    for order in range(3, max_order + 1):
+        name = ORDER_NAMES.get(order, f'order{order}')
+        header += [
+            f'{name}_prob',
+            f'{name}_prob_freq_weighted',
+            f'{name}_prob_smoothed',
+            f'{name}_prob_freq_weighted_smoothed',
+
+            f'pos_{name}_score',
+            f'pos_{name}_score_freq_weighted',
+            f'pos_{name}_score_smoothed',
+            f'pos_{name}_score_freq_weighted_smoothed'
+        ]
+    return header
+
+def generate_ngrams(token, order):
+    """
+    Returns the n-grams of a token padded with order - 1 word boundaries
+    before it and one after it, as the n-gram models see it.
+
+    token: The list of symbols in the token.
+    order: The number of sounds in each n-gram.
+
+    returns: A list of tuples of symbols.
+    """
+    padded = [WORD_BOUNDARY] * (order - 1) + token + [WORD_BOUNDARY]
+    return [
+        tuple(padded[idx:idx + order]) for idx in range(len(padded) - order + 1)
+    ]
+
+def token_value(freq, token_weighted):
+    """
+    Returns the amount a token adds to a count: its log frequency if counts
+    are token weighted, otherwise 1. Values are numpy floats so that dividing
+    by a count of zero gives inf or NaN, as in the backends.
+    """
+    if token_weighted:
+        with np.errstate(divide='ignore'):
+            return np.log(np.float64(freq))
+    return np.float64(1)
+
+def fit_higher_order_models(token_freqs, max_order=2):
+    """
+    Fits the n-gram and positional n-gram models of every order above 2 up
+    to max_order, one token at a time.
+
+    token_freqs: A list of word-frequency pairs, as returned by read_tokens.
+    max_order: The highest n-gram order to fit.
+
+    returns: A list of (kind, model) pairs, in the order of the columns
+    build_header adds for those orders, where kind is 'ngram' or
+    'positional'.
+    """
+    models = []
+    for order in range(3, max_order + 1):
+        for kind in ['ngram', 'positional']:
+            for smoothed in [False, True]:
+                for token_weighted in [False, True]:
+                    if kind == 'ngram':
+                        model = fit_ngrams(
+                            token_freqs, order, token_weighted, smoothed
+                        )
+                    else:
+                        model = fit_positional_ngrams(
+                            token_freqs, order, token_weighted, smoothed
+                        )
+                    models.append((kind, model))
+    return models
+
+def fit_ngrams(token_freqs, order, token_weighted=False, smoothed=False):
+    """
+    Counts the n-grams of one order and the contexts (the sounds before the
+    last one) they occur in. The probability of an n-gram is the probability
+    of its last sound given its context.
+
+    token_freqs: A list of word-frequency pairs.
+    order: The number of sounds in each n-gram.
+    token_weighted: If True, counts are weighted by log frequency of token.
+    smoothed: If True, every n-gram of the inventory starts with a
+    pseudo-count of PSEUDO_COUNT.
+
+    returns: A dictionary describing the model, used by get_ngram_prob.
+    """
+    gram_counts = defaultdict(lambda: np.float64(0))
+    context_counts = defaultdict(lambda: np.float64(0))
+    symbols = {WORD_BOUNDARY}
+
+    for token, freq in token_freqs:
+        val = token_value(freq, token_weighted)
+        symbols.update(token)
+        for gram in generate_ngrams(token, order):
+            gram_counts[gram] += val
+            context_counts[gram[:-1]] += val
+
+    return {
+        'order': order,
+        'smoothed': smoothed,
+        'symbols': symbols,
+        'grams': dict(gram_counts),
+        'contexts': dict(context_counts)
+    }
+
+def fit_positional_ngrams(token_freqs, order, token_weighted=False,
+                          smoothed=False):
+    """
+    Counts the n-grams of one order at each position of the tokens, without
+    word boundaries. The score of an n-gram is its share of the count of its
+    position.
+
+    token_freqs: A list of word-frequency pairs.
+    order: The number of sounds in each n-gram.
+    token_weighted: If True, counts are weighted by log frequency of token.
+    smoothed: If True, every n-gram of the training sounds starts with a
+    pseudo-count of PSEUDO_COUNT in every position of a word of up to
+    MAX_WORD_LEN sounds.
+
+    returns: A dictionary describing the model, used by
+    get_positional_score.
+    """
+    gram_counts = defaultdict(lambda: np.float64(0))
+    position_counts = defaultdict(lambda: np.float64(0))
+    sounds = set()
+
+    for token, freq in token_freqs:
+        val = token_value(freq, token_weighted)
+        sounds.update(token)
+        for idx in range(len(token) - order + 1):
+            gram_counts[idx, tuple(token[idx:idx + order])] += val
+            position_counts[idx] += val
+
+    return {
+        'order': order,
+        'smoothed': smoothed,
+        'num_smoothed': max(MAX_WORD_LEN - (order - 1), 0),
+        'sounds': sounds,
+        'grams': dict(gram_counts),
+        'positions': dict(position_counts)
+    }
+
+def score_higher_orders(word, higher_order_models):
+    """
+    Returns the scores of a word under the models of fit_higher_order_models.
+    """
+    return [
+        get_ngram_prob(word, model) if kind == 'ngram'
+        else get_positional_score(word, model)
+        for kind, model in higher_order_models
+    ]
+
+def get_ngram_prob(word, model):
+    """
+    Calculates the log n-gram probability of a word, including the n-grams
+    with word boundaries. An n-gram with a sound that wasn't seen in training
+    has a log probability of -inf, as does one whose context was never seen
+    unless the model is smoothed.
+    """
+    num_symbols = len(model['symbols'])
+    prob = np.float64(0)
+    for gram in generate_ngrams(word, model['order']):
+        if not all(sound in model['symbols'] for sound in gram):
+            prob += -math.inf
+            continue
+        count = model['grams'].get(gram, np.float64(0))
+        context = model['contexts'].get(gram[:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if model['smoothed']:
+                context = np.float64(0) if context is None else context
+                prob += np.log(
+                    (count + PSEUDO_COUNT)
+                    / (context + PSEUDO_COUNT * num_symbols)
+                )
+            elif context is None:
+                prob += -math.inf
+            else:
+                prob += np.log(count / context)
+    return prob
+
+def get_positional_score(word, model):
+    """
+    Calculates the positional n-gram score of a word. Following Vitevich &
+    Luce (2004), the scores start at 1. n-grams with a sound that wasn't
+    seen in training add nothing, as do n-grams that were never seen in
+    their position unless the position is smoothed.
+    """
+    order = model['order']
+    num_grams = len(model['sounds']) ** order
+    score = np.float64(1)
+    for idx in range(len(word) - order + 1):
+        gram = tuple(word[idx:idx + order])
+        if not all(sound in model['sounds'] for sound in gram):
+            continue
+        pseudo_count = 0
+        if model['smoothed'] and idx < model['num_smoothed']:
+            pseudo_count = PSEUDO_COUNT
+        count = model['grams'].get((idx, gram))
+        if count is None and pseudo_count == 0:
+            continue
+        count = np.float64(0) if count is None else count
+        total = model['positions'].get(idx, np.float64(0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score += (count + pseudo_count) / (total + pseudo_count * num_grams)
+    return score
+
+##############################
+# Code for checking backends #
+##############################
+
+# Tolerances used when comparing a backend with the reference: values match
+# if they differ by at most ATOL + RTOL * |reference|. By default they must
+# be equal.
+RTOL = 0.0
+ATOL = 0.0
+# Relative tolerance of the columns weighted by token frequency. The backends
+# add up the log frequency weights and pseudo-counts in a different order
+# than the per-word code, and the per-word code adds up the smoothed
+# positional totals in the order of a set of strings, which changes with
+# Python's hash seed. These columns can differ in the last few bits (at most
+# 4 ulps on the formatted corpora); every other column must be equal.
+WEIGHTED_RTOL = 1e-12
+# Columns that WEIGHTED_RTOL applies to are named with this
+WEIGHTED_COLUMN = 'freq_weighted'
+# Chunk size of the streaming backend, small so even small files are
+# counted in several chunks
+STREAMING_CHUNK_SIZE = 100
+
+def evaluate_many(train, tests, max_order=2):
+    """
+    Fits the reference models on a training file and scores test files with
+    them, as run does for one test file.
+
+    train: The path to the training file.
+    tests: The paths to the test files.
+    max_order: The highest n-gram order to fit and score.
+
+    returns: The header and a list of result rows for each test file.
+    """
+    train_token_freqs = read_tokens(train)
+    unique_sounds = set(
+        [sound for token, _ in train_token_freqs for sound in token]
+    )
+    sound_idx = sorted(list(unique_sounds)) + ['#']
+
+    # Frequencies of 0 and unattested contexts give the -inf and NaN scores
+    #   the backends have to reproduce, so numpy needn't warn about them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fitted_models = fit_ngram_models(train_token_freqs, sound_idx)
+        higher_order_models = fit_higher_order_models(
+            train_token_freqs, max_order
+        )
+
+        results = []
+        for test in tests:
+            test_token_freqs = read_tokens(test)
+            rows = score_corpus(test_token_freqs, fitted_models, sound_idx)
+            for row, (token, _) in zip(rows, test_token_freqs):
+                row += score_higher_orders(token, higher_order_models)
+            results.append(rows)
+    return build_header(max_order), results
+
+def _streaming_backend(train, tests, max_order):
+    """
+    Counts the training file in small chunks and merges the counts.
+    """
+    return ngram_calculator.evaluate_many(
+        train, tests, max_word_len=MAX_WORD_LEN, max_order=max_order,
+        chunk_size=STREAMING_CHUNK_SIZE
+    )
+
+def _saved_backend(train, tests, max_order):
+    """
+    Saves the fitted model, loads it back and scores with the loaded model.
+    """
+    fd, path = tempfile.mkstemp(suffix='.npz')
+    os.close(fd)
+    try:
+        ngram_calculator.fit(
+            train, path, max_word_len=MAX_WORD_LEN, max_order=max_order
+        )
+        counts, metadata = ngram_calculator.load_model(path)
+    finally:
+        os.remove(path)
+    memo = ngram_calculator.ScoreMemo(
+        counts.fitted_models(metadata['max_word_len'])
+    )
+    results = [
+        memo.score_corpus(ngram_calculator.read_corpus(test, counts.inventory))
+        for test in tests
+    ]
+    return ngram_calculator.build_header(counts.max_order), results
+
+def _batch_backend(train, tests, max_order):
+    """
+    Fits and scores on packed corpora, the way run and run_ngramcalc.py do.
+    """
+    return ngram_calculator.evaluate_many(
+        train, tests, max_word_len=MAX_WORD_LEN, max_order=max_order
+    )
+
+# Backends that can be checked against the reference. Each takes the
+# training file, the test files and max_order, and returns the header and
+# the result rows of each test file. They are run with the reference's
+# MAX_WORD_LEN and with ngram_calculator's default pseudo-count.
+BACKENDS = {
+    'batch': _batch_backend,
+    'streaming': _streaming_backend,
+    'saved': _saved_backend
+}
+
+def value_kind(value):
+    """
+    Returns the kind of a result value: 'str', 'int' or 'float'. Integer and
+    float scores are written differently ('1' and '1.0'), so a value of the
+    wrong kind is a mismatch even if it is equal.
+    """
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, (int, np.integer)):
+        return 'int'
+    return 'float'
+
+def values_match(reference, value, rtol=RTOL, atol=ATOL):
+    """
+    Returns True if a value matches the reference value: of the same kind,
+    and then equal (including the sign of a zero), both NaN, or within the
+    tolerances. Infinities only match the same infinity.
+    """
+    if value_kind(reference) != value_kind(value):
+        return False
+    if isinstance(reference, str):
+        return reference == value
+    reference, value = float(reference), float(value)
+    if math.isnan(reference) or math.isnan(value):
+        return math.isnan(reference) and math.isnan(value)
+    if reference == value:
+        return math.copysign(1, reference) == math.copysign(1, value)
+    if math.isinf(reference) or math.isinf(value):
+        return False
+    return abs(value - reference) <= atol + rtol * abs(reference)
+
+def compare_results(header, reference, results, rtol=RTOL, atol=ATOL,
+                    weighted_rtol=WEIGHTED_RTOL):
+    """
+    Compares every column of the results of a backend with the reference.
+
+    header: The column names.
+    reference: The result rows of the reference.
+    results: The result rows of the backend.
+    rtol: The relative tolerance.
+    atol: The absolute tolerance.
+    weighted_rtol: The relative tolerance of the columns weighted by token
+    frequency, if larger than rtol.
+
+    returns: A list of mismatches, in the order of the rows and columns.
+    Each is a dictionary with the row, the word, the column (the model) and
+    the reference and backend values.
+    """
+    if len(reference) != len(results):
+        raise ValueError(
+            f"The reference has {len(reference)} rows but the backend has "
+            f"{len(results)}."
+        )
+
+    column_rtols = [
+        max(rtol, weighted_rtol) if WEIGHTED_COLUMN in column else rtol
+        for column in header
+    ]
+    mismatches = []
+    for idx, (expected, actual) in enumerate(zip(reference, results)):
+        for column, column_rtol, reference_value, value in zip(
+            header, column_rtols, expected, actual
+        ):
+            if not values_match(reference_value, value, column_rtol, atol):
+                mismatches.append({
+                    'row': idx,
+                    'word': expected[0],
+                    'column': column,
+                    'reference': reference_value,
+                    'backend': value
+                })
+    return mismatches
+
+def check(train, tests, backend='batch', rtol=RTOL, atol=ATOL, max_order=2,
+          weighted_rtol=WEIGHTED_RTOL):
+    """
+    Runs the reference implementation and a backend on the same files and
+    compares every column of their results.
+
+    train: The path to the training file.
+    tests: The paths to the test files.
+    backend: The name of the backend, one of BACKENDS.
+    rtol: The relative tolerance.
+    atol: The absolute tolerance.
+    max_order: The highest n-gram order to fit and score.
+    weighted_rtol: The relative tolerance of the columns weighted by token
+    frequency, if larger than rtol.
+
+    returns: A dictionary mapping each test file to its list of mismatches,
+    as returned by compare_results.
+    """
+    header, reference = evaluate_many(train, tests, max_order)
+    backend_header, results = BACKENDS[backend](train, tests, max_order)
+    if backend_header != header:
+        raise ValueError(
+            f"The {backend} backend has the columns {backend_header}, "
+            f"expected {header}."
+        )
+    return {
+        test: compare_results(
+            header, test_reference, test_results, rtol, atol, weighted_rtol
+        )
+        for test, test_reference, test_results in zip(
+            tests, reference, results
+        )
+    }
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description = "Check that a backend of ngram_calculator.py "
+        "reproduces the reference implementation."
+    )
+    parser.add_argument(
+        'train_file', type=str, help='Path to the input corpus file.'
+    )
+    parser.add_argument(
+        'test_files', type=str, nargs='+', help='Paths to test data files'
+    )
+    parser.add_argument(
+        '--backend', type=str, default='batch', choices=list(BACKENDS),
+        help='Backend to check (default: batch)'
+    )
+    parser.add_argument(
+        '--rtol', type=float, default=RTOL,
+        help='Relative tolerance (default: 0, values must be equal)'
+    )
+    parser.add_argument(
+        '--atol', type=float, default=ATOL,
+        help='Absolute tolerance (default: 0)'
+    )
+    parser.add_argument(
+        '--weighted-rtol', type=float, default=WEIGHTED_RTOL,
+        help='Relative tolerance of the freq_weighted columns '
+        f'(default: {WEIGHTED_RTOL}, 0 to require equal values)'
+    )
+    parser.add_argument(
+        '--max-order', type=int, default=2,
+        help='Also check n-grams up to this order (e.g. 3 or 4)'
+    )
+    args = parser.parse_args()
+
+    mismatches = check(
+        args.train_file, args.test_files, args.backend, args.rtol, args.atol,
+        args.max_order, args.weighted_rtol
+    )
+    total = 0
+    for test, test_mismatches in mismatches.items():
+        total += len(test_mismatches)
+        if not test_mismatches:
+            print(f"{test}: matches the reference")
+            continue
+        first = test_mismatches[0]
+        columns = sorted({mismatch['column'] for mismatch in test_mismatches})
+        print(
+            f"{test}: {len(test_mismatches)} mismatches in {columns}. First: "
+            f"row {first['row']} ({first['word']!r}), {first['column']} is "
+            f"{first['backend']!r}, expected {first['reference']!r}"
+        )
+    sys.exit(1 if total else 0)
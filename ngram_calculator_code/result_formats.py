@@ -0,0 +1,275 @@
+import csv
+import os
+
+import numpy as np
+
+# Output formats by file extension. Files with any other extension are
+# written as CSV.
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.npz': 'npz',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow'
+}
+FORMATS = ['csv', 'npz', 'parquet', 'arrow']
+# Extension used for each format when output file names are generated
+DEFAULT_EXTENSIONS = {
+    'csv': '.csv',
+    'npz': '.npz',
+    'parquet': '.parquet',
+    'arrow': '.arrow'
+}
+# Columns that aren't scores
+WORD_COLUMN = 'word'
+LENGTH_COLUMN = 'word_len'
+
+def result_format(path, format=None):
+    """
+    Returns the format a results file is written in.
+
+    path: The path to the results file.
+    format: The format to use, one of FORMATS. If None, the format is chosen
+    by the extension of path.
+
+    returns: The name of the format.
+    """
+    if format is None:
+        format = EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'csv')
+    if format not in FORMATS:
+        raise ValueError(
+            f"Unknown output format {format!r}, expected one of {FORMATS}."
+        )
+    return format
+
+def write_results(results, outfile, header, format=None, float32=False):
+    """
+    Writes scored results in one of the supported formats. Outside of CSV
+    the scores are stored as typed columns, so -inf and NaN are kept as
+    floats rather than text, and the word column (like any other string
+    column) is stored as a categorical column.
+
+    results: The result rows, as returned by ngram_calculator.score_corpus.
+    outfile: The path to the output file.
+    header: The column names.
+    format: The format to write, one of FORMATS. If None, the format is
+    chosen by the extension of outfile.
+    float32: If True, scores are stored as 32-bit floats.
+
+    returns: None
+    """
+    format = result_format(outfile, format)
+    if format == 'csv':
+        write_csv(results, outfile, header, float32)
+    else:
+        write_columns(results_columns(results, header, float32), outfile, format)
+
+def write_columns(columns, outfile, format):
+    """
+    Writes typed columns, as returned by results_columns, in one of the
+    columnar formats (npz, parquet or arrow).
+
+    columns: A dictionary mapping each column name to an array.
+    outfile: The path to the output file.
+    format: The format to write.
+
+    returns: None
+    """
+    if format == 'npz':
+        write_npz(columns, outfile)
+    elif format in ('parquet', 'arrow'):
+        write_arrow(columns, outfile, format)
+    else:
+        raise ValueError(f"{format!r} is not a columnar format.")
+
+def results_columns(results, header, float32=False):
+    """
+    Converts result rows into typed columns.
+
+    results: The result rows.
+    header: The column names.
+    float32: If True, scores are converted to 32-bit floats.
+
+    returns: A dictionary mapping each column name to an array, in the order
+    of header.
+    """
+    score_type = np.float32 if float32 else np.float64
+    columns = {}
+    for idx, name in enumerate(header):
+        values = [row[idx] for row in results]
+        if name == WORD_COLUMN:
+            columns[name] = np.array(values, dtype=str)
+        elif name == LENGTH_COLUMN:
+            columns[name] = np.array(values, dtype=np.int32)
+        else:
+            columns[name] = np.array(values, dtype=score_type)
+    return columns
+
+def write_csv(results, outfile, header, float32=False):
+    """
+    Writes result rows as CSV text, the format the rest of the pipeline
+    started with.
+    """
+    if float32:
+        # The shortest text that reads back as the same 32-bit float. Integer
+        #   scores (the 1 of positional scores that nothing was added to) are
+        #   written as they are, as the 64-bit CSV writes them.
+        results = [
+            row[:2] + [
+                value if isinstance(value, (int, np.integer))
+                else str(np.float32(value))
+                for value in row[2:]
+            ]
+            for row in results
+        ]
+    with open(outfile, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerows([header] + results)
+
+def write_npz(columns, outfile):
+    """
+    Writes result columns to a .npz file. String columns are stored as their
+    sorted distinct values under <name>_categories plus an int32 code for
+    each row under <name>_codes, and the column order is stored under
+    'header'.
+    """
+    arrays = {}
+    for name, values in columns.items():
+        if values.dtype.kind == 'U':
+            categories, codes = np.unique(values, return_inverse=True)
+            arrays[name + '_categories'] = categories
+            arrays[name + '_codes'] = codes.ravel().astype(np.int32)
+        else:
+            arrays[name] = values
+    with open(outfile, 'wb') as f:
+        np.savez_compressed(f, header=np.array(list(columns)), **arrays)
+
+def write_arrow(columns, outfile, format):
+    """
+    Writes result columns to a Parquet or Arrow IPC file, with the string
+    columns dictionary-encoded. Needs pyarrow.
+    """
+    pa = _import_pyarrow(format)
+    table = pa.table({
+        name: (
+            pa.array(values).dictionary_encode() if values.dtype.kind == 'U'
+            else pa.array(values)
+        )
+        for name, values in columns.items()
+    })
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, outfile)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, outfile)
+
+def read_results(path, format=None, columns=None, filters=None):
+    """
+    Reads a results file written in any of the supported formats.
+
+    path: The path to the results file.
+    format: The format of the file, one of FORMATS. If None, the format is
+    chosen by the extension of path.
+    columns: The names of the columns to read, or None to read all of them.
+    Names the file doesn't have are skipped. Other than CSV, the formats only
+    read the requested columns from disk.
+    filters: A dictionary mapping column names to lists of values, keeping
+    only the rows whose value in each of those columns is in its list, or
+    None to keep every row. Parquet and Arrow files apply the filters while
+    they are read, so Parquet row groups without a matching row aren't read.
+
+    returns: A dictionary mapping each column name to an array, in the order
+    of the file's columns. String columns, such as the word column, are
+    returned as arrays of str.
+    """
+    format = result_format(path, format)
+    if format == 'csv':
+        with open(path, 'r', newline='') as f:
+            rows = list(csv.reader(f))
+        header, rows = rows[0], rows[1:]
+        return _filtered(
+            _selected(results_columns(rows, header), columns), filters
+        )
+
+    if format == 'npz':
+        with np.load(path, allow_pickle=False) as data:
+            names = data['header'].tolist()
+            if columns is not None:
+                names = [name for name in names if name in columns]
+            result = {}
+            for name in names:
+                if name + '_codes' in data.files:
+                    result[name] = data[name + '_categories'][
+                        data[name + '_codes']
+                    ]
+                else:
+                    result[name] = data[name]
+            return _filtered(result, filters)
+
+    pyarrow = _import_pyarrow(format)
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        if columns is not None:
+            names = pq.read_schema(path).names
+            columns = [name for name in names if name in columns]
+        table = pq.read_table(
+            path, columns=columns,
+            filters=[
+                (name, 'in', list(values)) for name, values in filters.items()
+            ] if filters else None
+        )
+    else:
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(path, format='feather')
+        if columns is not None:
+            columns = [name for name in dataset.schema.names if name in columns]
+        expression = None
+        for name, values in (filters or {}).items():
+            condition = pc.field(name).isin(list(values))
+            expression = condition if expression is None else (
+                expression & condition
+            )
+        table = dataset.to_table(columns=columns, filter=expression)
+    result = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if (pyarrow.types.is_integer(column.type)
+                or pyarrow.types.is_floating(column.type)):
+            result[name] = column.to_numpy()
+        else:
+            result[name] = np.array(column.to_pylist(), dtype=str)
+    return result
+
+def _selected(columns, names):
+    """
+    Keeps the named columns, in their original order.
+    """
+    if names is None:
+        return columns
+    return {name: values for name, values in columns.items() if name in names}
+
+def _filtered(columns, filters):
+    """
+    Keeps the rows whose values are in the filters, as read_results does.
+    """
+    if not filters:
+        return columns
+    kept = np.ones(len(next(iter(columns.values()), [])), dtype=bool)
+    for name, values in filters.items():
+        kept &= np.isin(columns[name], list(values))
+    return {name: values[kept] for name, values in columns.items()}
+
+def _import_pyarrow(format):
+    """
+    Imports pyarrow, which is only needed for the Parquet and Arrow formats.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            f"The {format} output format needs pyarrow "
+            "(pip install pyarrow)."
+        ) from None
+    return pyarrow
@@ -0,0 +1,215 @@
+import os
+import tempfile
+import urllib.parse
+import uuid
+
+import numpy as np
+
+import result_formats
+
+# Keys that identify one scoring run. The partition keys name the
+# directories of the store, so reads can skip whole directories; the row
+# keys are stored as columns next to the scores.
+PARTITION_KEYS = ['segmenter', 'level']
+ROW_KEYS = ['sample', 'contrast']
+KEYS = PARTITION_KEYS + ROW_KEYS
+# Format of the part files. Parquet can be read directly by R's arrow
+# package; npz doesn't need pyarrow.
+DEFAULT_FORMAT = 'parquet'
+# Prefix of the files holding results. Anything else in a partition, such
+# as the temporary files of an unfinished append, is ignored.
+PART_PREFIX = 'part-'
+
+def partition_path(root, keys):
+    """
+    Returns the directory of the partition a scoring run belongs to, laid out
+    as <root>/segmenter=<segmenter>/level=<level>.
+
+    root: The directory of the store.
+    keys: A dictionary with a value for each of the PARTITION_KEYS.
+
+    returns: The path of the partition directory.
+    """
+    parts = [
+        f"{key}={urllib.parse.quote(str(keys[key]), safe='')}"
+        for key in PARTITION_KEYS
+    ]
+    return os.path.join(root, *parts)
+
+def append(root, keys, results, header, format=DEFAULT_FORMAT):
+    """
+    Adds the results of one scoring run to the store. Each append writes a
+    new part file under a temporary name and renames it into place, so any
+    number of processes can append at once and readers never see a partial
+    file.
+
+    root: The directory of the store.
+    keys: A dictionary with a value for each of KEYS.
+    results: The result rows, as returned by ngram_calculator.score_corpus.
+    header: The column names of the result rows.
+    format: The format of the part file, npz, parquet or arrow.
+
+    returns: The path of the new part file.
+    """
+    missing = [key for key in KEYS if key not in keys]
+    if missing:
+        raise ValueError(f"Results need values for the keys {missing}.")
+
+    columns = {
+        key: np.full(len(results), str(keys[key])) for key in ROW_KEYS
+    }
+    columns.update(result_formats.results_columns(results, header))
+    return _write_part(partition_path(root, keys), columns, format)
+
+def read(root, filters=None, columns=None):
+    """
+    Reads a slice of the store. Filters on the partition keys skip every
+    directory that doesn't match before anything is read. Filters on the row
+    keys are applied as each part file is read, and only the requested
+    columns that a part file has are read from it.
+
+    root: The directory of the store.
+    filters: A dictionary mapping keys to the value, or list of values, to
+    keep. Keys without a filter match everything.
+    columns: The names of the result columns to read, or None to read all of
+    them. The key columns are always included.
+
+    returns: A dictionary mapping each column name to an array, with the key
+    columns first. Columns missing from some part files (such as higher-order
+    scores) are filled with NaN, as are requested columns that no part file
+    has.
+    """
+    filters = {
+        key: {str(value) for value in (
+            values if isinstance(values, (list, tuple, set)) else [values]
+        )}
+        for key, values in (filters or {}).items()
+    }
+    unknown = set(filters) - set(KEYS)
+    if unknown:
+        raise ValueError(f"Can only filter on the keys {KEYS}, not {unknown}.")
+    if columns is not None:
+        columns = ROW_KEYS + [name for name in columns if name not in KEYS]
+
+    row_filters = {
+        key: sorted(filters[key]) for key in ROW_KEYS if key in filters
+    }
+
+    tables = []
+    for keys, path in parts(root, filters):
+        table = result_formats.read_results(
+            path, columns=columns, filters=row_filters
+        )
+        num_rows = len(table[ROW_KEYS[0]])
+        if not num_rows:
+            continue
+        for key in PARTITION_KEYS:
+            table[key] = np.full(num_rows, keys[key])
+        tables.append(table)
+
+    return _concatenate(tables, columns)
+
+def parts(root, filters=None):
+    """
+    Lists the part files of the store, skipping the partitions that don't
+    match the filters.
+
+    root: The directory of the store.
+    filters: A dictionary mapping partition keys to sets of values to keep.
+
+    returns: A list of tuples of the partition keys and the path of each part
+    file, in a stable order.
+    """
+    filters = filters or {}
+    found = [({}, root)]
+    for key in PARTITION_KEYS:
+        deeper = []
+        for keys, directory in found:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                prefix = key + '='
+                if not name.startswith(prefix):
+                    continue
+                value = urllib.parse.unquote(name[len(prefix):])
+                if key in filters and value not in filters[key]:
+                    continue
+                deeper.append(
+                    (dict(keys, **{key: value}), os.path.join(directory, name))
+                )
+        found = deeper
+
+    return [
+        (keys, os.path.join(directory, name))
+        for keys, directory in found
+        for name in sorted(os.listdir(directory))
+        if name.startswith(PART_PREFIX)
+    ]
+
+def compact(root, format=DEFAULT_FORMAT):
+    """
+    Rewrites each partition that has more than one part file as a single
+    part file, so the store stays at one file per partition however many
+    runs were appended. The new file is in place before the old ones are
+    removed, so run this when no one else is reading the store.
+
+    root: The directory of the store.
+    format: The format of the rewritten part files.
+
+    returns: None
+    """
+    by_partition = {}
+    for keys, path in parts(root):
+        by_partition.setdefault(os.path.dirname(path), []).append(path)
+
+    for directory, paths in by_partition.items():
+        if len(paths) < 2:
+            continue
+        columns = _concatenate(
+            [result_formats.read_results(path) for path in paths]
+        )
+        _write_part(directory, columns, format)
+        for path in paths:
+            os.remove(path)
+
+def _write_part(directory, columns, format):
+    """
+    Atomically writes columns to a new part file in a partition directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    extension = result_formats.DEFAULT_EXTENSIONS[format]
+    path = os.path.join(directory, f'{PART_PREFIX}{uuid.uuid4().hex}{extension}')
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.tmp', suffix=extension, dir=directory
+    )
+    os.close(fd)
+    try:
+        result_formats.write_columns(columns, tmp_path, format)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+def _concatenate(tables, columns=None):
+    """
+    Concatenates tables of columns, putting the key columns first and
+    filling columns that a table lacks with NaN. Any of the named columns
+    that no table has are added at the end, filled with NaN.
+    """
+    names = [key for key in KEYS if any(key in table for table in tables)]
+    for table in tables:
+        names += [name for name in table if name not in names]
+    names += [name for name in columns or [] if name not in names]
+
+    columns = {}
+    for name in names:
+        pieces = []
+        for table in tables:
+            if name in table:
+                pieces.append(table[name])
+            else:
+                length = len(next(iter(table.values())))
+                pieces.append(np.full(length, np.nan))
+        columns[name] = np.concatenate(pieces) if pieces else np.array([])
+    return columns
@@ -1,118 +1,165 @@
 import sys
 import os
+import math
+import model_cache
 import ngram_calculator
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import shared_corpora
+import sweep
 
 # Input roots
 # incremental_root = "../incremental_corpora_out"
 incremental_root = "../incremental_corpora_out_v2"
 formatted_root = "../formatted_corpora"
 
-# Output root
+# Output root. The results store, trace and test stimuli are set in sweep.py.
 output_root = "../ScoredLists"
 
-# Test stimuli
-bigram_contrast = "../infant_stim_formatted/infant_2c_stimuli_bigram_contrast.txt"
-both_contrast   = "../infant_stim_formatted/infant_2b_stimuli_both_contrast.txt"
-unigram_contrast= "../infant_stim_formatted/infant_2a_stimuli_unigram_contrast.txt"
+# Reuse models fitted from identical training data in earlier sweeps (see
+#   model_cache.py). The cache is kept in ~/.cache/ngram_calculator/models.
+use_model_cache = False
+
+# Number of worker processes (None = one per CPU)
+max_workers = None
+
+# Training files are submitted to the pool in batches, so small files don't
+#   each pay the cost of a separate task. Batches hold as many files as give
+#   each worker about this many batches, so every worker has work...
+batches_per_worker = 4
+# ...and a batch is closed early once its files add up to this many bytes;
+#   larger files are submitted on their own
+batch_bytes = 4 * 1024 * 1024
 
 # ---------------------------
-# Gather tasks for incremental corpora
+# Parallel execution
 # ---------------------------
-tasks = []
-
-# selected_incremental = ["PearlBrentWords"]
+def run_group(train_path, group):
+    # Use the stimuli the parent shared with this worker, reading any that
+    #   weren't shared from disk
+    test_paths = [shared_corpora.attached_corpus(test_path, test_path) for test_path, _, _ in group]
+    cache = model_cache.ModelCache() if use_model_cache else None
+    header, results = ngram_calculator.evaluate_many(train_path, test_paths, model_cache=cache)
+    done = []
+    for (test_path, out_path, keys), test_results in zip(group, results):
+        done.append(sweep.save_results(test_results, header, out_path, keys))
+    return ", ".join(done)
+
+def run_batch(batch):
+    # Time each group, and keep going when one fails so the rest of the
+    #   batch isn't lost
+    return [sweep.timed_run(train_path, run_group, train_path, group) for train_path, group in batch]
+
+# The sweep only runs in the main process: under the spawn and forkserver
+#   start methods every worker imports this module again
+if __name__ == "__main__":
+    # ---------------------------
+    # Gather tasks for incremental corpora
+    # ---------------------------
+    tasks = []
+
+    # selected_incremental = ["PearlBrentWords"]
+
+    # for seg_type in tasks: # quick way to skip incremental runs
+    # for seg_type in selected_incremental: # way to run selected corpora
+    for seg_type in sorted(os.listdir(incremental_root)): # original run for all of the segmentation types in incremental root
+        seg_type_path = os.path.join(incremental_root, seg_type)
+        if not os.path.isdir(seg_type_path):
+            continue
 
-# for seg_type in tasks: # quick way to skip incremental runs
-# for seg_type in selected_incremental: # way to run selected corpora
-for seg_type in sorted(os.listdir(incremental_root)): # original run for all of the segmentation types in incremental root
-    seg_type_path = os.path.join(incremental_root, seg_type)
-    if not os.path.isdir(seg_type_path):
-        continue
+        # for sample_number in sorted(os.listdir(seg_type_path)):
+        sample_number = "1.01625"
+        train_dir = os.path.join(seg_type_path, sample_number)
+        if not os.path.isdir(train_dir):
+            continue
 
-    # for sample_number in sorted(os.listdir(seg_type_path)):
-    sample_number = "1.01625"
-    train_dir = os.path.join(seg_type_path, sample_number)
-    if not os.path.isdir(train_dir):
-        continue
-
-    # output_dir = os.path.join(output_root, "incremental", seg_type, sample_number)
-    output_dir = os.path.join(output_root, "incremental_v2", seg_type, sample_number)
-    os.makedirs(output_dir, exist_ok=True)
-
-    for filename in os.listdir(train_dir):
-        train_path = os.path.join(train_dir, filename)
-        if not os.path.isfile(train_path):
+        # output_dir = os.path.join(output_root, "incremental", seg_type, sample_number)
+        output_dir = os.path.join(output_root, "incremental_v2", seg_type, sample_number)
+        os.makedirs(output_dir, exist_ok=True)
+
+        for filename in os.listdir(train_dir):
+            train_path = os.path.join(train_dir, filename)
+            if not os.path.isfile(train_path):
+                continue
+
+            base_name = os.path.splitext(filename)[0]
+            keys = {"segmenter": seg_type, "level": sample_number, "sample": base_name.replace("sample", "", 1)}
+
+            # Replace the "sample" prefix in base_name with the sample_number
+            if base_name.startswith("sample"):
+                base_name = base_name.replace("sample", sample_number, 1)
+
+            for contrast, test_path in sweep.contrasts.items():
+                tasks.append((train_path, test_path, os.path.join(output_dir, f"{base_name}_{contrast}.csv"), dict(keys, contrast=contrast)))
+
+
+    # ---------------------------
+    # Gather tasks for formatted corpora
+    # ---------------------------
+    # quick modification if only wanting to run a few additional folders
+    selected_corpora = [
+        "OLDPearlCorpusUtterances",
+        "OLDPearlCorpusWordTypes"
+    ]
+    selected_corpora = ["OLDTinyInfantLexiconNoNumbers_Prepped"]
+    selected_corpora = ["TP_btp_absolute", "TP_btp_relative", "TP_ftp_absolute", "TP_ftp_relative", "TP_mi_absolute", "TP_mi_relative"]
+    selected_corpora = []
+
+    # for corpus_name in sorted(os.listdir(formatted_root)): # when running on all of the formatted corpora
+    for corpus_name in selected_corpora:
+        corpus_path = os.path.join(formatted_root, corpus_name)
+        if not os.path.isdir(corpus_path):
             continue
 
-        base_name = os.path.splitext(filename)[0]
+        output_dir = os.path.join(output_root, "standard", corpus_name)
+        os.makedirs(output_dir, exist_ok=True)
 
-        # Replace the "sample" prefix in base_name with the sample_number
-        if base_name.startswith("sample"):
-            base_name = base_name.replace("sample", sample_number, 1)
+        for filename in os.listdir(corpus_path):
+            if not filename.endswith(".txt"):
+                continue
 
-        tasks.append((train_path, bigram_contrast, os.path.join(output_dir, f"{base_name}_bigram_contrast.csv")))
-        tasks.append((train_path, both_contrast,   os.path.join(output_dir, f"{base_name}_both_contrast.csv")))
-        tasks.append((train_path, unigram_contrast,os.path.join(output_dir, f"{base_name}_unigram_contrast.csv")))
+            train_path = os.path.join(corpus_path, filename)
+            if not os.path.isfile(train_path):
+                continue
 
+            base_name = os.path.splitext(filename)[0]
 
-# ---------------------------
-# Gather tasks for formatted corpora
-# ---------------------------
-# quick modification if only wanting to run a few additional folders
-selected_corpora = [
-    "OLDPearlCorpusUtterances",
-    "OLDPearlCorpusWordTypes"
-]
-selected_corpora = ["OLDTinyInfantLexiconNoNumbers_Prepped"]
-selected_corpora = ["TP_btp_absolute", "TP_btp_relative", "TP_ftp_absolute", "TP_ftp_relative", "TP_mi_absolute", "TP_mi_relative"]
-selected_corpora = []
-
-# for corpus_name in sorted(os.listdir(formatted_root)): # when running on all of the formatted corpora
-for corpus_name in selected_corpora:
-    corpus_path = os.path.join(formatted_root, corpus_name)
-    if not os.path.isdir(corpus_path):
-        continue
-
-    output_dir = os.path.join(output_root, "standard", corpus_name)
-    os.makedirs(output_dir, exist_ok=True)
-
-    for filename in os.listdir(corpus_path):
-        if not filename.endswith(".txt"):
-            continue
+            keys = {"segmenter": corpus_name, "level": "standard", "sample": base_name}
+            for contrast, test_path in sweep.contrasts.items():
+                tasks.append((train_path, test_path, os.path.join(output_dir, f"{base_name}_{contrast}.csv"), dict(keys, contrast=contrast)))
 
-        train_path = os.path.join(corpus_path, filename)
-        if not os.path.isfile(train_path):
-            continue
 
-        base_name = os.path.splitext(filename)[0]
+    print(f"Discovered {len(tasks)} scoring tasks.")
 
-        tasks.append((train_path, bigram_contrast, os.path.join(output_dir, f"{base_name}_bigram_contrast.csv")))
-        tasks.append((train_path, both_contrast,   os.path.join(output_dir, f"{base_name}_both_contrast.csv")))
-        tasks.append((train_path, unigram_contrast,os.path.join(output_dir, f"{base_name}_unigram_contrast.csv")))
+    # Score all contrasts of a training file together, so each model is fitted
+    #   once and stimuli shared between contrasts are scored once
+    grouped_tasks = {}
+    for train_path, test_path, out_path, keys in tasks:
+        grouped_tasks.setdefault(train_path, []).append((test_path, out_path, keys))
 
+    # Batch the groups, largest training files first so the long tasks start
+    #   early and the small batches fill in the gaps at the end
+    num_workers = max_workers or os.cpu_count() or 1
+    groups_per_batch = max(1, math.ceil(len(grouped_tasks) / (num_workers * batches_per_worker)))
+    batches = []
+    batch, batch_size = [], 0
+    for train_path in sorted(grouped_tasks, key=os.path.getsize, reverse=True):
+        size = os.path.getsize(train_path)
+        if size >= batch_bytes:
+            batches.append([(train_path, grouped_tasks[train_path])])
+            continue
+        if batch and (len(batch) >= groups_per_batch or batch_size + size > batch_bytes):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append((train_path, grouped_tasks[train_path]))
+        batch_size += size
+    if batch:
+        batches.append(batch)
 
-print(f"Discovered {len(tasks)} scoring tasks.")
+    print(f"Grouped into {len(grouped_tasks)} training files in {len(batches)} batches for {num_workers} workers.")
 
+    stimuli = sorted({test_path for group in grouped_tasks.values() for test_path, _, _ in group})
+    batch_names = {f"batch of {[train_path for train_path, _ in batch]}": (batch,) for batch in batches}
+    sweep.run(run_batch, batch_names, stimuli, max_workers=num_workers, noun="training files")
 
-# ---------------------------
-# Parallel execution
-# ---------------------------
-def run_task(args):
-    train_path, test_path, out_path = args
-    ngram_calculator.run(train_path, test_path, out_path)
-    return out_path
-
-with ProcessPoolExecutor() as executor:
-    futures = {executor.submit(run_task, task): task for task in tasks}
-
-    for future in as_completed(futures):
-        task = futures[future]
-        try:
-            result = future.result()
-            print(f"Done: {result}")
-        except Exception as e:
-            print(f"Error on task {task}: {e}")
 
 
 
@@ -0,0 +1,317 @@
+import csv
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ngram_calculator
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Number of fitted models kept in memory before the least recently used one
+# is dropped
+DEFAULT_MAX_MODELS = 64
+# Number of scored words each model remembers before the least recently used
+# one is dropped
+DEFAULT_MAX_SCORES = 100000
+
+class ModelStore:
+    """
+    An LRU-bounded set of fitted models, keyed by the file they were loaded
+    from. A model is either fitted from a training file or loaded from a
+    model file written by ngram_calculator.save_model. Files that changed
+    since they were loaded are loaded again, replacing the old version.
+    Requests for a file that is already being loaded wait for that load
+    rather than loading it again.
+
+    max_models: The maximum number of models to keep.
+    cache: If True, training files are read through packed sidecar files.
+    max_scores: The maximum number of scored words each model remembers.
+    """
+    def __init__(self, max_models=DEFAULT_MAX_MODELS, cache=False,
+                 max_scores=DEFAULT_MAX_SCORES):
+        self.max_models = max_models
+        self.cache = cache
+        self.max_scores = max_scores
+        self._models = OrderedDict()
+        # Futures of the files being loaded, by the same keys as _models
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Returns the counts and fitted models for a training or model file,
+        loading them if they aren't in memory yet.
+
+        path: The path to a training file, or to a .npz model file.
+
+        returns: A tuple of the NgramCounts and a ScoreMemo of the fitted
+        models, which keeps the scores of the words most recently scored with
+        them.
+        """
+        path = os.path.abspath(path)
+        key = (path, os.stat(path).st_mtime_ns)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = Future()
+                loading = True
+            else:
+                loading = False
+
+        # Another request is already loading the file: wait for its model
+        if not loading:
+            return pending.result()
+
+        try:
+            model = self._load(path)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            # Drop the versions of the file that were loaded before it changed
+            for stale in [
+                other for other in self._models
+                if other[0] == path and other != key
+            ]:
+                del self._models[stale]
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        pending.set_result(model)
+        return model
+
+    def _load(self, path):
+        """
+        Fits or loads the model of a file, as returned by get.
+        """
+        if path.endswith('.npz'):
+            counts, metadata = ngram_calculator.load_model(path)
+            max_word_len = metadata['max_word_len']
+        else:
+            counts = ngram_calculator.fit(path, cache=self.cache)
+            max_word_len = ngram_calculator.MAX_WORD_LEN
+        return (
+            counts,
+            ngram_calculator.ScoreMemo(
+                counts.fitted_models(max_word_len), self.max_scores
+            )
+        )
+
+    def loaded(self):
+        """
+        Returns the paths of the models in memory, least recently used first.
+        """
+        with self._lock:
+            return [path for path, _ in self._models]
+
+def score_words(store, model, words):
+    """
+    Scores a list of words with a model from the store.
+
+    store: The ModelStore.
+    model: The path to a training file or .npz model file.
+    words: A list of words, each a string of space-separated symbols.
+
+    returns: The header, as returned by ngram_calculator.build_header for the
+    orders of the model, and a list of result rows.
+    """
+    counts, memo = store.get(model)
+    corpus = ngram_calculator.pack_tokens(
+        [[word.split(' '), 0] for word in words]
+    ).recode(counts.inventory)
+    header = ngram_calculator.build_header(counts.max_order)
+    return header, memo.score_corpus(corpus)
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of the scoring service.
+
+    POST /score takes a JSON object with a "model" (a training file or .npz
+    model file) and a list of "words" and/or "test_files", and returns the
+    header and result rows. GET /status lists the models in memory.
+    """
+    def do_GET(self):
+        if self.path != '/status':
+            self._send(404, {'error': f'Unknown path {self.path}'})
+            return
+        self._send(200, {'models': self.server.store.loaded()})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        try:
+            model, words, test_files = self._read_request()
+            for test_file in test_files:
+                words.extend(
+                    ' '.join(token)
+                    for token, _ in ngram_calculator.read_tokens(test_file)
+                )
+            header, rows = score_words(self.server.store, model, words)
+        except (OSError, ValueError) as e:
+            self._send(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+
+        self._send(200, {'header': header, 'rows': rows})
+
+    def _read_request(self):
+        """
+        Reads the JSON body of a /score request and checks its fields,
+        raising ValueError if the body is malformed.
+
+        returns: The model path, the list of words and the list of test
+        files.
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length))
+        if not isinstance(request, dict):
+            raise ValueError('The request must be a JSON object.')
+        model = request.get('model')
+        if not isinstance(model, str):
+            raise ValueError(
+                '"model" must be the path to a training or model file.'
+            )
+        lists = []
+        for field in ['words', 'test_files']:
+            value = request.get(field, [])
+            if not isinstance(value, list) or not all(
+                isinstance(item, str) for item in value
+            ):
+                raise ValueError(f'"{field}" must be a list of strings.')
+            lists.append(list(value))
+        return model, *lists
+
+    def _send(self, status, body):
+        # Scores can be -inf or NaN, which Python's json module writes as
+        #   -Infinity and NaN
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT,
+          max_models=DEFAULT_MAX_MODELS, cache=False,
+          max_scores=DEFAULT_MAX_SCORES):
+    """
+    Runs the scoring service until it is interrupted.
+
+    host: The address to listen on. Keep this on localhost: the service reads
+    any file path it is sent.
+    port: The port to listen on.
+    max_models: The maximum number of fitted models to keep in memory.
+    cache: If True, training files are read through packed sidecar files.
+    max_scores: The maximum number of scored words each model remembers.
+
+    returns: None
+    """
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.store = ModelStore(max_models, cache, max_scores)
+    print(f"Scoring service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def request_scores(model, words=(), test_files=(), host=DEFAULT_HOST,
+                   port=DEFAULT_PORT):
+    """
+    Asks a running scoring service to score words with a model.
+
+    model: The path to a training file or .npz model file.
+    words: A list of words, each a string of space-separated symbols.
+    test_files: Paths to test files whose words should be scored as well.
+    host: The address of the service.
+    port: The port of the service.
+
+    returns: A list of result rows, with the header as the first row.
+    """
+    body = json.dumps({
+        'model': os.path.abspath(model),
+        'words': list(words),
+        'test_files': [os.path.abspath(path) for path in test_files]
+    }).encode('utf-8')
+    request = urllib.request.Request(
+        f'http://{host}:{port}/score', data=body,
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read())['error']) from None
+    return [result['header']] + result['rows']
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description = "Keep fitted n-gram models in memory and score words on request."
+    )
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run the service.')
+    serve_parser.add_argument(
+        '--max-models', type=int, default=DEFAULT_MAX_MODELS,
+        help='Number of fitted models to keep in memory'
+    )
+    serve_parser.add_argument(
+        '--max-scores', type=int, default=DEFAULT_MAX_SCORES,
+        help='Number of scored words each model remembers'
+    )
+    serve_parser.add_argument(
+        '--cache', action='store_true',
+        help='Read training files through packed sidecar files'
+    )
+
+    score_parser = subparsers.add_parser(
+        'score', help='Score words with a running service.'
+    )
+    score_parser.add_argument(
+        'model', type=str, help='Path to a training file or .npz model file'
+    )
+    score_parser.add_argument(
+        'words', type=str, nargs='*',
+        help='Words to score, each as one argument of space-separated symbols'
+    )
+    score_parser.add_argument(
+        '--test-file', type=str, action='append', default=[],
+        help='Test file whose words should be scored as well'
+    )
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(
+            args.host, args.port, args.max_models, args.cache,
+            args.max_scores
+        )
+    else:
+        rows = request_scores(
+            args.model, args.words, args.test_file, args.host, args.port
+        )
+        csv.writer(sys.stdout).writerows(rows)
@@ -0,0 +1,142 @@
+import atexit
+
+import numpy as np
+
+import ngram_calculator
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Arrays of a PackedCorpus that are published in shared memory
+CORPUS_ARRAYS = ['codes', 'offsets', 'freqs']
+
+class SharedCorpora:
+    """
+    Read-only corpora published once by a parent process so that pool
+    workers can use them without reading, parsing or copying them again.
+    The code, offset and frequency arrays of each corpus are placed in
+    shared memory blocks, and workers map the same blocks into their own
+    address space. The symbol tables and words are small, so they travel
+    with the description of the blocks.
+
+    Where shared memory is not available, or a block can't be created, the
+    arrays are carried in the description itself, so each worker gets its
+    own copy once, when it starts, rather than once per task.
+
+    corpora: A dictionary mapping names (such as the paths of the stimulus
+    files) to PackedCorpus objects.
+    """
+    def __init__(self, corpora):
+        self._blocks = []
+        self.spec = {}
+        try:
+            for name, corpus in corpora.items():
+                self.spec[name] = self._publish(corpus)
+        except BaseException:
+            self.close()
+            raise
+        # Don't leave blocks behind if the parent exits without closing
+        atexit.register(self.close)
+
+    def _publish(self, corpus):
+        """
+        Describes one corpus, copying its arrays into shared memory blocks
+        where possible.
+        """
+        arrays = {}
+        for array_name in CORPUS_ARRAYS:
+            array = np.ascontiguousarray(getattr(corpus, array_name))
+            arrays[array_name] = self._share(array)
+        return {
+            'symbols': corpus.inventory.symbols,
+            'words': corpus.words(),
+            'arrays': arrays
+        }
+
+    def _share(self, array):
+        """
+        Copies an array into a new shared memory block and returns how to
+        find it, or returns the array itself if shared memory can't be used.
+        """
+        if shared_memory is None or array.nbytes == 0:
+            return array
+        try:
+            block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        except OSError:
+            return array
+        self._blocks.append(block)
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+        return (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """
+        Releases the shared memory blocks. Workers that are still attached
+        keep their mappings until they exit.
+
+        returns: None
+        """
+        while self._blocks:
+            block = self._blocks.pop()
+            block.close()
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# The corpora a worker attached to in attach_corpora, by name
+_attached = {}
+# Blocks kept open for the lifetime of the worker
+_attached_blocks = []
+
+def attach_corpora(spec):
+    """
+    Attaches to corpora published with SharedCorpora. Meant to be used as
+    the initializer of a process pool, with the spec of a SharedCorpora as
+    its argument; works with any start method.
+
+    spec: The spec attribute of a SharedCorpora.
+
+    returns: None
+    """
+    for name, description in spec.items():
+        arrays = {
+            array_name: _attach(shared)
+            for array_name, shared in description['arrays'].items()
+        }
+        _attached[name] = ngram_calculator.PackedCorpus(
+            ngram_calculator.SoundInventory(description['symbols']),
+            arrays['codes'], arrays['offsets'], arrays['freqs'],
+            description['words']
+        )
+
+def attached_corpus(name, default=None):
+    """
+    Returns a corpus this worker attached to, or default if there is none
+    with that name.
+    """
+    return _attached.get(name, default)
+
+def _attach(shared):
+    """
+    Returns a read-only view of a shared array, or the array itself if it
+    was carried in the spec.
+    """
+    if isinstance(shared, np.ndarray):
+        array = shared
+    else:
+        block_name, shape, dtype = shared
+        # Pool workers share the resource tracker of the process that
+        #   published the block, so attaching doesn't change who unlinks it
+        block = shared_memory.SharedMemory(name=block_name)
+        _attached_blocks.append(block)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
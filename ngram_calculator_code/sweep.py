@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ngram_calculator
+import results_store
+import shared_corpora
+import timing_trace
+
+# Settings and plumbing shared by the sweeps of run_ngramcalc.py and
+#   incremental_pipeline.py
+
+# If set, every run is appended to one partitioned results store here
+#   (see results_store.py) instead of being written to its own CSV
+# results_store_root = "../ScoredLists/results_store"
+results_store_root = None
+
+# If set, every worker traces the time, CPU time and memory use of each stage
+#   of each run to this JSON lines file (see timing_trace.py), and a summary
+#   table of the stages is printed at the end
+# trace_path = "../ScoredLists/timing_trace.jsonl"
+trace_path = None
+
+# Test stimuli
+bigram_contrast = "../infant_stim_formatted/infant_2c_stimuli_bigram_contrast.txt"
+both_contrast   = "../infant_stim_formatted/infant_2b_stimuli_both_contrast.txt"
+unigram_contrast= "../infant_stim_formatted/infant_2a_stimuli_unigram_contrast.txt"
+contrasts = {
+    "bigram_contrast": bigram_contrast,
+    "both_contrast": both_contrast,
+    "unigram_contrast": unigram_contrast
+}
+
+def save_results(results, header, out_path, keys):
+    """
+    Writes the results of one run to its own CSV, or appends them to the
+    results store if results_store_root is set.
+
+    results: The rows of the run, from ngram_calculator.evaluate_many.
+    header: The column names of the rows.
+    out_path: The CSV to write the rows to.
+    keys: The partition keys of the run in the results store.
+
+    returns: The path the results were written to.
+    """
+    if results_store_root is None:
+        ngram_calculator.write_results(results, out_path, header)
+        return out_path
+    # Each worker appends its own part file, so no locking is needed
+    return results_store.append(results_store_root, keys, results, header)
+
+def timed_run(label, fn, *args):
+    """
+    Times one run inside a worker, catching its exception so the rest of
+    the worker's runs aren't lost.
+
+    label: What the run is called in the progress lines.
+    fn: The function to run.
+    args: The arguments of fn.
+
+    returns: A label, result, seconds triple, where the result is the output
+    of fn or the exception it raised.
+    """
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        result = e
+    return label, result, time.perf_counter() - start
+
+def run(worker, tasks, stimulus_paths, max_workers=None, noun="runs"):
+    """
+    Runs a sweep on a process pool and prints its progress and timings.
+
+    The stimulus files are read once and shared with every worker through
+    shared memory (see shared_corpora.py). Each worker returns a list of
+    timed_run triples, which are printed as they complete. Once every worker
+    is done the results store is compacted and the trace summarized.
+
+    worker: The function run in the pool.
+    tasks: A dictionary mapping the name of each task, used if the whole
+    task fails, to the arguments of worker.
+    stimulus_paths: The stimulus files to share with the workers.
+    max_workers: The number of worker processes (None = one per CPU).
+    noun: What the runs are called in the summary line.
+
+    returns: A list of seconds, label pairs, one for each successful run.
+    """
+    # Start a fresh trace before the workers are started, so they trace to it too
+    if trace_path is not None:
+        open(trace_path, 'w').close()
+        timing_trace.enable(trace_path)
+
+    # Read each stimulus file once and share it with every worker through shared
+    #   memory, instead of each task reading it from disk again
+    shared_stimuli = shared_corpora.SharedCorpora({path: ngram_calculator.read_corpus(path) for path in stimulus_paths})
+
+    sweep_start = time.perf_counter()
+    run_times = []
+    with shared_stimuli, ProcessPoolExecutor(max_workers=max_workers, initializer=shared_corpora.attach_corpora, initargs=(shared_stimuli.spec,)) as executor:
+        futures = {executor.submit(worker, *args): name for name, args in tasks.items()}
+
+        for future in as_completed(futures):
+            try:
+                timings = future.result()
+            except Exception as e:
+                print(f"Error on {futures[future]}: {e}")
+                continue
+            for label, result, seconds in timings:
+                if isinstance(result, Exception):
+                    print(f"Error on {label} ({seconds:.2f}s): {result}")
+                else:
+                    run_times.append((seconds, label))
+                    print(f"Done ({seconds:.2f}s): {result}")
+
+    sweep_time = time.perf_counter() - sweep_start
+    if run_times:
+        total_time = sum(seconds for seconds, _ in run_times)
+        print(f"Ran {len(run_times)} {noun} in {sweep_time:.2f}s "
+              f"({total_time:.2f}s across workers, {total_time / len(run_times):.2f}s each).")
+        for seconds, label in sorted(run_times, reverse=True)[:5]:
+            print(f"  slowest: {seconds:.2f}s {label}")
+
+    # Merge the part files of each partition once every worker is done
+    if results_store_root is not None:
+        results_store.compact(results_store_root)
+
+    if trace_path is not None:
+        print(f"Time by stage across all runs (trace in {trace_path}):")
+        print(timing_trace.format_summary(timing_trace.summarize(timing_trace.read_trace(trace_path))))
+
+    return run_times
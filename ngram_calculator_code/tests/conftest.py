@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top-level modules, so the tests run with
+#   the script directory on the path, as the scripts themselves do
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+@pytest.fixture
+def write_corpus(tmp_path):
+    """
+    Writes word-frequency lines to a file in the test's temporary directory.
+
+    returns: A function taking a file name and a list of word, frequency
+    pairs, where each word is a string of space-separated sounds, and
+    returning the path of the file.
+    """
+    def write(name, token_freqs):
+        path = tmp_path / name
+        path.write_text(''.join(
+            f"{word},{freq}\n" for word, freq in token_freqs
+        ))
+        return str(path)
+    return write
@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+import pytest
+
+import ngram_calculator
+import ngram_reference
+
+TRAIN = [('a b', 2), ('b a c', 3), ('c a', 1)]
+MORE_TRAIN = [('a d d a', 4), ('c', 2)]
+# 'a b c a b c' is twice as long as the longest training word
+TEST = [('a b c a b c', 1), ('a b c', 1), ('c', 1), ('z a', 1)]
+
+def tokens(token_freqs):
+    return [(word.split(' '), freq) for word, freq in token_freqs]
+
+def counts_of(token_freqs, max_order=3):
+    corpus = ngram_calculator.pack_tokens(tokens(token_freqs))
+    return ngram_calculator.count_ngrams(corpus, max_order)
+
+def scores(counts):
+    corpus = ngram_calculator.pack_tokens(
+        tokens(TEST + MORE_TRAIN), counts.inventory
+    )
+    return ngram_calculator.score_corpus(corpus, counts.fitted_models())
+
+def assert_same_scores(expected, actual):
+    """
+    Checks that two sets of counts score the test words identically, except
+    for the last bits of the columns weighted by token frequency.
+    """
+    header = ngram_calculator.build_header(expected.max_order)
+    assert ngram_reference.compare_results(
+        header, scores(expected), scores(actual)
+    ) == []
+
+@pytest.mark.parametrize('backend', sorted(ngram_reference.BACKENDS))
+@pytest.mark.parametrize('max_order', [2, 3])
+def test_long_test_words_match_reference(write_corpus, backend, max_order):
+    train = write_corpus('train.txt', TRAIN)
+    test = write_corpus('test.txt', TEST)
+    mismatches = ngram_reference.check(
+        train, [test], backend, max_order=max_order
+    )
+    assert mismatches == {test: []}
+
+def test_long_test_words_add_nothing_past_training_positions(write_corpus):
+    header, (rows,) = ngram_calculator.evaluate_many(
+        write_corpus('train.txt', TRAIN), [write_corpus('test.txt', TEST)]
+    )
+    long_word, prefix = rows[0], rows[1]
+    for column in ['pos_uni_score', 'pos_bi_score']:
+        idx = header.index(column)
+        assert long_word[idx] == prefix[idx]
+
+def test_empty_test_file(write_corpus, tmp_path):
+    train = write_corpus('train.txt', TRAIN)
+    empty = write_corpus('empty.txt', [])
+    header, results = ngram_calculator.evaluate_many(train, [empty])
+    assert header == ngram_calculator.HEADER
+    assert results == [[]]
+
+    out = tmp_path / 'out.csv'
+    ngram_calculator.run(train, empty, str(out))
+    assert out.read_text().splitlines() == [','.join(ngram_calculator.HEADER)]
+
+def test_empty_training_file(write_corpus, tmp_path):
+    empty = write_corpus('empty.txt', [])
+    test = write_corpus('test.txt', TEST)
+    header, (rows,) = ngram_calculator.evaluate_many(empty, [test])
+    assert [row[0] for row in rows] == [word for word, _ in TEST]
+    for row in rows:
+        for column, value in zip(header, row):
+            if column.startswith('pos_'):
+                # Nothing is attested, so every positional score is the
+                #   integer 1 of an unattested word
+                assert value == 1 and isinstance(value, int)
+            elif column.endswith('_prob'):
+                assert value == -math.inf
+
+    out = tmp_path / 'out.csv'
+    ngram_calculator.run(empty, empty, str(out))
+    assert out.read_text().splitlines() == [','.join(ngram_calculator.HEADER)]
+
+def test_merge_matches_counting_together():
+    together = counts_of(TRAIN + MORE_TRAIN)
+    merged = counts_of(TRAIN) + counts_of(MORE_TRAIN)
+    assert merged.inventory == together.inventory
+    assert merged.num_positions == together.num_positions
+    assert_same_scores(together, merged)
+
+    partial = ngram_calculator.NgramCounts.empty(max_order=3)
+    partial.partial_fit(tokens(TRAIN)).partial_fit(tokens(MORE_TRAIN))
+    assert_same_scores(together, partial)
+
+def test_subtract_undoes_merge():
+    counts = counts_of(TRAIN)
+    restored = (counts + counts_of(MORE_TRAIN)) - counts_of(MORE_TRAIN)
+    # The sound 'd' and the positions of the longer words are dropped again
+    assert restored.inventory == counts.inventory
+    assert restored.num_positions == counts.num_positions
+    assert_same_scores(counts, restored)
+
+def test_subtract_uncounted_tokens():
+    with pytest.raises(ValueError):
+        counts_of(TRAIN) - counts_of(MORE_TRAIN)
+
+def test_combine_different_orders():
+    with pytest.raises(ValueError):
+        counts_of(TRAIN, max_order=2) + counts_of(MORE_TRAIN, max_order=3)
+
+def test_save_and_load_higher_orders(write_corpus, tmp_path):
+    train = write_corpus('train.txt', TRAIN + MORE_TRAIN)
+    path = str(tmp_path / 'model.npz')
+    counts = ngram_calculator.fit(train, save_to=path, max_order=3)
+    loaded, _ = ngram_calculator.load_model(path)
+
+    assert loaded.max_order == 3
+    assert loaded.inventory == counts.inventory
+    for name in ['unigrams', 'bigrams', 'pos_unigrams', 'pos_bigrams']:
+        np.testing.assert_array_equal(
+            getattr(loaded, name), getattr(counts, name)
+        )
+    for name in ['keys', 'counts', 'pos_keys', 'pos_counts']:
+        np.testing.assert_array_equal(
+            getattr(loaded.higher_orders[3], name),
+            getattr(counts.higher_orders[3], name)
+        )
+
+    # The loaded counts are the saved ones, so they score bit for bit the same
+    header = ngram_calculator.build_header(3)
+    assert ngram_reference.compare_results(
+        header, scores(counts), scores(loaded), weighted_rtol=0
+    ) == []
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import ngram_calculator
+import results_store
+
+TRAIN = [('a b', 2), ('b a c', 3), ('c a', 1)]
+TEST = [('a b c', 1), ('c', 1), ('z a', 1)]
+
+@pytest.fixture(params=['npz', 'parquet', 'arrow'])
+def format(request):
+    if request.param != 'npz':
+        pytest.importorskip('pyarrow')
+    return request.param
+
+@pytest.fixture
+def store(write_corpus, tmp_path, format):
+    """
+    A store with runs of max order 2 and 3 in the same partition, so its part
+    files have different columns.
+    """
+    train = write_corpus('train.txt', TRAIN)
+    test = write_corpus('test.txt', TEST)
+    root = str(tmp_path / 'store')
+    for sample, max_order in [(1, 2), (2, 3)]:
+        header, (results,) = ngram_calculator.evaluate_many(
+            train, [test], max_order=max_order
+        )
+        for contrast in ['bigram_contrast', 'unigram_contrast']:
+            keys = {'segmenter': 'Seg', 'level': 'standard',
+                    'sample': sample, 'contrast': contrast}
+            results_store.append(root, keys, results, header, format)
+    return root
+
+def test_read_mixed_orders(store):
+    table = results_store.read(store, columns=['uni_prob', 'tri_prob'])
+    assert set(table) == set(results_store.KEYS) | {'uni_prob', 'tri_prob'}
+    assert len(table['sample']) == 4 * len(TEST)
+
+    order2 = table['sample'] == '1'
+    assert np.isnan(table['tri_prob'][order2]).all()
+    assert not np.isnan(table['tri_prob'][~order2]).any()
+    assert not np.isnan(table['uni_prob']).any()
+
+def test_read_filters_rows(store):
+    table = results_store.read(
+        store, filters={'sample': 2, 'contrast': 'unigram_contrast'},
+        columns=['tri_prob', 'quad_prob']
+    )
+    assert list(table['sample']) == ['2'] * len(TEST)
+    assert list(table['contrast']) == ['unigram_contrast'] * len(TEST)
+    assert not np.isnan(table['tri_prob']).any()
+    # No part has fourth-order scores
+    assert np.isnan(table['quad_prob']).all()
+
+def test_read_mixed_orders_after_compact(store, format):
+    results_store.compact(store, format)
+    table = results_store.read(store, filters={'sample': [1, 2]})
+    assert len(table['sample']) == 4 * len(TEST)
+    assert np.isnan(table['tri_prob'][table['sample'] == '1']).all()
+    assert not np.isnan(table['tri_prob'][table['sample'] == '2']).any()
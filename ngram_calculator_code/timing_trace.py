@@ -0,0 +1,201 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variable holding the path of the trace file. It is set by
+# enable, so worker processes started afterwards trace to the same file
+# whatever their start method.
+TRACE_ENV = 'NGRAM_TRACE'
+# Columns of the summary table, after the stage and model
+SUMMARY_COLUMNS = [
+    'calls', 'wall_s', 'cpu_s', 'tokens', 'rss_delta_mb',
+    'process_peak_rss_mb'
+]
+
+_path = os.environ.get(TRACE_ENV) or None
+
+def enable(path):
+    """
+    Starts tracing every stage to a JSON lines file, in this process and in
+    any process it starts afterwards.
+
+    path: The path of the trace file. Records are appended to it.
+
+    returns: None
+    """
+    global _path
+    _path = path
+    os.environ[TRACE_ENV] = path
+
+def disable():
+    """
+    Stops tracing.
+
+    returns: None
+    """
+    global _path
+    _path = None
+    os.environ.pop(TRACE_ENV, None)
+
+def enabled():
+    """
+    Returns True if stages are being traced.
+    """
+    return _path is not None
+
+def stage(name, **fields):
+    """
+    Times a stage of the work. When tracing is off this is an empty context
+    manager. When it is on, a record with the wall time and CPU time of the
+    stage, the resident set size of the process when it ended and how much
+    that changed during the stage, and the peak RSS of the process so far is
+    appended to the trace file when the stage ends.
+
+    name: The name of the stage (e.g. read, count, fit, score, write).
+    fields: JSON-serializable fields to add to the record, such as the model
+    type or the number of tokens.
+
+    returns: A context manager that gives the record as a dictionary, so
+    fields that are only known inside the stage can be added to it.
+    """
+    if _path is None:
+        return contextlib.nullcontext({})
+    return _Stage(name, fields)
+
+class _Stage:
+    """
+    Measures one traced stage.
+    """
+    def __init__(self, name, fields):
+        self.record = dict({'stage': name}, **fields)
+
+    def __enter__(self):
+        self.rss = rss_mb()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record['wall_s'] = time.perf_counter() - self.wall
+        self.record['cpu_s'] = time.process_time() - self.cpu
+        rss = rss_mb()
+        self.record['rss_mb'] = rss
+        self.record['rss_delta_mb'] = (
+            None if rss is None or self.rss is None else rss - self.rss
+        )
+        self.record['process_peak_rss_mb'] = process_peak_rss_mb()
+        self.record['pid'] = os.getpid()
+        path = _path
+        if path is not None:
+            # One write per record in append mode, so the lines of processes
+            #   tracing to the same file don't interleave
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.record) + '\n')
+        return False
+
+def rss_mb():
+    """
+    Returns the current resident set size of this process in MiB, or None
+    where it can't be measured. It is read from /proc, so only on Linux.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+def process_peak_rss_mb():
+    """
+    Returns the peak resident set size of this process since it started in
+    MiB, or None where it can't be measured. This is the same for every
+    stage after the one that used the most memory, so it shows how much a
+    process needed overall rather than what any one stage used.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+    return peak / 1024
+
+def read_trace(path):
+    """
+    Reads the records of a trace file.
+
+    path: The path of the trace file.
+
+    returns: A list of dictionaries.
+    """
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(records):
+    """
+    Aggregates trace records by stage and model type.
+
+    records: A list of trace records.
+
+    returns: A list of rows, each the stage, the model type (or '') and the
+    values of SUMMARY_COLUMNS, slowest stage first. Wall time, CPU time and
+    tokens are summed over calls; the RSS change is the largest growth of
+    any one call, and the process peak RSS the largest seen.
+    """
+    totals = {}
+    for record in records:
+        key = (record['stage'], record.get('model', ''))
+        total = totals.setdefault(key, dict.fromkeys(SUMMARY_COLUMNS, 0))
+        total['calls'] += 1
+        total['wall_s'] += record['wall_s']
+        total['cpu_s'] += record['cpu_s']
+        total['tokens'] += record.get('tokens', 0)
+        for column in ['rss_delta_mb', 'process_peak_rss_mb']:
+            # The float comes first so a tie with the initial 0 keeps it
+            total[column] = max(
+                float(record.get(column) or 0), total[column]
+            )
+
+    rows = [
+        [stage_name, model] + [total[column] for column in SUMMARY_COLUMNS]
+        for (stage_name, model), total in totals.items()
+    ]
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+def format_summary(rows):
+    """
+    Lays out the rows of summarize as a text table.
+    """
+    header = ['stage', 'model'] + SUMMARY_COLUMNS
+    cells = [header] + [
+        [
+            f'{value:.3f}' if isinstance(value, float) else str(value)
+            for value in row
+        ]
+        for row in rows
+    ]
+    widths = [max(len(row[idx]) for row in cells) for idx in range(len(header))]
+    return '\n'.join(
+        '  '.join(
+            cell.ljust(width) for cell, width in zip(row, widths)
+        ).rstrip()
+        for row in cells
+    )
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description = "Summarize a timing trace written with --trace."
+    )
+    parser.add_argument('trace_file', type=str, help='Path to the trace file')
+    args = parser.parse_args()
+
+    print(format_summary(summarize(read_trace(args.trace_file))))
@@ -2,6 +2,11 @@ import random
 import re
 import os
 import math 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from format_for_ngramcalc import format_token_counts
 
 # def disjoint_random_samples(corpus_size, k, slice_factor, seed=None):
 #     """
@@ -37,7 +42,7 @@ import math
 ## version 2. no longer requires disjoint set across samples. This allows for
 ## fractional slice facros such as 1.5 to extend the set of unsegmented lines
 ## beyond just 1/2 of the corpus
-def disjoint_random_samples(corpus_size, k, slice_factor, seed=None):
+def disjoint_random_samples(corpus_size, k, slice_factor, seed=None, mode="legacy"):
     """
     Return k samples of size floor(n / slice_factor) indices from a corpus of size n.
     - slice_factor can be float (> 1.0). E.g., 1.5 => samples of ~2/3 of the corpus.
@@ -49,7 +54,47 @@ def disjoint_random_samples(corpus_size, k, slice_factor, seed=None):
     :param k: int, number of samples requested
     :param slice_factor: float (>1), denominator for each sample's size
     :param seed: int or None, random seed for reproducibility
-    :return: List[List[int]] -- k lists of indices
+    :param mode: "legacy" draws every split from one random.Random(seed) stream,
+                 as incremental_corpora_out_v2 was drawn; "keyed" draws each
+                 sample on its own with sample_indices, so a sample doesn't
+                 depend on k or on the samples before it
+    :return: np.ndarray of shape (k, sample_size) -- one row of indices per sample
+    """
+    sample_size, per_split_capacity = sample_layout(corpus_size, slice_factor)
+
+    if mode == "keyed":
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        out = np.empty((k, sample_size), dtype=np.int64)
+        for i in range(k):
+            out[i] = sample_indices(corpus_size, slice_factor, i, seed)
+        return out
+    if mode != "legacy":
+        raise ValueError(f"Unknown sampling mode {mode!r}.")
+
+    # The shuffles stay on random.Random so a seed gives the same samples as
+    # before; each split is then cut into its blocks in one reshape
+    rng = random.Random(seed)
+    out = np.empty((k, sample_size), dtype=np.int64)
+    done = 0
+    while done < k:
+        # New split: shuffle the entire index set
+        all_indices = list(range(corpus_size))
+        rng.shuffle(all_indices)
+
+        # Create up to per_split_capacity disjoint blocks in this split
+        take = min(per_split_capacity, k - done)
+        blocks = np.array(all_indices[:take * sample_size], dtype=np.int64)
+        out[done:done + take] = blocks.reshape(take, sample_size)
+        done += take
+
+    return out
+
+
+def sample_layout(corpus_size, slice_factor):
+    """
+    Return (sample_size, per_split_capacity): floor(n / slice_factor), at
+    least 1, and the number of disjoint samples of that size in one split.
     """
     if corpus_size <= 0:
         raise ValueError("corpus_size must be positive.")
@@ -68,24 +113,121 @@ def disjoint_random_samples(corpus_size, k, slice_factor, seed=None):
 
     # Max number of disjoint samples you can pack in a single split
     per_split_capacity = max(1, corpus_size // sample_size)
+    return sample_size, per_split_capacity
 
-    rng = random.Random(seed)
-    out = []
-    while len(out) < k:
-        # New split: shuffle the entire index set
-        all_indices = list(range(corpus_size))
-        rng.shuffle(all_indices)
 
-        # Create up to per_split_capacity disjoint blocks in this split
-        take = min(per_split_capacity, k - len(out))
-        for j in range(take):
-            start = j * sample_size
-            end = start + sample_size  # end is safe: per_split_capacity * sample_size <= corpus_size
-            out.append(all_indices[start:end])
+# Rounds of the Feistel network behind keyed sampling
+FEISTEL_ROUNDS = 4
+
+
+def sample_indices(corpus_size, slice_factor, sample, seed):
+    """
+    Return the indices of one sample of a level in keyed mode, in
+    O(sample_size) and without drawing any other sample.
+
+    Sample i is block i % per_split_capacity of split i // per_split_capacity,
+    as in legacy mode, but each split is a random permutation of the corpus
+    keyed by (seed, slice_factor, split) that can be evaluated at any
+    position, so only the positions of the block are computed. The samples
+    of a split are disjoint, and changing k or adding levels leaves every
+    other sample as it was.
+
+    :param corpus_size: int, total size of the corpus (n)
+    :param slice_factor: float (>1), denominator for each sample's size
+    :param sample: int, number of the sample within its level
+    :param seed: int, random seed
+    :return: np.ndarray of the sample's indices
+    """
+    sample_size, per_split_capacity = sample_layout(corpus_size, slice_factor)
+    split, block = divmod(sample, per_split_capacity)
+
+    # The level is keyed by the bits of its float value, so 2 and 2.0 are
+    # the same level
+    level_bits = int(np.float64(slice_factor).view(np.uint64))
+    keys = np.random.SeedSequence([seed, level_bits, split]).generate_state(
+        FEISTEL_ROUNDS, np.uint64
+    )
+
+    positions = np.arange(block * sample_size, (block + 1) * sample_size, dtype=np.uint64)
+    return _permute(positions, corpus_size, keys).astype(np.int64)
 
+
+def _permute(positions, corpus_size, keys):
+    """
+    Map positions through a keyed permutation of range(corpus_size): a
+    Feistel network over the smallest even number of bits that covers the
+    corpus, applied again to any value that lands past its end (cycle
+    walking), which keeps it a permutation of range(corpus_size).
+    """
+    half_bits = max(1, ((corpus_size - 1).bit_length() + 1) // 2)
+    out = _feistel(positions, half_bits, keys)
+    outside = out >= corpus_size
+    while outside.any():
+        out[outside] = _feistel(out[outside], half_bits, keys)
+        outside = out >= corpus_size
     return out
 
 
+def _feistel(values, half_bits, keys):
+    """
+    Apply one round per key of a balanced Feistel network to uint64 values
+    of 2 * half_bits bits.
+    """
+    shift = np.uint64(half_bits)
+    mask = np.uint64((1 << half_bits) - 1)
+    hi = values >> shift
+    lo = values & mask
+    for key in keys:
+        hi, lo = lo, hi ^ (_mix(lo ^ key) & mask)
+    return (hi << shift) | lo
+
+
+def _mix(x):
+    """
+    The splitmix64 finalizer, a cheap hash of uint64 values.
+    """
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def sample_masks(corpus_size, samples):
+    """
+    Turn sample index arrays into line membership masks.
+
+    :param corpus_size: int, total size of the corpus (n)
+    :param samples: (k, sample_size) array of indices, as from disjoint_random_samples
+    :return: np.ndarray of bools, shape (k, n) -- True where a line is in the sample
+    """
+    samples = np.asarray(samples)
+    masks = np.zeros((len(samples), corpus_size), dtype=bool)
+    masks[np.arange(len(samples))[:, None], samples] = True
+    return masks
+
+
+def index_words(corpus):
+    """
+    Split every line of a corpus into words once, so samples can be typed
+    with array operations instead of re-splitting lines.
+
+    :param corpus: list of lines
+    :return: (words, word_ids, token_lines) -- the distinct words in
+             first-seen order, the id of every token in corpus order, and
+             the line each token is on
+    """
+    ids = {}
+    word_ids = []
+    line_lengths = []
+    for line in corpus:
+        tokens = line.split()
+        line_lengths.append(len(tokens))
+        word_ids.extend(ids.setdefault(word, len(ids)) for word in tokens)
+    token_lines = np.repeat(np.arange(len(corpus)), line_lengths)
+    return list(ids), np.array(word_ids, dtype=np.int64), token_lines
+
+
 # def process_corpus(corpus, indices_segmented):
 #     """
 #     indices_segmented determine which lines should be left unsegmented.
@@ -110,22 +252,29 @@ def disjoint_random_samples(corpus_size, k, slice_factor, seed=None):
 #     return processed_corpus
 
 # version of process_corpus() that only includes segmented lines 
-def process_corpus(corpus, indices_segmented):
+def process_corpus(indexed_corpus, unsegmented_mask):
     """
-    indices_segmented determine which lines should be left unsegmented.
-    Every other line is segmented and the words are extracted.
+    unsegmented_mask determines which lines should be left unsegmented.
+    Every other line is segmented and the words are extracted, counting how
+    often each one occurs.
+
+    :param indexed_corpus: (words, word_ids, token_lines) from index_words
+    :param unsegmented_mask: bool array, True for the lines of the sample
+    Returns a list of (formatted word, token count) pairs, in the order the
+    words are first seen.
     """
-    processed_corpus = []
-    seen = set()
-    for i, line in enumerate(corpus):
-        if i not in indices_segmented:
-            words = line.split()
-            for word in words:
-                formatted = ' '.join(word)
-                if formatted not in seen:
-                    seen.add(formatted)
-                    processed_corpus.append(formatted)
-    return processed_corpus
+    words, word_ids, token_lines = indexed_corpus
+    # The mask is sized to the reference corpus; lines past its end are
+    # never in the sample
+    num_lines = int(token_lines[-1]) + 1 if len(token_lines) else 0
+    in_sample = np.zeros(max(num_lines, len(unsegmented_mask)), dtype=bool)
+    in_sample[:len(unsegmented_mask)] = unsegmented_mask
+    kept = word_ids[~in_sample[token_lines]]
+    counts = np.bincount(kept, minlength=len(words))
+    # np.unique gives each word's first position among the kept tokens
+    present, first_seen = np.unique(kept, return_index=True)
+    ordered = present[np.argsort(first_seen)]
+    return [(' '.join(words[w]), int(counts[w])) for w in ordered]
 
 # -----------------------
 # Setup
@@ -140,6 +289,9 @@ levels = [1.01625]
 # samples_per_level = {64: 8, 32: 8, 16: 8, 8: 8, 4: 8, 2: 8, 1.75: 8, 1.5:8, 1.25:8, 1.1:8, 1.05:8, 1.025:8, 1.02:8, 1.0175:8, 1.01625:8, 1.015:8, 1.01:8}
 samples_per_level = {1.01625:8}
 random_seed = 42
+# "legacy" reproduces the samples of incremental_corpora_out_v2; "keyed" draws
+# each sample on its own (see sample_indices)
+sample_mode = "legacy"
 
 # Explicit list of folders you want to process
 target_folders = [
@@ -162,54 +314,115 @@ target_folders = [
 # -----------------------
 # Step 1. Reference corpus for shared samples
 # -----------------------
-first_valid = None
-for folder in target_folders:
-    candidate = os.path.join(input_root, folder, "1", "Model.txt")
-    if os.path.isfile(candidate):
-        first_valid = candidate
-        break
+def load_corpus(model_path):
+    """
+    Read the non-empty lines of a segmenter's Model.txt.
+    """
+    with open(model_path, "r", encoding="utf-8") as f:
+        return [line.rstrip() for line in f if line.strip() != ""]
 
-if first_valid is None:
-    raise RuntimeError("No reference corpus found in target_folders")
 
-with open(first_valid, "r", encoding="utf-8") as f:
-    ref_lines = [line.rstrip() for line in f if line.strip() != ""]
+def shared_samples(input_root, target_folders, levels, samples_per_level, seed, mode="legacy"):
+    """
+    Draw the samples shared by every segmenter, over the lines of the first
+    folder in target_folders that has a 1/Model.txt. mode is the sampling
+    mode of disjoint_random_samples.
+
+    :return: (corpus_size, dict mapping level -> (k, sample_size) index array)
+    """
+    first_valid = None
+    for folder in target_folders:
+        candidate = os.path.join(input_root, folder, "1", "Model.txt")
+        if os.path.isfile(candidate):
+            first_valid = candidate
+            break
+
+    if first_valid is None:
+        raise RuntimeError("No reference corpus found in target_folders")
 
-corpus_size = len(ref_lines)
+    corpus_size = len(load_corpus(first_valid))
 
-# Generate shared disjoint samples
-all_samples_by_level = {
-    level: disjoint_random_samples(corpus_size, samples_per_level[level], level, seed=random_seed)
-    for level in levels
-}
+    all_samples_by_level = {
+        level: disjoint_random_samples(corpus_size, samples_per_level[level], level, seed=seed, mode=mode)
+        for level in levels
+    }
+    return corpus_size, all_samples_by_level
 
 
 # -----------------------
 # Step 2. Process each corpus
 # -----------------------
-for folder in target_folders:
-    model_path = os.path.join(input_root, folder, "1", "Model.txt")
-    if not os.path.isfile(model_path):
-        print(f"Skipping {folder} (no Model.txt in 1/)")
-        continue
+def split_folder(input_root, output_root, folder, corpus_size, samples_by_level):
+    """
+    Write the samples of every level of one folder, reading and indexing its
+    Model.txt once for all of them.
 
-    print(f"Processing {folder}")
-    with open(model_path, "r", encoding="utf-8") as f:
-        corpus = [line.rstrip() for line in f if line.strip() != ""]
+    :param samples_by_level: dict level -> (k, sample_size) index array, as
+                             from shared_samples
+    :return: list of the paths written, in level order
+    """
+    model_path = os.path.join(input_root, folder, "1", "Model.txt")
+    indexed_corpus = index_words(load_corpus(model_path))
 
-    for level in levels:
-        level_samples = all_samples_by_level[level]
-        for i, indices in enumerate(level_samples):
-            processed = process_corpus(corpus, indices)
+    saved = []
+    for level, samples in samples_by_level.items():
+        output_dir = os.path.join(output_root, folder, str(level))
+        os.makedirs(output_dir, exist_ok=True)
 
-            output_dir = os.path.join(output_root, folder, str(level))
-            os.makedirs(output_dir, exist_ok=True)
+        for i, mask in enumerate(sample_masks(corpus_size, samples)):
+            processed = process_corpus(indexed_corpus, mask)
 
             output_path = os.path.join(output_dir, f"sample{i}.txt")
             with open(output_path, "w", encoding="utf-8") as f_out:
-                f_out.write("\n".join(processed))
+                f_out.write(format_token_counts(processed))
+            saved.append(output_path)
+    return saved
+
 
-            print(f"  Saved {output_path}")
+def split_corpora(input_root, output_root, target_folders, levels, samples_per_level, seed, max_workers=None, mode="legacy"):
+    """
+    Write the samples of every level of every folder. The samples are drawn
+    once and every folder is written by a process pool; each sample file only
+    depends on its own folder and level, so the files are the same as a
+    serial run gives.
+
+    :param max_workers: int or None, size of the pool (None = one per CPU,
+                        1 = run serially in this process)
+    :param mode: the sampling mode of disjoint_random_samples
+    :return: list of the paths written, in folder and level order
+    """
+    corpus_size, all_samples_by_level = shared_samples(
+        input_root, target_folders, levels, samples_per_level, seed, mode
+    )
+
+    folders = []
+    for folder in target_folders:
+        model_path = os.path.join(input_root, folder, "1", "Model.txt")
+        if not os.path.isfile(model_path):
+            print(f"Skipping {folder} (no Model.txt in 1/)")
+            continue
+        folders.append(folder)
+
+    saved = [None] * len(folders)
+    if max_workers == 1:
+        for idx, folder in enumerate(folders):
+            saved[idx] = split_folder(input_root, output_root, folder, corpus_size, all_samples_by_level)
+            print(f"  Saved {folder}")
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(split_folder, input_root, output_root, folder, corpus_size, all_samples_by_level): idx
+                for idx, folder in enumerate(folders)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                saved[idx] = future.result()
+                print(f"  Saved {folders[idx]}")
+    return [path for paths in saved for path in paths]
+
+
+if __name__ == "__main__":
+    split_corpora(input_root, output_root, target_folders, levels, samples_per_level, random_seed, mode=sample_mode)
 
 
 